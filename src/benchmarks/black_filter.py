@@ -0,0 +1,101 @@
+"""
+Benchmark of the black tile filter: one `Filter.is_too_black` call per tile
+against a single `Filter.is_too_black_tiles` call over the whole image, on
+synthetic images.
+
+Usage (from the `src` directory):
+    uv run python -m benchmarks.black_filter --image_size 2000 --tiles_size 250
+"""
+
+import argparse
+import time
+
+import numpy as np
+from affine import Affine
+from astrovision.data import SatelliteImage
+from astrovision.data.utils import generate_tiles_borders
+
+from classes.filters.filter import Filter
+
+CRS = "EPSG:4471"
+
+
+def make_image(image_size: int, dtype: str, seed: int = 0) -> SatelliteImage:
+    """
+    Create a synthetic image with random pixels, black stripes and a nodata
+border covering the left 30% of the image, as on the edge of a scene.
+    """
+    rng = np.random.default_rng(seed)
+    max_value = np.iinfo(dtype).max
+    array = rng.integers(0, max_value, (3, image_size, image_size), dtype=dtype, endpoint=True)
+    # Black stripes covering about a third of the image
+    for start in rng.integers(0, image_size, 10):
+        array[:, start : start + image_size // 30] = 0
+    array[:, :, : int(0.3 * image_size)] = 0
+    return SatelliteImage(
+        array=array,
+        crs=CRS,
+        bounds=(0.0, 0.0, image_size * 0.5, image_size * 0.5),
+        transform=Affine(0.5, 0.0, 0.0, 0.0, -0.5, image_size * 0.5),
+    )
+
+
+def per_tile_filter(filter_: Filter, si: SatelliteImage, tiles_size: int, black_value_threshold: int) -> list:
+    """
+    Black filter as done before the batch API: split, then one call per tile.
+    """
+    return [
+        filter_.is_too_black(tile, black_value_threshold=black_value_threshold, black_area_threshold=0.5)
+        for tile in si.split(tiles_size)
+    ]
+
+
+def float_filter(si: SatelliteImage, tiles_size: int, black_value_threshold: int) -> list:
+    """
+    Float64 per-tile filter, as implemented before the integer grayscale.
+    """
+    verdicts = []
+    for tile in si.split(tiles_size):
+        gray_image = 0.2989 * tile.array[0] + 0.5870 * tile.array[1] + 0.1140 * tile.array[2]
+        verdicts.append(np.sum(gray_image < black_value_threshold) / np.prod(gray_image.shape) >= 0.5)
+    return verdicts
+
+
+def timeit(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Black tile filter benchmark")
+    parser.add_argument("--image_size", type=int, default=2000, help="Image side in pixels")
+    parser.add_argument("--tiles_size", type=int, default=250, help="Tile side in pixels")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs")
+    args = parser.parse_args()
+
+    filter_ = Filter()
+    indices = generate_tiles_borders(args.image_size, args.image_size, args.tiles_size)
+
+    for dtype, black_value_threshold in [("uint8", 25), ("uint16", 25 * 257)]:
+        si = make_image(args.image_size, dtype)
+
+        # Check that both paths keep the same tiles
+        batch = filter_.is_too_black_tiles(si, indices, black_value_threshold, 0.5)
+        assert batch == per_tile_filter(filter_, si, args.tiles_size, black_value_threshold)
+        assert batch == float_filter(si, args.tiles_size, black_value_threshold)
+        assert 0 < sum(batch) < len(batch), "The image should have black and non-black tiles"
+
+        float_ms = 1000 * sum(timeit(float_filter, si, args.tiles_size, black_value_threshold) for _ in range(args.repeat))
+        batch_ms = 1000 * sum(
+            timeit(filter_.is_too_black_tiles, si, indices, black_value_threshold, 0.5) for _ in range(args.repeat)
+        )
+        print(
+            f"{dtype}, {len(indices)} tiles of {args.tiles_size}px: "
+            f"float64 per tile {float_ms / args.repeat:.1f}ms, batch {batch_ms / args.repeat:.1f}ms "
+            f"({float_ms / batch_ms:.1f}x), {sum(batch)} black tiles"
+        )
+
+
+if __name__ == "__main__":
+    main()
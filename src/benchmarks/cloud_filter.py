@@ -0,0 +1,199 @@
+"""
+Benchmark of the cloud filter: the polygon round-trip of the former
+`Filter.create_mask_cloud` (polygonize, spatial join, rasterize) against the
+raster-native mask, on synthetic cloudy images. Also checks the parity of the
+masks and of the `Filter.is_cloud` verdicts, and fails if the masks or the
+tiles kept by `CloudFilter` differ from the polygon path on an image whose
+clouds have no holes, or if the masks or the verdicts differ from the polygon
+path beyond the pixels it adds around the clouds on the random images.
+
+Usage (from the `src` directory):
+    uv run python -m benchmarks.cloud_filter --image_size 2000 --tiles_size 250
+"""
+
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+from astrovision.data import SatelliteImage
+from astrovision.data.utils import generate_tiles_borders
+from rasterio.features import rasterize, shapes
+from rasterio.io import MemoryFile
+from scipy.ndimage import binary_dilation, binary_fill_holes
+from shapely.geometry import Polygon
+
+from benchmarks.cloud_mask import make_image
+from classes.filters.filter import Filter
+from classes.filters.tile_filter import CloudFilter
+from classes.tile_grids.tile_grid import TileGrid
+
+PARAMETERS = {"threshold_center": 0.7, "threshold_full": 0.4, "min_relative_size": 0.0125}
+
+
+def mask_to_gdf(mask: np.ndarray, clouds_only: bool = False) -> gpd.GeoDataFrame:
+    """
+    Polygonize a binary mask, as done by the former `Filter.mask_to_gdf`. The
+    former version also polygonized the background: with `clouds_only`, only
+    the clouds are polygonized.
+    """
+    polygon_list = []
+    for shape in shapes(mask, mask=mask.astype(bool) if clouds_only else None):
+        polygon = Polygon(shape[0]["coordinates"][0])
+        if polygon.area > 0.85 * mask.shape[0] * mask.shape[1]:
+            continue
+        polygon_list.append(polygon)
+    return gpd.GeoDataFrame(geometry=polygon_list)
+
+
+def polygon_mask_cloud(
+    filter_: Filter,
+    si: SatelliteImage,
+    threshold_center: float,
+    threshold_full: float,
+    min_relative_size: float,
+    clouds_only: bool = False,
+) -> np.ndarray:
+    """
+    Cloud mask as implemented before the raster-native version, see `mask_to_gdf` for `clouds_only`.
+    """
+    g_center = mask_to_gdf(filter_.mask_cloud(si, threshold_center, min_relative_size), clouds_only)
+    g_full = mask_to_gdf(filter_.mask_cloud(si, threshold_full, min_relative_size), clouds_only)
+    result = gpd.sjoin(g_full, g_center, how="inner", predicate="intersects").drop_duplicates(subset="geometry")
+    if result.empty:
+        return np.zeros(si.array.shape[1:])
+    return rasterize(result.geometry, out_shape=si.array.shape[1:], fill=0, all_touched=True, default_value=1)
+
+
+def polygon_is_cloud(filter_: Filter, si: SatelliteImage, tiles_size: int, clouds_only: bool = False) -> list:
+    """
+    Tile verdicts of the former `Filter.is_cloud`, see `mask_to_gdf` for `clouds_only`.
+    """
+    mask = polygon_mask_cloud(filter_, si, **PARAMETERS, clouds_only=clouds_only)
+    indices = generate_tiles_borders(mask.shape[0], mask.shape[1], tiles_size)
+    masks = [mask[rows[0] : rows[1], cols[0] : cols[1]] for rows, cols in indices]
+    return [1 if np.sum(tile_mask) > np.prod(tile_mask.shape) * 0.5 else 0 for tile_mask in masks]
+
+
+def make_disc_image(image_size: int, dtype: str) -> SatelliteImage:
+    """
+    Create a synthetic image with disc clouds over a dark background: a cloud
+    with a bright center, a cloud without one and a bright cloud too small to
+    be kept. Clouds have no holes and do not split the background, so that the
+    polygon path may only add the pixels touching the clouds.
+    """
+    rows, cols = np.mgrid[:image_size, :image_size] / image_size
+    clouds = np.full((image_size, image_size), 0.1)
+    for row, col, radius, value in [(0.3, 0.3, 0.25, 0.5), (0.3, 0.3, 0.1, 0.9), (0.75, 0.7, 0.15, 0.5), (0.8, 0.2, 0.03, 0.9)]:
+        clouds[(rows - row) ** 2 + (cols - col) ** 2 < radius**2] = value
+    si = make_image(image_size, dtype)
+    si.array = np.repeat((np.iinfo(dtype).max * clouds).astype(dtype)[np.newaxis], 3, axis=0)
+    return si
+
+
+def check_parity(image_size: int, tiles_size: int):
+    """
+    Check that the raster-native mask only differs from the polygon mask along
+    the edges of the clouds, and that `CloudFilter` keeps the tiles kept by
+    the former `Filter.is_cloud`, on disc clouds.
+    """
+    filter_ = Filter()
+    for dtype in ["uint8", "uint16"]:
+        si = make_disc_image(image_size, dtype)
+        raster_mask = filter_.create_mask_cloud(si, **PARAMETERS).astype(bool)
+        polygon_mask = polygon_mask_cloud(filter_, si, **PARAMETERS).astype(bool)
+        assert raster_mask.any(), "No cloud in the parity image"
+        assert not np.any(raster_mask & ~polygon_mask), "Cloud pixels missing from the polygon mask"
+        assert not np.any(polygon_mask & ~binary_dilation(raster_mask, np.ones((3, 3)))), "Cloud pixels away from the edges"
+
+        polygon_kept = np.array(polygon_is_cloud(filter_, si, tiles_size)) == 0
+        assert 0 < polygon_kept.sum() < len(polygon_kept), "No cloudy or no clear tile in the parity image"
+        assert np.array_equal(np.array(filter_.is_cloud(si, tiles_size, **PARAMETERS)) == 0, polygon_kept)
+
+        profile = {"driver": "GTiff", "count": 3, "dtype": dtype, "crs": si.crs, "transform": si.transform}
+        with MemoryFile() as memfile:
+            with memfile.open(height=image_size, width=image_size, **profile) as dst:
+                dst.write(si.array)
+            with memfile.open() as src:
+                # Windowed, the grayscale is read by rasterio strip by strip as in the pipeline
+                grid = TileGrid(src, tiles_size, 3, windowed=True)
+                cloud_filter = CloudFilter(**PARAMETERS)
+                kept = ~cloud_filter.reject_tiles(grid, np.arange(len(grid)))
+                assert np.array_equal(cloud_filter.get_mask(grid).view(bool), raster_mask)
+        assert np.array_equal(kept, polygon_kept), "CloudFilter keeps other tiles than the polygon path"
+        print(
+            f"{dtype}, {image_size}px discs: parity ok, {np.sum(polygon_mask & ~raster_mask)} edge pixels only in the "
+            f"polygon mask, {kept.sum()}/{len(kept)} tiles kept by both paths"
+        )
+
+
+def check_scene_parity(filter_: Filter, si: SatelliteImage, tiles_size: int) -> int:
+    """
+    Check the raster-native mask and verdicts against the polygon path on any
+    image. Polygons being filled, the polygon path adds the holes of the clouds
+    and the pixels touching them: the polygon mask should contain the raster
+    mask and stay within its filled and dilated version. The background, which
+    the former path also polygonized, is left out. Tiles whose masks differ by
+    more than edge pixels, i.e. with filled holes, may get another verdict.
+
+    Returns:
+        int: Number of tiles with filled holes, whose verdicts are not compared.
+    """
+    raster_mask = filter_.create_mask_cloud(si, **PARAMETERS).astype(bool)
+    polygon_mask = polygon_mask_cloud(filter_, si, **PARAMETERS, clouds_only=True).astype(bool)
+    assert not np.any(raster_mask & ~polygon_mask), "Cloud pixels missing from the polygon mask"
+    filled_mask = binary_dilation(binary_fill_holes(raster_mask), np.ones((3, 3)))
+    assert not np.any(polygon_mask & ~filled_mask), "Cloud pixels away from the clouds and their holes"
+
+    holes = polygon_mask & ~binary_dilation(raster_mask, np.ones((3, 3)))
+    indices = generate_tiles_borders(*raster_mask.shape, tiles_size)
+    compared = [not holes[rows[0] : rows[1], cols[0] : cols[1]].any() for rows, cols in indices]
+    raster_verdicts = filter_.is_cloud(si, tiles_size, **PARAMETERS)
+    polygon_verdicts = polygon_is_cloud(filter_, si, tiles_size, clouds_only=True)
+    for k in np.flatnonzero(compared):
+        assert raster_verdicts[k] == polygon_verdicts[k], f"Tile {k} gets another verdict than with the polygon path"
+    return len(indices) - sum(compared)
+
+
+def timeit(function, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cloud filter benchmark")
+    parser.add_argument("--image_size", type=int, default=2000, help="Image side in pixels")
+    parser.add_argument("--tiles_size", type=int, default=250, help="Tile side in pixels")
+    parser.add_argument("--cloud_scale", type=float, default=0.03, help="Typical cloud size relative to the image")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs")
+    args = parser.parse_args()
+
+    check_parity(args.image_size, args.tiles_size)
+    filter_ = Filter()
+
+    for dtype in ["uint8", "uint16"]:
+        for seed in range(3):
+            si = make_image(args.image_size, dtype, seed, args.cloud_scale)
+            holed_tiles = check_scene_parity(filter_, si, args.tiles_size)
+
+            # Parity of the masks and of the tile verdicts with the former path, background included
+            raster_mask = filter_.create_mask_cloud(si, **PARAMETERS)
+            polygon_mask = polygon_mask_cloud(filter_, si, **PARAMETERS)
+            raster_verdicts = filter_.is_cloud(si, args.tiles_size, **PARAMETERS)
+            polygon_verdicts = polygon_is_cloud(filter_, si, args.tiles_size)
+            pixels = np.mean(raster_mask == polygon_mask)
+            tiles = sum(a == b for a, b in zip(raster_verdicts, polygon_verdicts))
+
+            polygon_ms = 1000 * sum(timeit(polygon_is_cloud, filter_, si, args.tiles_size) for _ in range(args.repeat))
+            raster_ms = 1000 * sum(timeit(filter_.is_cloud, si, args.tiles_size, **PARAMETERS) for _ in range(args.repeat))
+            print(
+                f"{dtype}, seed {seed}, {args.image_size}px: is_cloud polygons {polygon_ms / args.repeat:.1f}ms, "
+                f"raster {raster_ms / args.repeat:.1f}ms ({polygon_ms / raster_ms:.1f}x), "
+                f"{pixels:.2%} identical pixels, {tiles}/{len(raster_verdicts)} identical verdicts "
+                f"({sum(raster_verdicts)} cloudy tiles, {holed_tiles} with filled holes not compared)"
+            )
+
+
+if __name__ == "__main__":
+    main()
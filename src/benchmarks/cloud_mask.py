@@ -0,0 +1,110 @@
+"""
+Benchmark of the cloud mask construction: one full-image comparison per
+cluster against the keep table relabel of `Filter.mask_cloud`, on synthetic
+cloudy images.
+
+Usage (from the `src` directory):
+    uv run python -m benchmarks.cloud_mask --image_size 2000
+"""
+
+import argparse
+import time
+
+import numpy as np
+from affine import Affine
+from astrovision.data import SatelliteImage
+from scipy.ndimage import gaussian_filter, label
+
+from classes.filters.filter import Filter
+
+CRS = "EPSG:4471"
+
+
+def make_image(image_size: int, dtype: str, seed: int = 0, cloud_scale: float = 0.01) -> SatelliteImage:
+    """
+    Create a synthetic image with smooth bright blobs (clouds) over noise,
+    `cloud_scale` being the typical size of the blobs relative to the image.
+    """
+    rng = np.random.default_rng(seed)
+    max_value = np.iinfo(dtype).max
+    clouds = gaussian_filter(rng.random((image_size, image_size)), sigma=cloud_scale * image_size).ravel()
+    # Uniform ranks raised to a power so that about 30% of the pixels are above the full
+    # threshold (0.4) and 10% above the center threshold (0.7), in tens of clusters
+    ranks = np.empty(clouds.size)
+    ranks[np.argsort(clouds)] = np.linspace(0, 1, clouds.size)
+    clouds = (ranks**2.5).reshape(image_size, image_size)
+    noise = rng.normal(0, 0.01, (3, image_size, image_size))
+    array = (max_value * np.clip(clouds + noise, 0, 1)).astype(dtype)
+    return SatelliteImage(
+        array=array,
+        crs=CRS,
+        bounds=(0.0, 0.0, image_size * 0.5, image_size * 0.5),
+        transform=Affine(0.5, 0.0, 0.0, 0.0, -0.5, image_size * 0.5),
+    )
+
+
+def loop_mask_cloud(filter_: Filter, si: SatelliteImage, threshold: float, min_relative_size: float) -> np.ndarray:
+    """
+    Cloud mask as implemented before the keep table: one comparison per cluster.
+    """
+    grayscale = filter_.to_grayscale(si.array)
+    absolute_threshold = threshold * np.iinfo(grayscale.dtype).max
+    labeled, num_features = label(grayscale > absolute_threshold)
+    region_sizes = np.bincount(labeled.flat)
+    sorted_labels = np.argsort(-region_sizes)
+
+    mask = np.zeros_like(labeled)
+    if num_features >= 1:
+        for i in range(1, num_features + 1):
+            if region_sizes[sorted_labels[i]] >= min_relative_size * np.prod(grayscale.shape):
+                mask[labeled == sorted_labels[i]] = 1
+            else:
+                break
+    return mask
+
+
+def loop_masks(filter_: Filter, si: SatelliteImage, min_relative_size: float) -> list:
+    return [loop_mask_cloud(filter_, si, threshold, min_relative_size) for threshold in (0.7, 0.4)]
+
+
+def table_masks(filter_: Filter, si: SatelliteImage, min_relative_size: float) -> list:
+    grayscale = filter_.to_grayscale(si.array)
+    labeled = np.empty(grayscale.shape, dtype=np.int32)
+    return [filter_.mask_cloud(si, threshold, min_relative_size, grayscale, labeled) for threshold in (0.7, 0.4)]
+
+
+def timeit(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cloud mask benchmark")
+    parser.add_argument("--image_size", type=int, default=2000, help="Image side in pixels")
+    parser.add_argument("--min_relative_size", type=float, default=0.0005, help="Minimum relative size of a cloud")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs")
+    args = parser.parse_args()
+
+    filter_ = Filter()
+
+    for dtype in ["uint8", "uint16"]:
+        si = make_image(args.image_size, dtype)
+
+        # Check that both paths produce the same masks, for the center and full thresholds
+        masks = table_masks(filter_, si, args.min_relative_size)
+        for mask, expected in zip(masks, loop_masks(filter_, si, args.min_relative_size)):
+            assert mask.dtype == np.uint8
+            assert np.array_equal(mask, expected)
+
+        loop_ms = 1000 * sum(timeit(loop_masks, filter_, si, args.min_relative_size) for _ in range(args.repeat))
+        table_ms = 1000 * sum(timeit(table_masks, filter_, si, args.min_relative_size) for _ in range(args.repeat))
+        print(
+            f"{dtype}, {args.image_size}px, center and full masks: "
+            f"loop {loop_ms / args.repeat:.1f}ms, keep table {table_ms / args.repeat:.1f}ms "
+            f"({loop_ms / table_ms:.1f}x), {masks[0].mean():.1%} / {masks[1].mean():.1%} cloudy pixels"
+        )
+
+
+if __name__ == "__main__":
+    main()
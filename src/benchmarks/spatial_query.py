@@ -0,0 +1,132 @@
+"""
+Benchmark of the labeler patch selection: GeoDataFrame `.cx` indexing
+against the STRtree spatial index of `Labeler`, on a synthetic department.
+
+Usage (from the `src` directory):
+    uv run python -m benchmarks.spatial_query --n_polygons 1000000
+"""
+
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from affine import Affine
+from astrovision.data import SatelliteImage
+from astrovision.data.utils import generate_tiles_borders, get_bounds_for_tile
+from rasterio.features import rasterize
+
+from classes.labelers.labeler import BDTOPOLabeler
+from functions import download_data
+
+CRS = "EPSG:4471"
+
+
+def make_department(n_polygons: int, extent: float, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    Create a synthetic BDTOPO-like layer of small rectangular buildings.
+
+    Args:
+        n_polygons (int): Number of buildings.
+        extent (float): Side of the square department, in meters.
+        seed (int): Random seed.
+
+    Returns:
+        gpd.GeoDataFrame: Synthetic buildings.
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, extent, n_polygons)
+    y = rng.uniform(0, extent, n_polygons)
+    geometry = shapely.box(x, y, x + rng.uniform(5, 25, n_polygons), y + rng.uniform(5, 25, n_polygons))
+    return gpd.GeoDataFrame(
+        {
+            "USAGE1": rng.choice(["Indifférencié", "Résidentiel", "Commercial et services"], n_polygons),
+            "HAUTEUR": rng.uniform(2, 15, n_polygons),
+        },
+        geometry=geometry,
+        crs=CRS,
+    )
+
+
+def make_images(n_images: int, extent: float, image_size: int, resolution: float, seed: int = 1):
+    """
+    Create empty satellite images randomly located over the department.
+    """
+    rng = np.random.default_rng(seed)
+    side = image_size * resolution
+    images = []
+    for left, top in zip(rng.uniform(0, extent - side, n_images), rng.uniform(side, extent, n_images)):
+        transform = Affine(resolution, 0.0, left, 0.0, -resolution, top)
+        images.append(
+            SatelliteImage(
+                array=np.zeros((3, image_size, image_size), dtype=np.uint8),
+                crs=CRS,
+                bounds=(left, top - side, left + side, top),
+                transform=transform,
+            )
+        )
+    return images
+
+
+def cx_segmentation_label(labeling_data: gpd.GeoDataFrame, si: SatelliteImage) -> np.ndarray:
+    """
+    Patch selection and rasterization as done before the spatial index.
+    """
+    xmin, ymin, xmax, ymax = si.bounds
+    patch = labeling_data.cx[xmin:xmax, ymin:ymax].copy()
+    if patch.empty:
+        return np.zeros(si.array.shape[1:], dtype=np.uint8)
+    return rasterize(patch.geometry, out_shape=si.array.shape[1:], transform=si.transform, all_touched=True, default_value=1)
+
+
+def timeit(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Labeler spatial query benchmark")
+    parser.add_argument("--n_polygons", type=int, default=1_000_000, help="Number of synthetic buildings")
+    parser.add_argument("--extent", type=float, default=50_000.0, help="Side of the department in meters")
+    parser.add_argument("--n_images", type=int, default=20, help="Number of images to label")
+    parser.add_argument("--image_size", type=int, default=2000, help="Image side in pixels")
+    parser.add_argument("--resolution", type=float, default=0.5, help="Pixel size in meters")
+    parser.add_argument("--tiles_size", type=int, default=250, help="Tile side in pixels for batch queries")
+    args = parser.parse_args()
+
+    labeling_data = make_department(args.n_polygons, args.extent)
+    images = make_images(args.n_images, args.extent, args.image_size, args.resolution)
+
+    # The labeler loads the synthetic layer instead of the BDTOPO
+    download_data.load_bdtopo = lambda year, dep, extent=None: labeling_data.copy()
+    start = time.perf_counter()
+    labeler = BDTOPOLabeler("2023", "SYNTHETIC", "segmentation", crs_list=[CRS])
+    print(f"Labeler construction (projection and STRtree): {time.perf_counter() - start:.2f}s")
+
+    # Check that both paths produce the same labels
+    for si in images[:3]:
+        assert np.array_equal(cx_segmentation_label(labeling_data, si), labeler.create_segmentation_label(si))
+
+    cx_ms = 1000 * sum(timeit(cx_segmentation_label, labeling_data, si) for si in images) / len(images)
+    tree_ms = 1000 * sum(timeit(labeler.create_segmentation_label, si) for si in images) / len(images)
+    print(f"Segmentation label per image: .cx {cx_ms:.1f}ms, STRtree {tree_ms:.1f}ms")
+
+    cx_patch = lambda b: labeling_data.cx[b[0] : b[2], b[1] : b[3]].copy()  # noqa: E731
+    cx_ms = 1000 * sum(timeit(cx_patch, si.bounds) for si in images) / len(images)
+    tree_ms = 1000 * sum(timeit(labeler.query, si.bounds, CRS) for si in images) / len(images)
+    print(f"Patch selection per image: .cx {cx_ms:.1f}ms, STRtree {tree_ms:.2f}ms")
+
+    # Tile bounds of every image, answered one by one or in a single batch
+    indices = generate_tiles_borders(args.image_size, args.image_size, args.tiles_size)
+    tiles_bounds = [get_bounds_for_tile(si.transform, rows, cols) for si in images for rows, cols in indices]
+    cx_time = timeit(lambda: [cx_patch(b) for b in tiles_bounds])
+    single_time = timeit(lambda: [labeler.query(b, CRS) for b in tiles_bounds])
+    batch_time = timeit(labeler.query_many, tiles_bounds, CRS)
+    n_tiles = len(tiles_bounds)
+    print(f"Patch selection for {n_tiles} tiles: .cx {cx_time:.2f}s, STRtree {single_time:.3f}s, batch {batch_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
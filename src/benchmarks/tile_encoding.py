@@ -0,0 +1,104 @@
+"""
+Benchmark of the encoding profiles of `src/config/encodings.yaml`: size on
+disk per tile (image and label) and write throughput of the tiles of a
+synthetic Pleiades-like image, written by a `FileTileWriter`.
+
+Usage (from the `src` directory):
+    uv run python -m benchmarks.tile_encoding --image_size 2000 --tiles_size 250
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import rasterio
+import yaml
+from rasterio.errors import NotGeoreferencedWarning
+from scipy.ndimage import gaussian_filter
+
+from benchmarks.cloud_mask import make_image
+from classes.tile_encoders.tile_encoder import TileEncoder
+from classes.tile_views.tile_view import TileView
+from classes.tile_writers.tile_writer import FileTileWriter
+
+ENCODINGS_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "encodings.yaml")
+
+
+def make_tiles(image_size: int, tiles_size: int, dtype: str, seed: int = 0) -> list:
+    """
+    Tiles of a synthetic image: clouds over a textured ground, with a binary
+    label of rectangular buildings covering about 10% of the image.
+    """
+    rng = np.random.default_rng(seed)
+    si = make_image(image_size, dtype, seed)
+    # Smooth ground texture, so that the tiles compress like real images rather than noise
+    max_value = np.iinfo(dtype).max
+    ground = gaussian_filter(rng.random((3, image_size, image_size)), sigma=(0, 3, 3))
+    si.array = np.clip(0.5 * si.array + 0.5 * max_value * (ground - ground.min()) / np.ptp(ground), 0, max_value).astype(dtype)
+
+    label = np.zeros((image_size, image_size), dtype=np.uint8)
+    for row, col, height, width in rng.integers(0, image_size, (image_size**2 // 4000, 4)):
+        label[row : row + height % 40 + 5, col : col + width % 40 + 5] = 1
+
+    return [
+        TileView(si.array, (row, row + tiles_size), (col, col + tiles_size), si.crs, si.transform, label)
+        for row in range(0, image_size - tiles_size + 1, tiles_size)
+        for col in range(0, image_size - tiles_size + 1, tiles_size)
+    ]
+
+
+def max_error(entry: dict, tile: TileView) -> float:
+    """
+    Largest absolute difference between a tile and its image file.
+    """
+    with warnings.catch_warnings():
+        # JPEG and WebP tiles are not georeferenced
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rasterio.open(entry["image"]) as src:
+            return float(np.abs(src.read().astype(np.float64) - tile.array).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tile encoding benchmark")
+    parser.add_argument("--image_size", type=int, default=2000, help="Image side in pixels")
+    parser.add_argument("--tiles_size", type=int, default=250, help="Tile side in pixels")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs")
+    args = parser.parse_args()
+
+    with open(ENCODINGS_PATH, "r") as file:
+        profiles = yaml.load(file, Loader=yaml.FullLoader)
+
+    for dtype in ["uint8", "uint16"]:
+        tiles = make_tiles(args.image_size, args.tiles_size, dtype)
+        reference = None
+        for name, profile in profiles.items():
+            encoder = TileEncoder(**profile)
+            if encoder.driver in ["JPEG", "WEBP"] and dtype != "uint8":
+                print(f"{dtype}, {name}: {encoder.driver} only encodes uint8 images")
+                continue
+
+            durations, sizes = [], []
+            for _ in range(args.repeat):
+                with tempfile.TemporaryDirectory() as directory:
+                    os.makedirs(f"{directory}/labels/train/")
+                    writer = FileTileWriter(f"{directory}/labels/test/", f"{directory}/labels/train/", encoder=encoder)
+                    start = time.perf_counter()
+                    with writer:
+                        entries = [writer.write(tile, f"tile_{k:04d}", False) for k, tile in enumerate(tiles)]
+                    durations.append(time.perf_counter() - start)
+                    sizes.append(sum(os.path.getsize(entry[key]) for entry in entries for key in ["image", "label"]))
+                    error = max_error(entries[0], tiles[0])
+
+            bytes_per_tile = sizes[-1] / len(tiles)
+            reference = reference or bytes_per_tile
+            print(
+                f"{dtype}, {name}: {bytes_per_tile / 1024:.1f} KiB/tile ({reference / bytes_per_tile:.1f}x smaller than "
+                f"{next(iter(profiles))}), {len(tiles) / min(durations):.0f} tiles/s, max error {error:g}"
+            )
+
+
+if __name__ == "__main__":
+    main()
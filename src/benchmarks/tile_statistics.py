@@ -0,0 +1,100 @@
+"""
+Benchmark of tile statistics over several tile layouts: per-tile slicing and
+sums for each layout against a single integral image of the black and cloud
+masks, queried for every layout.
+
+Usage (from the `src` directory):
+    uv run python -m benchmarks.tile_statistics --image_size 2000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.cloud_mask import make_image
+from classes.filters.filter import Filter
+from classes.integral_images.integral_image import IntegralImage
+
+BLACK_VALUE_THRESHOLD = 25
+
+
+def get_layouts(image_size: int) -> dict:
+    """
+    Tile layouts evaluated: three grids and overlapping sliding windows.
+    """
+    return {
+        "125px grid": IntegralImage.get_windows(image_size, image_size, 125),
+        "250px grid": IntegralImage.get_windows(image_size, image_size, 250),
+        "500px grid": IntegralImage.get_windows(image_size, image_size, 500),
+        "250px windows, stride 50": IntegralImage.get_windows(image_size, image_size, 250, stride=50),
+    }
+
+
+def per_tile_fractions(masks: list, layouts: dict) -> list:
+    """
+    Fraction of each tile covered by each mask, one slice and sum per tile.
+    """
+    return [
+        [np.array([mask[rows[0] : rows[1], cols[0] : cols[1]].mean() for rows, cols in indices]) for indices in layouts.values()]
+        for mask in masks
+    ]
+
+
+def integral_fractions(integral_images: list, layouts: dict) -> list:
+    """
+    Fraction of each tile covered by each mask, from integral images.
+    """
+    return [[integral_image.mean_tiles(indices) for indices in layouts.values()] for integral_image in integral_images]
+
+
+def timeit(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tile statistics benchmark")
+    parser.add_argument("--image_size", type=int, default=2000, help="Image side in pixels")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs")
+    args = parser.parse_args()
+
+    filter_ = Filter()
+    layouts = get_layouts(args.image_size)
+    block_size = IntegralImage.get_block_size(*layouts.values())
+    n_tiles = sum(len(indices) for indices in layouts.values())
+
+    for dtype in ["uint8", "uint16"]:
+        si = make_image(args.image_size, dtype, cloud_scale=0.05)
+        threshold = BLACK_VALUE_THRESHOLD * (257 if dtype == "uint16" else 1)
+        masks = [
+            filter_.to_integer_grayscale(si.array) < threshold * 10_000,
+            filter_.create_mask_cloud(si).view(bool),
+        ]
+
+        # Integral images at the block size of all the layouts, and at the pixel level
+        integral_images = [IntegralImage(mask, block_size) for mask in masks]
+        pixel_integral_images = [IntegralImage(mask) for mask in masks]
+
+        # Check that both paths give the same fractions
+        expected = per_tile_fractions(masks, layouts)
+        for images in [integral_images, pixel_integral_images]:
+            for fractions, expected_fractions in zip(integral_fractions(images, layouts), expected):
+                assert all(np.allclose(a, b) for a, b in zip(fractions, expected_fractions))
+
+        def build_and_query(block_size: int):
+            return integral_fractions([IntegralImage(mask, block_size) for mask in masks], layouts)
+
+        per_tile_ms = 1000 * sum(timeit(per_tile_fractions, masks, layouts) for _ in range(args.repeat))
+        block_ms = 1000 * sum(timeit(build_and_query, block_size) for _ in range(args.repeat))
+        pixel_ms = 1000 * sum(timeit(build_and_query, 1) for _ in range(args.repeat))
+        print(
+            f"{dtype}, {len(layouts)} layouts, {n_tiles} tiles, 2 masks: per tile {per_tile_ms / args.repeat:.1f}ms, "
+            f"integral images by blocks of {block_size}px {block_ms / args.repeat:.1f}ms "
+            f"({per_tile_ms / block_ms:.1f}x), by pixels {pixel_ms / args.repeat:.1f}ms ({per_tile_ms / pixel_ms:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,12 @@
-from typing import List
+import math
+from typing import List, Optional
 
-import geopandas as gpd
 import numpy as np
 from astrovision.data import SatelliteImage
 from astrovision.data.utils import generate_tiles_borders
-from rasterio.features import rasterize, shapes
 from scipy.ndimage import label
-from shapely.geometry import Polygon
+
+from classes.integral_images.integral_image import IntegralImage
 
 
 class Filter:
@@ -36,19 +36,161 @@ class Filter:
         Returns:
         - bool: True if the proportion of black pixels is greater than or equal to the threshold, False otherwise.
         """
-        # Convert the RGB image to grayscale
-        gray_image = 0.2989 * image.array[0] + 0.5870 * image.array[1] + 0.1140 * image.array[2]
+        height, width = image.array.shape[1:]
+        return self.is_too_black_tiles(
+            image,
+            [((0, height), (0, width))],
+            black_value_threshold,
+            black_area_threshold,
+        )[0]
+
+    def is_too_black_tiles(
+        self,
+        image: SatelliteImage,
+        indices: List,
+        black_value_threshold: int = 100,
+        black_area_threshold: float = 0.5,
+    ) -> List[bool]:
+        """
+        Determine, for every tile of an image at once, if it has a significant proportion of black pixels.
+
+        Black pixels are counted in exact integer arithmetic: the grayscale of the
+        whole image is computed once, then the black pixels of every tile are
+        counted with an integral image of the black pixel mask.
+
+        Parameters:
+        - image (SatelliteImage): The input satellite image.
+        - indices (List): Tile borders, as returned by `generate_tiles_borders` or `IntegralImage.get_windows`.
+        - black_value_threshold (int, optional): The intensity threshold to consider a pixel as black. Default is 100.
+        - black_area_threshold (float, optional): The threshold for the proportion of black pixels in a tile. Default is 0.5.
+
+        Returns:
+        - List[bool]: For each tile, True if its proportion of black pixels is greater than or equal to the threshold.
+        """
+        integral_image = self.black_integral_image(image, black_value_threshold, IntegralImage.get_block_size(indices))
+        return (integral_image.mean_tiles(indices) >= black_area_threshold).tolist()
+
+    def black_integral_image(
+        self,
+        image: SatelliteImage,
+        black_value_threshold: int = 100,
+        block_size: int = 1,
+    ) -> IntegralImage:
+        """
+        Compute the integral image of the black pixel mask of an image, from
+        which the proportion of black pixels of any tile with borders multiple
+        of `block_size` is read in O(1): several tile sizes, strides or offsets
+        can be evaluated without reading the pixels again.
+
+        Parameters:
+        - image (SatelliteImage): The input satellite image.
+        - black_value_threshold (int, optional): The intensity threshold to consider a pixel as black. Default is 100.
+        - block_size (int, optional): Block size of the integral image, see `IntegralImage.get_block_size`. Default is 1.
 
-        # Count the number of black pixels
-        nb_black_pixels = np.sum(gray_image < black_value_threshold)
+        Returns:
+        - IntegralImage: Integral image of the black pixel mask.
+        """
+        black = self.to_integer_grayscale(image.array[:3]) < black_value_threshold * 10_000
+        return IntegralImage(black, block_size)
+
+    def bound_black_tiles(
+        self,
+        overview: SatelliteImage,
+        indices: List,
+        overview_factor: int,
+        black_value_threshold: int = 100,
+        black_area_threshold: float = 0.5,
+    ) -> List[bool]:
+        """
+        Determine from an overview of an image which of its tiles are certain to
+        be rejected by the black filter, without reading the full-resolution pixels.
+
+        Each pixel of the overview is the average of a block of `overview_factor`
+        x `overview_factor` pixels of the image. Grayscale values being
+        non-negative, at most `mean / black_value_threshold` of the pixels of a
+        block can be at or above the threshold (Markov's inequality), so at least
+        `1 - mean / black_value_threshold` of them are black. A tile is rejected
+        only when these lower bounds, over the blocks inside the tile, already
+        reach `black_area_threshold`: the full-resolution filter would reject it
+        too. The bound holds as long as the overview holds block averages, up to
+        the rounding of the overview values.
+
+        Parameters:
+        - overview (SatelliteImage): Block averages of the image, with at least 3 bands, see `TileGrid.get_overview`.
+        - indices (List): Tile borders in the full-resolution image, as returned by `generate_tiles_borders`.
+        - overview_factor (int): Side of the blocks of pixels averaged in an overview pixel.
+        - black_value_threshold (int, optional): The intensity threshold to consider a pixel as black. Default is 100.
+        - black_area_threshold (float, optional): The threshold for the proportion of black pixels in a tile. Default is 0.5.
+
+        Returns:
+        - List[bool]: For each tile, True if it is certain to be rejected by the black filter.
+        """
+        # Upper bound of the mean grayscale of each block, scaled by 10 000: the rounding of each
+        # band adds at most 1, i.e. 2989 + 5870 + 1140 < 10 000 once weighted
+        mean_bound = self.to_integer_grayscale(overview.array[:3]).astype(np.int64) + 10_000
+        # Lower bound of the number of black pixels of each block, in integers
+        block_area = overview_factor**2
+        black_bound = block_area + np.floor_divide(-block_area * mean_bound, black_value_threshold * 10_000)
+        black_bound = np.maximum(black_bound, 0)
+
+        # Blocks entirely inside each tile
+        borders = np.array(indices, dtype=np.int64).reshape(-1, 2, 2)
+        blocks = np.empty_like(borders)
+        blocks[:, :, 0] = -np.floor_divide(-borders[:, :, 0], overview_factor)
+        blocks[:, :, 1] = borders[:, :, 1] // overview_factor
+        blocks[:, :, 1] = np.minimum(blocks[:, :, 1], np.array(black_bound.shape))
+        blocks[:, :, 1] = np.maximum(blocks[:, :, 1], blocks[:, :, 0])
+        blocks[:, :, 0] = np.minimum(blocks[:, :, 0], blocks[:, :, 1])
+
+        black_pixels = IntegralImage(black_bound).sum_tiles(blocks.tolist())
+        tiles_area = (borders[:, 0, 1] - borders[:, 0, 0]) * (borders[:, 1, 1] - borders[:, 1, 0])
+        return (black_pixels / tiles_area >= black_area_threshold).tolist()
+
+    @staticmethod
+    def to_integer_grayscale(array: np.ndarray) -> np.ndarray:
+        """
+        Convert an RGB array to grayscale in exact integer arithmetic, scaled by
+        10 000: the weights (0.2989, 0.5870, 0.1140) become (2989, 5870, 1140).
 
-        # Calculate the proportion of black pixels
-        black_pixel_ratio = nb_black_pixels / np.prod(gray_image.shape)
+        Parameters:
+        - array (np.ndarray): Array in (C, H, W) format, with at least 3 bands.
 
-        # Check if the proportion exceeds the threshold
-        return black_pixel_ratio >= black_area_threshold
+        Returns:
+        - np.ndarray: Grayscale array, scaled by 10 000.
+        """
+        dtype = np.int64 if array.dtype.itemsize > 2 else np.int32
+        # Band by band to avoid large temporaries
+        gray_image = np.multiply(array[0], 2989, dtype=dtype)
+        gray_image += np.multiply(array[1], 5870, dtype=dtype)
+        gray_image += np.multiply(array[2], 1140, dtype=dtype)
+        return gray_image
+
+    def to_grayscale(self, array: np.ndarray) -> np.ndarray:
+        """
+        Convert an RGB array to grayscale, in the dtype of the array.
 
-    def mask_cloud(self, image: SatelliteImage, threshold: float = 0.7, min_relative_size: float = 0.0125) -> np.ndarray:
+        Parameters:
+        - array (np.ndarray): Array in (C, H, W) format. Single-band arrays are
+          considered grayscale already.
+
+        Returns:
+        - np.ndarray: Grayscale array in (H, W) format.
+        """
+        if array.shape[0] == 1:
+            return array[0]
+
+        weights = np.array([0.2989, 0.5870, 0.1140])[:, np.newaxis, np.newaxis]
+        grayscale = np.sum(weights * array[:3], axis=0)
+        return grayscale.astype(array.dtype)
+
+    def mask_cloud(
+        self,
+        image: SatelliteImage,
+        threshold: float = 0.7,
+        min_relative_size: float = 0.0125,
+        grayscale: Optional[np.ndarray] = None,
+        labeled: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
         """
         Generate a cloud mask based on pixel intensity and cluster size.
 
@@ -58,6 +200,9 @@ class Filter:
           Default is 0.7.
         - min_relative_size (float, optional): The minimum relative size of a cluster to be considered as a cloud.
           Default is 0.0125.
+        - grayscale (np.ndarray, optional): Grayscale of the image, computed from the image if not given.
+        - labeled (np.ndarray, optional): int32 buffer of the image shape receiving the cluster labels,
+          allocated if not given. Passing it avoids an allocation when masks are computed for several thresholds.
 
         Returns:
         - np.ndarray: A binary mask indicating the cloud regions in the image.
@@ -78,9 +223,8 @@ class Filter:
             >>> ax.imshow(mask, alpha=0.3)
         """
         # Convert the RGB image to grayscale
-        weights = np.array([0.2989, 0.5870, 0.1140])[:, np.newaxis, np.newaxis]
-        grayscale = np.sum(weights * image.array, axis=0)
-        grayscale = grayscale.astype(image.array.dtype)
+        if grayscale is None:
+            grayscale = self.to_grayscale(image.array)
 
         # Compute absolute threshold based on image dtype
         if grayscale.dtype == np.uint8:
@@ -90,21 +234,17 @@ class Filter:
         else:
             raise ValueError(f"Unsupported dtype: {grayscale.dtype}. Expected np.uint8 or np.uint16.")
 
-        # Find clusters of white pixels
-        labeled, num_features = label(grayscale > absolute_threshold)
-        region_sizes = np.bincount(labeled.flat)
-
-        # Sort region labels by decreasing size
-        sorted_labels = np.argsort(-region_sizes)
+        # Find clusters of white pixels, pixels being integers the comparison is done on the floor of the threshold
+        if labeled is None:
+            labeled = np.empty(grayscale.shape, dtype=np.int32)
+        label(grayscale > math.floor(absolute_threshold), output=labeled)
+        region_sizes = np.bincount(labeled.ravel())
 
-        mask = np.zeros_like(labeled)
-        if num_features >= 1:
-            for i in range(1, num_features + 1):
-                # Minimum size of the cluster
-                if region_sizes[sorted_labels[i]] >= min_relative_size * np.prod(grayscale.shape):
-                    mask[labeled == sorted_labels[i]] = 1
-                else:
-                    break
+        # Keep the clusters above the minimum size, except the largest region which is the background
+        # (label 0 unless a cluster is larger than it), then relabel the image through the keep table
+        keep = (region_sizes >= min_relative_size * grayscale.size).astype(np.uint8)
+        keep[np.argmax(region_sizes)] = 0
+        mask = keep[labeled]
 
         # Return the cloud mask
         return mask
@@ -119,6 +259,9 @@ class Filter:
         """
         Create a binary mask indicating cloud regions in the input satellite image.
 
+        Cloud regions are the clusters above `threshold_full` which contain a
+        cluster above `threshold_center`.
+
         Parameters:
         - image (SatelliteImage): The input satellite image.
         - threshold_center (float, optional): The intensity threshold for center clouds.
@@ -147,62 +290,20 @@ class Filter:
             >>> ax.imshow(mask_full, alpha=0.3)
         """
 
-        # Mask out center clouds from the image using the specified threshold
-        cloud_center = self.mask_cloud(image, threshold_center, min_relative_size)
-
-        # Mask out full clouds from the image using the specified threshold
-        cloud_full = self.mask_cloud(image, threshold_full, min_relative_size)
-
-        # Create GeoDataFrames from the masked center and full clouds
-        g_center = self.mask_to_gdf(cloud_center)
-        g_full = self.mask_to_gdf(cloud_full)
-
-        # Spatial join on the GeoDataFrames for the masked full and center clouds
-        result = gpd.sjoin(g_full, g_center, how="inner", predicate="intersects")
-
-        # Remove any duplicate geometries
-        result = result.drop_duplicates(subset="geometry")
-
-        # Rasterize the geometries into a numpy array
-        if result.empty:
-            rasterized = np.zeros(image.array.shape[1:])
-        else:
-            rasterized = rasterize(
-                result.geometry,
-                out_shape=image.array.shape[1:],
-                fill=0,
-                out=None,
-                all_touched=True,
-                default_value=1,
-                dtype=None,
-            )
-
-        return rasterized
-
-    def mask_to_gdf(self, mask: np.array) -> gpd.GeoDataFrame:
-        """
-        Convert a binary mask to a GeoDataFrame containing polygons.
-
-        Parameters:
-        - mask (np.ndarray): Binary mask indicating regions of interest.
+        # The grayscale and the label buffer are shared by both thresholds
+        grayscale = self.to_grayscale(image.array)
+        labeled = np.empty(grayscale.shape, dtype=np.int32)
 
-        Returns:
-        - gpd.GeoDataFrame: GeoDataFrame containing polygons derived from the input mask.
-        """
-
-        polygon_list = []
-
-        for shape in shapes(mask):
-            polygon = Polygon(shape[0]["coordinates"][0])
-
-            # Skip polygons with area greater than 85% of the mask area
-            if polygon.area > 0.85 * mask.shape[0] * mask.shape[1]:
-                continue
+        # Mask out center clouds from the image using the specified threshold
+        cloud_center = self.mask_cloud(image, threshold_center, min_relative_size, grayscale, labeled)
 
-            polygon_list.append(polygon)
+        # Mask out full clouds from the image using the specified threshold, labels of the
+        # full clusters are left in the label buffer
+        cloud_full = self.mask_cloud(image, threshold_full, min_relative_size, grayscale, labeled)
 
-        gdf = gpd.GeoDataFrame(geometry=polygon_list)
-        return gdf
+        # Keep the full clouds containing a center cloud
+        overlaps = np.bincount(labeled[cloud_center.view(bool)], minlength=labeled.max() + 1)
+        return cloud_full & (overlaps > 0).astype(np.uint8)[labeled]
 
     def is_cloud(
         self,
@@ -226,19 +327,45 @@ class Filter:
         - List[int]: A list of binary values (1 for cloud, 0 for non-cloud) for each tile.
         """
 
-        # Create a cloud mask for the entire image
-        mask = self.create_mask_cloud(
+        # Generate tile indices
+        height, width = si.array.shape[1:]
+        indices = generate_tiles_borders(height, width, tiles_size)
+
+        # Create the integral image of the cloud mask of the entire image
+        integral_image = self.cloud_integral_image(
             si,
             threshold_center,
             threshold_full,
             min_relative_size,
+            IntegralImage.get_block_size(indices),
         )
 
-        # Generate tile indices
-        indices = generate_tiles_borders(mask.shape[0], mask.shape[1], tiles_size)
+        # Return a list of binary values indicating cloud presence in each tile
+        cloud_fractions = integral_image.mean_tiles(indices)
+        return (cloud_fractions > 0.5).astype(int).tolist()
 
-        # Extract masks for each tile
-        masks = [mask[rows[0] : rows[1], cols[0] : cols[1]] for rows, cols in indices]
+    def cloud_integral_image(
+        self,
+        si: SatelliteImage,
+        threshold_center: float = 0.7,
+        threshold_full: float = 0.4,
+        min_relative_size: float = 0.0125,
+        block_size: int = 1,
+    ) -> IntegralImage:
+        """
+        Compute the integral image of the cloud mask of an image, from which the
+        cloud proportion of any tile with borders multiple of `block_size` is
+        read in O(1).
 
-        # Return a list of binary values indicating cloud presence in each tile
-        return [1 if np.sum(tile_mask) > np.prod(tile_mask.shape) * 0.5 else 0 for tile_mask in masks]
+        Parameters:
+        - si (SatelliteImage): The input satellite image.
+        - threshold_center (float, optional): The intensity threshold for center clouds. Default is 0.7.
+        - threshold_full (float, optional): The intensity threshold for full clouds. Default is 0.4.
+        - min_relative_size (float, optional): The minimum relative size of a cloud cluster. Default is 0.0125.
+        - block_size (int, optional): Block size of the integral image, see `IntegralImage.get_block_size`. Default is 1.
+
+        Returns:
+        - IntegralImage: Integral image of the cloud mask.
+        """
+        mask = self.create_mask_cloud(si, threshold_center, threshold_full, min_relative_size)
+        return IntegralImage(mask.view(bool), block_size)
@@ -0,0 +1,132 @@
+"""
+Filter chain class.
+"""
+
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from classes.filters.tile_filter import NEEDS, TileFilter
+from classes.tile_grids.tile_grid import TileGrid
+from classes.tile_views.tile_view import TileView
+
+
+class FilterChain:
+    """
+    Chain of tile filters, run from the cheapest to the most expensive.
+
+    Filters are ordered by the data they read, then by cost. Each filter only
+    evaluates the tiles kept by the previous ones, and the chain stops as soon
+    as no tile is left: the data of the next filters, e.g. the pixels of the
+    image, is then never loaded. The number of evaluated and rejected tiles and
+    the time of each filter are accumulated in `statistics`.
+    """
+
+    def __init__(self, filters: List[TileFilter]):
+        """
+        Constructor.
+
+        Args:
+            filters (List[TileFilter]): Filters of the chain, in any order.
+        """
+        self.filters = sorted(filters, key=lambda filter_: (NEEDS.index(filter_.needs), filter_.cost))
+        self.statistics = {filter_.name: {"tiles": 0, "rejected": 0, "time": 0.0} for filter_ in self.filters}
+
+    def run(self, grid: TileGrid, local: bool = True) -> np.ndarray:
+        """
+        Run the filters on the tiles of a grid.
+
+        Args:
+            grid (TileGrid): Tiles of the image.
+            local (bool): If False, local filters are skipped, to be evaluated
+                tile by tile with `run_tile`.
+
+        Returns:
+            np.ndarray: For each tile, True if it is kept.
+        """
+        kept = np.ones(len(grid), dtype=bool)
+        for filter_ in self.filters:
+            if filter_.local and not local:
+                continue
+            candidates = np.flatnonzero(kept)
+            if candidates.size == 0:
+                break
+            with grid.profiler.stage(filter_.name):
+                start = time.perf_counter()
+                # Data first read by this filter, e.g. the cloud mask, counts in its time
+                filter_.load(grid)
+                rejected = filter_.reject_tiles(grid, candidates)
+                self.update(filter_.name, len(candidates), int(rejected.sum()), time.perf_counter() - start)
+            kept[candidates[rejected]] = False
+        return kept
+
+    def run_tile(self, grid: TileGrid, tile: TileView, needs: str = "pixels") -> bool:
+        """
+        Run the local filters reading some data on a single tile, e.g. the
+        filters reading the labels once the tile is labeled.
+
+        Args:
+            grid (TileGrid): Grid of the tile.
+            tile (TileView): The tile.
+            needs (str): Data read by the filters to run, "pixels" or "labels".
+
+        Returns:
+            bool: True if the tile is kept.
+        """
+        for filter_ in self.filters:
+            if not filter_.local or filter_.needs != needs:
+                continue
+            with grid.profiler.stage(filter_.name):
+                start = time.perf_counter()
+                rejected = filter_.reject_tile(tile, grid)
+                self.update(filter_.name, 1, int(rejected), time.perf_counter() - start)
+            if rejected:
+                return False
+        return True
+
+    def score_tile(self, grid: TileGrid, tile: TileView) -> Dict[str, float]:
+        """
+        Score a kept tile by each filter having a score, see `TileFilter.score_tile`.
+
+        Args:
+            grid (TileGrid): Grid of the tile.
+            tile (TileView): The tile.
+
+        Returns:
+            Dict[str, float]: Score of each filter, under "{name}_fraction".
+        """
+        scores = {}
+        for filter_ in self.filters:
+            score = filter_.score_tile(grid, tile)
+            if score is not None:
+                scores[f"{filter_.name}_fraction"] = score
+        return scores
+
+    def update(self, name: str, tiles: int, rejected: int, duration: float):
+        """
+        Add the evaluation of tiles by a filter to the statistics.
+        """
+        statistics = self.statistics[name]
+        statistics["tiles"] += tiles
+        statistics["rejected"] += rejected
+        statistics["time"] += duration
+
+    @staticmethod
+    def merge_statistics(statistics_list: List[Dict[str, Dict]]) -> Dict[str, Dict]:
+        """
+        Sum the statistics of several chains, e.g. read from the manifest records.
+
+        Args:
+            statistics_list (List[Dict[str, Dict]]): Statistics of each chain.
+
+        Returns:
+            Dict[str, Dict]: Summed statistics, by filter.
+        """
+        merged = {}
+        for statistics in statistics_list:
+            for name, values in statistics.items():
+                total = merged.setdefault(name, {"tiles": 0, "rejected": 0, "time": 0.0})
+                for key, value in values.items():
+                    total[key] += value
+        return merged
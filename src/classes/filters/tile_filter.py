@@ -0,0 +1,313 @@
+"""
+Tile filter classes.
+"""
+
+import hashlib
+from typing import Dict, Optional
+
+import numpy as np
+import shapely
+
+from classes.filters.filter import Filter
+from classes.integral_images.integral_image import IntegralImage
+from classes.tile_grids.tile_grid import TileGrid
+from classes.tile_views.tile_view import TileView
+
+# Data a filter reads, from the cheapest to the most expensive to load
+NEEDS = ["geometry", "overview", "pixels", "labels"]
+
+
+class TileFilter:
+    """
+    Base class of the filters of a `FilterChain`.
+
+    A filter declares the data it reads (`needs`, one of `NEEDS`), loaded by
+    `load` before it is evaluated, and its cost among the filters reading the
+    same data. A `local` filter only reads the pixels of the tile it evaluates,
+    so it can also be evaluated on a single tile window with `reject_tile`.
+    A filter may also score the kept tiles with `score_tile`, for the tile index.
+    """
+
+    name = "filter"
+    needs = "geometry"
+    cost = 0
+    local = False
+
+    def load(self, grid: TileGrid):
+        """
+        Load the data of the grid read by the filter.
+
+        Args:
+            grid (TileGrid): Tiles of the image.
+        """
+        return
+
+    def reject_tiles(self, grid: TileGrid, candidates: np.ndarray) -> np.ndarray:
+        """
+        Evaluate tiles of a grid.
+
+        Args:
+            grid (TileGrid): Tiles of the image.
+            candidates (np.ndarray): Positions in the grid of the tiles to evaluate.
+
+        Returns:
+            np.ndarray: For each candidate, True if it is rejected.
+        """
+        raise NotImplementedError()
+
+    def reject_tile(self, tile: TileView, grid: Optional[TileGrid] = None) -> bool:
+        """
+        Evaluate a single tile, for local filters.
+
+        Args:
+            tile (TileView): The tile.
+            grid (Optional[TileGrid]): Grid of the tile, for filters counting the tiles of an image.
+
+        Returns:
+            bool: True if the tile is rejected.
+        """
+        raise NotImplementedError()
+
+    def score_tile(self, grid: TileGrid, tile: TileView) -> Optional[float]:
+        """
+        Score a kept tile, e.g. its proportion of black pixels.
+
+        Args:
+            grid (TileGrid): Tiles of the image.
+            tile (TileView): The tile.
+
+        Returns:
+            Optional[float]: The score, None if the filter has no score.
+        """
+        return None
+
+
+class RoiFilter(TileFilter):
+    """
+    Reject the tiles outside the ROI, from their geometry only.
+    """
+
+    name = "roi"
+    needs = "geometry"
+
+    def __init__(self, roi_geometry):
+        """
+        Constructor.
+
+        Args:
+            roi_geometry: Geometry of the ROI, in the CRS of the images.
+        """
+        self.roi_geometry = roi_geometry
+        shapely.prepare(self.roi_geometry)
+
+    def load(self, grid: TileGrid):
+        grid.boxes
+
+    def reject_tiles(self, grid: TileGrid, candidates: np.ndarray) -> np.ndarray:
+        return ~shapely.intersects(self.roi_geometry, grid.boxes[candidates])
+
+
+class OverviewFilter(TileFilter):
+    """
+    Reject the tiles certain to be rejected by the black filter, from an
+    overview of the image, see `Filter.bound_black_tiles`.
+    """
+
+    name = "prefilter"
+    needs = "overview"
+
+    def __init__(self, black_parameters: Dict, overview_factor: int = 8):
+        """
+        Constructor.
+
+        Args:
+            black_parameters (Dict): Parameters of the black filter.
+            overview_factor (int): Resolution reduction of the overview.
+        """
+        self.black_parameters = black_parameters
+        self.overview_factor = overview_factor
+
+    def load(self, grid: TileGrid):
+        grid.get_overview(self.overview_factor)
+
+    def reject_tiles(self, grid: TileGrid, candidates: np.ndarray) -> np.ndarray:
+        rejected = Filter().bound_black_tiles(
+            grid.get_overview(self.overview_factor),
+            [grid.indices[k] for k in candidates],
+            self.overview_factor,
+            **self.black_parameters,
+        )
+        return np.array(rejected, dtype=bool)
+
+
+class BlackFilter(TileFilter):
+    """
+    Reject the tiles with a significant proportion of black pixels, see
+    `Filter.is_too_black_tiles`.
+    """
+
+    name = "black"
+    needs = "pixels"
+    cost = 1
+    local = True
+
+    def __init__(self, black_value_threshold: int = 100, black_area_threshold: float = 0.5):
+        """
+        Constructor.
+
+        Args:
+            black_value_threshold (int): The intensity threshold to consider a pixel as black.
+            black_area_threshold (float): The threshold for the proportion of black pixels in a tile.
+        """
+        self.black_value_threshold = black_value_threshold
+        self.black_area_threshold = black_area_threshold
+
+    def load(self, grid: TileGrid):
+        grid.image
+
+    def reject_tiles(self, grid: TileGrid, candidates: np.ndarray) -> np.ndarray:
+        is_black = Filter().is_too_black_tiles(
+            grid.image,
+            [grid.indices[k] for k in candidates],
+            self.black_value_threshold,
+            self.black_area_threshold,
+        )
+        return np.array(is_black, dtype=bool)
+
+    def reject_tile(self, tile: TileView, grid: Optional[TileGrid] = None) -> bool:
+        return Filter().is_too_black(tile, self.black_value_threshold, self.black_area_threshold)
+
+    def score_tile(self, grid: TileGrid, tile: TileView) -> float:
+        """
+        Proportion of black pixels of the tile.
+        """
+        gray_image = Filter.to_integer_grayscale(tile.array[:3])
+        return float(np.count_nonzero(gray_image < self.black_value_threshold * 10_000) / gray_image.size)
+
+
+class CloudFilter(TileFilter):
+    """
+    Reject the tiles more than half covered by clouds. The cloud mask needs
+    the connected components of the whole image: it is the most expensive
+    filter, computed on the grayscale image.
+    """
+
+    name = "cloud"
+    needs = "pixels"
+    cost = 2
+
+    def __init__(self, threshold_center: float = 0.7, threshold_full: float = 0.4, min_relative_size: float = 0.0125):
+        """
+        Constructor.
+
+        Args:
+            threshold_center (float): The intensity threshold for center clouds.
+            threshold_full (float): The intensity threshold for full clouds.
+            min_relative_size (float): The minimum relative size of a cloud cluster.
+        """
+        self.threshold_center = threshold_center
+        self.threshold_full = threshold_full
+        self.min_relative_size = min_relative_size
+
+    def load(self, grid: TileGrid):
+        self.get_mask(grid)
+
+    def get_mask(self, grid: TileGrid) -> np.ndarray:
+        """
+        Cloud mask of the image of a grid, computed once for all tile sizes.
+
+        Args:
+            grid (TileGrid): Tiles of the image.
+
+        Returns:
+            np.ndarray: Cloud mask of the image.
+        """
+        parameters = (self.threshold_center, self.threshold_full, self.min_relative_size)
+        return grid.get_cached(
+            (self.name, parameters),
+            lambda: Filter().create_mask_cloud(grid.grayscale, *parameters),
+        )
+
+    def reject_tiles(self, grid: TileGrid, candidates: np.ndarray) -> np.ndarray:
+        indices = [grid.indices[k] for k in candidates]
+        integral_image = IntegralImage(self.get_mask(grid).view(bool), IntegralImage.get_block_size(indices))
+        return integral_image.mean_tiles(indices) > 0.5
+
+    def score_tile(self, grid: TileGrid, tile: TileView) -> float:
+        """
+        Proportion of cloud pixels of the tile, from the mask of the image.
+        """
+        return float(self.get_mask(grid)[slice(*tile.rows), slice(*tile.cols)].view(bool).mean())
+
+
+class SamplingFilter(TileFilter):
+    """
+    Sample the tiles from their label, before they are saved: tiles with too
+    few labeled pixels are only kept with a given probability, and the number
+    of tiles kept for each majority class of an image can be capped.
+
+    Decisions are deterministic: the draw of a tile only depends on its bounds,
+    and quotas are counted in the order of the grid, in windowed mode as well.
+    """
+
+    name = "sampling"
+    needs = "labels"
+    cost = 0
+    local = True
+
+    def __init__(
+        self,
+        min_positive_ratio: float = 0.0,
+        empty_keep_probability: float = 1.0,
+        class_quotas: Optional[Dict[int, int]] = None,
+        background: int = 0,
+        seed: int = 0,
+    ):
+        """
+        Constructor.
+
+        Args:
+            min_positive_ratio (float): Proportion of labeled (non background) pixels
+                under which a tile is considered empty.
+            empty_keep_probability (float): Probability to keep an empty tile.
+            class_quotas (Optional[Dict[int, int]]): Maximum number of tiles kept per
+                image and tile size, by majority class of the tile (e.g. COSIA `numero`).
+                Quotas are not shared between images.
+            background (int): Class of the pixels without label.
+            seed (int): Seed of the draws of the empty tiles.
+        """
+        self.min_positive_ratio = min_positive_ratio
+        self.empty_keep_probability = empty_keep_probability
+        self.class_quotas = {int(k): int(v) for k, v in (class_quotas or {}).items()}
+        self.background = background
+        self.seed = seed
+
+    def load(self, grid: TileGrid):
+        grid.label
+
+    def reject_tiles(self, grid: TileGrid, candidates: np.ndarray) -> np.ndarray:
+        return np.array([self.reject_tile(grid.get_tile(k), grid) for k in candidates], dtype=bool)
+
+    def reject_tile(self, tile: TileView, grid: Optional[TileGrid] = None) -> bool:
+        counts = np.bincount(tile.label.ravel(), minlength=self.background + 1)
+        positive_ratio = 1 - counts[self.background] / tile.label.size
+        if positive_ratio <= 0 or positive_ratio < self.min_positive_ratio:
+            if self.draw(tile) >= self.empty_keep_probability:
+                return True
+        if not self.class_quotas:
+            return False
+
+        # Tiles kept for each class of the image, shared by the tiles of a grid
+        kept = grid.get_cached((self.name, grid.tiles_size), dict) if grid is not None else {}
+        majority = int(np.argmax(counts))
+        if kept.get(majority, 0) >= self.class_quotas.get(majority, np.inf):
+            return True
+        kept[majority] = kept.get(majority, 0) + 1
+        return False
+
+    def draw(self, tile: TileView) -> float:
+        """
+        Uniform draw in [0, 1) from the seed and the bounds of the tile.
+        """
+        key = f"{self.seed}:{tile.crs}:{','.join(f'{bound:.3f}' for bound in tile.bounds)}"
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big") / 2**64
@@ -0,0 +1,149 @@
+"""
+Integral image class.
+"""
+
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class IntegralImage:
+    """
+    Summed-area table of a 2D array.
+
+    Built once from the array, it gives the sum of the array over any
+    rectangle with four lookups: statistics of tiles of any size, stride or
+    offset, overlapping or not, are then vectorized queries which do not read
+    the pixels again.
+
+    The table can be built over square blocks of `block_size` pixels rather
+    than pixels, which makes it much cheaper to build and to store. Only
+    rectangles with borders multiple of the block size can then be queried:
+    `get_block_size` gives the largest block size suited to a set of tiles.
+    """
+
+    def __init__(self, array: np.ndarray, block_size: int = 1):
+        """
+        Constructor.
+
+        Args:
+            array (np.ndarray): 2D boolean or integer array.
+            block_size (int): Side of the blocks of pixels summed in the table.
+        """
+        height, width = array.shape
+        max_value = 1 if array.dtype == bool else np.iinfo(array.dtype).max
+        dtype = np.int32 if array.size * max_value < 2**31 else np.int64
+        self.block_size = block_size
+        self.shape = (height, width)
+
+        # Sums of the blocks, pixels of incomplete blocks at the bottom and right edges cannot be queried
+        n_rows, n_cols = height // block_size, width // block_size
+        blocks = array[: n_rows * block_size, : n_cols * block_size]
+        if block_size > 1:
+            blocks = blocks.reshape(n_rows, block_size, -1).sum(axis=1, dtype=dtype)
+            blocks = blocks.reshape(n_rows, n_cols, block_size).sum(axis=2)
+
+        # table[i, j] is the sum of the blocks before row i and column j
+        self.table = np.zeros((n_rows + 1, n_cols + 1), dtype=dtype)
+        np.cumsum(blocks, axis=0, dtype=dtype, out=self.table[1:, 1:])
+        np.cumsum(self.table[1:, 1:], axis=1, out=self.table[1:, 1:])
+
+    @staticmethod
+    def get_block_size(*indices: List) -> int:
+        """
+        Largest block size with which all the given tiles can be queried.
+
+        Args:
+            *indices (List): Lists of tile borders, as returned by
+                `generate_tiles_borders` or `get_windows`.
+
+        Returns:
+            int: Greatest common divisor of the tile borders.
+        """
+        return math.gcd(*np.unique(np.concatenate([np.ravel(tiles) for tiles in indices])).tolist()) or 1
+
+    def sum(self, row_min: np.ndarray, row_max: np.ndarray, col_min: np.ndarray, col_max: np.ndarray) -> np.ndarray:
+        """
+        Sum the array over rectangles, given by their pixel (exclusive) bounds.
+
+        Args:
+            row_min (np.ndarray): First row of each rectangle.
+            row_max (np.ndarray): Row after the last one of each rectangle.
+            col_min (np.ndarray): First column of each rectangle.
+            col_max (np.ndarray): Column after the last one of each rectangle.
+
+        Returns:
+            np.ndarray: Sum of the array over each rectangle.
+        """
+        bounds = np.stack([row_min, row_max, col_min, col_max])
+        if np.any(bounds % self.block_size):
+            raise ValueError(f"Rectangle borders should be multiples of the block size {self.block_size}.")
+        row_min, row_max, col_min, col_max = bounds // self.block_size
+
+        table = self.table
+        return table[row_max, col_max] - table[row_min, col_max] - table[row_max, col_min] + table[row_min, col_min]
+
+    def sum_tiles(self, indices: List) -> np.ndarray:
+        """
+        Sum the array over tiles.
+
+        Args:
+            indices (List): Tile borders ((row_min, row_max), (col_min, col_max)), as
+                returned by `generate_tiles_borders` or `get_windows`.
+
+        Returns:
+            np.ndarray: Sum of the array over each tile.
+        """
+        (row_min, row_max), (col_min, col_max) = np.array(indices, dtype=np.int64).reshape(-1, 2, 2).transpose(1, 2, 0)
+        return self.sum(row_min, row_max, col_min, col_max)
+
+    def mean_tiles(self, indices: List) -> np.ndarray:
+        """
+        Average the array over tiles, e.g. the fraction of each tile covered by a mask.
+
+        Args:
+            indices (List): Tile borders, as returned by `generate_tiles_borders` or `get_windows`.
+
+        Returns:
+            np.ndarray: Mean of the array over each tile.
+        """
+        (row_min, row_max), (col_min, col_max) = np.array(indices, dtype=np.int64).reshape(-1, 2, 2).transpose(1, 2, 0)
+        return self.sum(row_min, row_max, col_min, col_max) / ((row_max - row_min) * (col_max - col_min))
+
+    @staticmethod
+    def get_windows(
+        height: int,
+        width: int,
+        tiles_size: int,
+        stride: Optional[int] = None,
+        offset: Tuple[int, int] = (0, 0),
+    ) -> List:
+        """
+        Borders of square windows sliding over an image. As in
+        `generate_tiles_borders`, the last windows of a row or column are moved
+        back inside the image, so that all windows have the same size.
+
+        Args:
+            height (int): Height of the image.
+            width (int): Width of the image.
+            tiles_size (int): Side of the windows.
+            stride (Optional[int]): Step between two windows, `tiles_size` by default.
+            offset (Tuple[int, int]): Row and column of the first window.
+
+        Returns:
+            List: Window borders ((row_min, row_max), (col_min, col_max)). With the
+                default stride and offset, the same as `generate_tiles_borders`.
+        """
+        if tiles_size > height or tiles_size > width:
+            raise ValueError("The size of the tile should be smaller than the size of the original image.")
+        stride = stride or tiles_size
+
+        def starts(size: int, start: int) -> List[int]:
+            return sorted({min(position, size - tiles_size) for position in range(start, size, stride)})
+
+        return [
+            ((row, row + tiles_size), (col, col + tiles_size))
+            for row in starts(height, offset[0])
+            for col in starts(width, offset[1])
+        ]
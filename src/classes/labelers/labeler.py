@@ -2,14 +2,29 @@
 Labeler classes.
 """
 
+import hashlib
+import json
+import os
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
+import geopandas as gpd
 import numpy as np
 import pandas as pd
+import rasterio
+import rasterio.errors
+import rasterio.shutil
 import requests
+import shapely
+from affine import Affine
 from astrovision.data import SatelliteImage
 from rasterio.features import rasterize
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+from shapely import STRtree
+from tqdm import tqdm
 
 from functions import download_data
 
@@ -24,6 +39,8 @@ class Labeler(ABC):
         year: str,
         dep: str,
         task: str,
+        crs_list: Optional[List[str]] = None,
+        extent: Optional[gpd.GeoSeries] = None,
     ):
         """
         Constructor.
@@ -32,13 +49,130 @@ class Labeler(ABC):
             year (Literal): Year.
             dep (Literal): Departement.
             task (Literal): task
+            crs_list (Optional[List[str]]): CRS of the images to label, the
+                labeling data is reprojected and indexed once in each of them.
+            extent (Optional[gpd.GeoSeries]): Area of interest, labeling data
+                far from it is not loaded.
         """
         self.year = year
         self.dep = dep
         self.task = task
+        self.crs_list = crs_list or []
+        self.extent = extent
+        self.geometries = {}
+        self.trees = {}
+        self.label_rasters = {}
         if task not in ["segmentation", "detection"]:
             raise NotImplementedError("Task must be 'segmentation'or 'detection'.")
 
+    def build_indexes(self):
+        """
+        Project and index the labeling data in every CRS of `crs_list`.
+        Called by subclasses once their labeling data is loaded, so that the
+        work is done in the parent process before workers are forked.
+        """
+        for crs in self.crs_list:
+            self.get_tree(crs)
+
+    def get_geometries(self, crs: str) -> np.ndarray:
+        """
+        Return the labeling geometries in a given CRS.
+
+        Reprojections are cached by CRS: the projections of `crs_list` are
+        computed in the parent process when the labeler is built, so workers
+        only get already projected geometries.
+
+        Args:
+            crs (str): Target CRS.
+
+        Returns:
+            np.ndarray: Array of shapely geometries, in the row order of
+                `labeling_data`.
+        """
+        if crs not in self.geometries:
+            geometry = self.labeling_data.geometry
+            if geometry.crs != crs:
+                geometry = geometry.to_crs(crs)
+            self.geometries[crs] = geometry.to_numpy()
+        return self.geometries[crs]
+
+    def get_tree(self, crs: str) -> STRtree:
+        """
+        Return the packed spatial index of the labeling geometries in a given CRS.
+
+        Args:
+            crs (str): Target CRS.
+
+        Returns:
+            STRtree: Spatial index over `get_geometries(crs)`.
+        """
+        if crs not in self.trees:
+            self.trees[crs] = STRtree(self.get_geometries(crs))
+        return self.trees[crs]
+
+    def query(self, bounds: Tuple[float], crs: str) -> np.ndarray:
+        """
+        Return the positions of the labeling geometries intersecting a box.
+
+        Args:
+            bounds (Tuple[float]): Box bounds (xmin, ymin, xmax, ymax).
+            crs (str): CRS of the bounds.
+
+        Returns:
+            np.ndarray: Sorted integer positions in `labeling_data`.
+        """
+        return np.sort(self.get_tree(crs).query(shapely.box(*bounds), predicate="intersects"))
+
+    def query_many(self, bounds_list: List[Tuple[float]], crs: str) -> List[np.ndarray]:
+        """
+        Return the positions of the labeling geometries intersecting each of
+        several boxes (tiles, images) with a single index traversal.
+
+        Args:
+            bounds_list (List[Tuple[float]]): Boxes bounds (xmin, ymin, xmax, ymax).
+            crs (str): CRS of the bounds.
+
+        Returns:
+            List[np.ndarray]: Sorted integer positions in `labeling_data`, one
+                array per box.
+        """
+        boxes = shapely.box(*np.asarray(bounds_list, dtype=float).reshape(-1, 4).T)
+        if len(boxes) == 0:
+            return []
+        box_indices, geometry_indices = self.get_tree(crs).query(boxes, predicate="intersects")
+        order = np.lexsort((geometry_indices, box_indices))
+        splits = np.searchsorted(box_indices[order], np.arange(1, len(boxes)))
+        return np.split(geometry_indices[order], splits)
+
+    def has_labels(self, bounds_list: List[Tuple[float]], crs: str) -> List[bool]:
+        """
+        Return whether some labeling geometries may intersect each of several boxes.
+
+        Args:
+            bounds_list (List[Tuple[float]]): Boxes bounds (xmin, ymin, xmax, ymax).
+            crs (str): CRS of the bounds.
+
+        Returns:
+            List[bool]: One flag per box.
+        """
+        return [indices.size > 0 for indices in self.query_many(bounds_list, crs)]
+
+    @abstractmethod
+    def rasterize_labels(self, bounds: Tuple[float], transform: Affine, out_shape: Tuple[int], crs: str) -> np.array:
+        """
+        Rasterize the segmentation labels over a pixel grid.
+
+        Args:
+            bounds (Tuple[float]): Bounds of the grid.
+            transform (Affine): Transform of the grid.
+            out_shape (Tuple[int]): Shape (height, width) of the grid.
+            crs (str): CRS of the grid.
+
+        Returns:
+            np.array: Segmentation mask.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def create_segmentation_label(self, satellite_image: SatelliteImage) -> np.array:
         """
@@ -52,6 +186,120 @@ class Labeler(ABC):
         """
         raise NotImplementedError()
 
+    def build_label_rasters(self, grids: Dict[str, Tuple[Affine, int, int]], directory: str, block_size: int = 4096):
+        """
+        Rasterize the segmentation labels of the whole department once into a
+        tiled and compressed COG per CRS, aligned with the imagery grid. Rasters
+        are named after their CRS and a hash of their grid, so that the grids
+        of different sources do not overwrite each other, and a raster already
+        present in `directory` is only reused if its grid matches. Segmentation
+        labels are then windowed reads of these rasters.
+
+        Args:
+            grids (Dict[str, Tuple[Affine, int, int]]): Transform, width and
+                height of the department grid, by CRS.
+            directory (str): Directory of the label rasters.
+            block_size (int): Side of the blocks rasterized at once.
+        """
+        if self.task != "segmentation":
+            raise NotImplementedError("Label rasters are only available for the segmentation task.")
+
+        os.makedirs(directory, exist_ok=True)
+        for crs, (transform, width, height) in grids.items():
+            grid_hash = hashlib.sha1(json.dumps([list(transform)[:6], width, height]).encode()).hexdigest()[:12]
+            path = os.path.join(directory, f"{crs.replace(':', '_')}_{grid_hash}.tif")
+            if not self.is_label_raster_valid(path, transform, width, height):
+                self.write_label_raster(path, crs, transform, width, height, block_size)
+            self.label_rasters[crs] = path
+
+    @staticmethod
+    def is_label_raster_valid(path: str, transform: Affine, width: int, height: int) -> bool:
+        """
+        Check that a label raster exists and covers exactly the given grid.
+
+        Args:
+            path (str): Path of the label raster.
+            transform (Affine): Transform of the grid.
+            width (int): Width of the grid.
+            height (int): Height of the grid.
+
+        Returns:
+            bool: True if the raster can be reused.
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with rasterio.open(path) as src:
+                return (src.width, src.height) == (width, height) and src.transform.almost_equals(transform)
+        except rasterio.errors.RasterioIOError:
+            return False
+
+    def write_label_raster(self, path: str, crs: str, transform: Affine, width: int, height: int, block_size: int = 4096):
+        """
+        Rasterize the segmentation labels over a grid, block by block, into a COG.
+
+        Args:
+            path (str): Path of the COG.
+            crs (str): CRS of the grid.
+            transform (Affine): Transform of the grid.
+            width (int): Width of the grid.
+            height (int): Height of the grid.
+            block_size (int): Side of the blocks rasterized at once.
+        """
+        windows = [
+            Window(col, row, min(block_size, width - col), min(block_size, height - row))
+            for row in range(0, height, block_size)
+            for col in range(0, width, block_size)
+        ]
+        blocks_bounds = [window_bounds(window, transform) for window in windows]
+
+        tmp_path = f"{path}.tmp"
+        with rasterio.open(
+            tmp_path,
+            "w",
+            driver="GTiff",
+            dtype="uint8",
+            count=1,
+            crs=crs,
+            transform=transform,
+            width=width,
+            height=height,
+            tiled=True,
+            blockxsize=512,
+            blockysize=512,
+            compress="deflate",
+            sparse_ok=True,
+            bigtiff="if_safer",
+        ) as dst:
+            blocks = zip(windows, blocks_bounds, self.has_labels(blocks_bounds, crs))
+            for window, bounds, has_labels in tqdm(blocks, total=len(windows), desc=f"Rasterizing labels ({crs})"):
+                # Empty blocks are left sparse
+                if has_labels:
+                    label = self.rasterize_labels(bounds, window_transform(window, transform), (window.height, window.width), crs)
+                    dst.write(label, 1, window=window)
+
+        # The COG replaces the raster atomically, a run interrupted while copying leaves no partial raster
+        rasterio.shutil.copy(
+            tmp_path, f"{path}.cog.tmp", driver="COG", compress="DEFLATE", blocksize=512, overview_resampling="nearest"
+        )
+        os.replace(f"{path}.cog.tmp", path)
+        os.remove(tmp_path)
+
+    def read_label_raster(self, satellite_image: SatelliteImage) -> np.array:
+        """
+        Read the segmentation label of a SatelliteImage from the label raster of its CRS.
+
+        Args:
+            satellite_image (SatelliteImage): Satellite image.
+
+        Returns:
+            np.array: Segmentation mask.
+        """
+        with rasterio.open(self.label_rasters[satellite_image.crs]) as src:
+            window = from_bounds(*satellite_image.bounds, transform=src.transform)
+            window = Window(*(round(value) for value in (window.col_off, window.row_off, window.width, window.height)))
+            return src.read(1, window=window, out_shape=satellite_image.array.shape[1:], boundless=True, fill_value=0)
+
     def create_label(self, satellite_image: SatelliteImage):
         """
         Create a label for a SatelliteImage.
@@ -62,6 +310,8 @@ class Labeler(ABC):
         """
 
         if self.task == "segmentation":
+            if satellite_image.crs in self.label_rasters:
+                return self.read_label_raster(satellite_image)
             return self.create_segmentation_label(satellite_image)
         elif self.task == "detection":
             return self.create_detection_label(satellite_image)
@@ -75,6 +325,8 @@ class BDTOPOLabeler(Labeler):
         year: str,
         dep: str,
         task: str,
+        crs_list: Optional[List[str]] = None,
+        extent: Optional[gpd.GeoSeries] = None,
     ):
         """
         Constructor.
@@ -82,38 +334,45 @@ class BDTOPOLabeler(Labeler):
         Args:
             labeling_date (datetime): Date of labeling data.
             dep (Literal): Departement.
+            crs_list (Optional[List[str]]): CRS of the images to label.
+            extent (Optional[gpd.GeoSeries]): Area of interest.
         """
-        super(BDTOPOLabeler, self).__init__(year, dep, task)
-        self.labeling_data = download_data.load_bdtopo(year=self.year, dep=self.dep)
-        self.labeling_data["bbox"] = self.labeling_data.geometry.apply(lambda geom: geom.bounds)
-
-    def create_segmentation_label(self, satellite_image: SatelliteImage) -> np.array:
+        super(BDTOPOLabeler, self).__init__(year, dep, task, crs_list, extent)
+        self.labeling_data = download_data.load_bdtopo(year=self.year, dep=self.dep, extent=self.extent)
+        # Buildings kept by the filtered segmentation: small habitations or undefined
+        # (usages are only available in the BATIMENT layer, from 2019)
+        self.is_small_habitation = None
+        if {"USAGE1", "HAUTEUR"}.issubset(self.labeling_data.columns):
+            self.is_small_habitation = (
+                self.labeling_data["USAGE1"].isin(["Indifférencié", "Résidentiel"]) & (self.labeling_data["HAUTEUR"] <= 7.0)
+            ).to_numpy()
+        self.build_indexes()
+
+    def rasterize_labels(self, bounds: Tuple[float], transform: Affine, out_shape: Tuple[int], crs: str) -> np.array:
         """
-        Create a segmentation label (mask) from BDTOPO data for a
-        SatelliteImage.
+        Rasterize the BDTOPO buildings over a pixel grid.
 
         Args:
-            satellite_image (SatelliteImage): Satellite image.
+            bounds (Tuple[float]): Bounds of the grid.
+            transform (Affine): Transform of the grid.
+            out_shape (Tuple[int]): Shape (height, width) of the grid.
+            crs (str): CRS of the grid.
 
         Returns:
             np.array: Segmentation mask.
         """
-        if self.labeling_data.crs != satellite_image.crs:
-            self.labeling_data.geometry = self.labeling_data.geometry.to_crs(satellite_image.crs)
-
         # Filtering geometries from BDTOPO
-        xmin, ymin, xmax, ymax = satellite_image.bounds
-        patch = self.labeling_data.cx[xmin:xmax, ymin:ymax].copy()
+        indices = self.query(bounds, crs)
 
-        if patch.empty:
-            rasterized = np.zeros(satellite_image.array.shape[1:], dtype=np.uint8)
+        if indices.size == 0:
+            rasterized = np.zeros(out_shape, dtype=np.uint8)
         else:
             rasterized = rasterize(
-                patch.geometry,
-                out_shape=satellite_image.array.shape[1:],
+                self.get_geometries(crs)[indices],
+                out_shape=out_shape,
                 fill=0,
                 out=None,
-                transform=satellite_image.transform,
+                transform=transform,
                 all_touched=True,
                 default_value=1,
                 dtype=None,
@@ -121,6 +380,21 @@ class BDTOPOLabeler(Labeler):
 
         return rasterized
 
+    def create_segmentation_label(self, satellite_image: SatelliteImage) -> np.array:
+        """
+        Create a segmentation label (mask) from BDTOPO data for a
+        SatelliteImage.
+
+        Args:
+            satellite_image (SatelliteImage): Satellite image.
+
+        Returns:
+            np.array: Segmentation mask.
+        """
+        return self.rasterize_labels(
+            satellite_image.bounds, satellite_image.transform, satellite_image.array.shape[1:], satellite_image.crs
+        )
+
     def create_segmentation_label_filtered(self, satellite_image: SatelliteImage) -> np.array:
         """
         Create a filtered segmentation label (mask) from BDTOPO
@@ -133,26 +407,20 @@ class BDTOPOLabeler(Labeler):
         Returns:
             np.array: Segmentation mask.
         """
-        if self.labeling_data.crs != satellite_image.crs:
-            self.labeling_data.geometry = self.labeling_data.geometry.to_crs(satellite_image.crs)
-
         # Filtering geometries from BDTOPO
-        xmin, ymin, xmax, ymax = satellite_image.bounds
-        patch = self.labeling_data.cx[xmin:xmax, ymin:ymax].copy()
-
-        patch11 = patch[patch["USAGE1"] == "Indifférencié"]
-        patch12 = patch[patch["USAGE1"] == "Résidentiel"]
+        indices = self.query(satellite_image.bounds, satellite_image.crs)
 
-        patch2 = pd.concat([patch11, patch12], ignore_index=True)
+        if self.is_small_habitation is None:
+            raise ValueError("labeling_data must contain 'USAGE1' and 'HAUTEUR' columns.")
 
-        # threshold
-        patch_petite_hab = patch2[patch2["HAUTEUR"] <= 7.0]
+        # Keep habitations or undefined buildings under the height threshold
+        indices = indices[self.is_small_habitation[indices]]
 
-        if patch_petite_hab.empty:
+        if indices.size == 0:
             rasterized = np.zeros(satellite_image.array.shape[1:], dtype=np.uint8)
         else:
             rasterized = rasterize(
-                patch_petite_hab.geometry,
+                self.get_geometries(satellite_image.crs)[indices],
                 out_shape=satellite_image.array.shape[1:],
                 fill=0,
                 out=None,
@@ -204,19 +472,18 @@ class BDTOPOLabeler(Labeler):
             List[Tuple[int]]: Object detection label.
         """
 
-        if self.labeling_data.crs != satellite_image.crs:
-            self.labeling_data.geometry = self.labeling_data.geometry.to_crs(satellite_image.crs)
-
         image_height = satellite_image.array.shape[1]
 
         # Filtering geometries from BDTOPO
-        xmin, ymin, xmax, ymax = satellite_image.bounds
-        patch = self.labeling_data.cx[xmin:xmax, ymin:ymax].copy()
+        indices = self.query(satellite_image.bounds, satellite_image.crs)
 
-        if patch.empty:
+        if indices.size == 0:
             label = np.array([], dtype=np.uint8)
         else:
-            label = patch.geometry.apply(self.geometry_to_pixel_bounds, transform=satellite_image.transform).tolist()
+            label = [
+                self.geometry_to_pixel_bounds(geom, satellite_image.transform)
+                for geom in self.get_geometries(satellite_image.crs)[indices]
+            ]
             label = [tuple(max(min(round(coord), image_height), 0) for coord in bbox) for bbox in label]
             label = [bbox for bbox in label if ((bbox[0] != bbox[2]) and (bbox[1] != bbox[3]))]
         return label
@@ -230,6 +497,10 @@ class COSIALabeler(Labeler):
         year: str,
         dep: str,
         task: str,
+        crs_list: Optional[List[str]] = None,
+        extent: Optional[gpd.GeoSeries] = None,
+        lazy: bool = False,
+        cache_size: int = 64,
     ):
         """
         Constructor.
@@ -237,10 +508,20 @@ class COSIALabeler(Labeler):
         Args:
             labeling_date (datetime): Date of labeling data.
             dep (Literal): Departement.
+            crs_list (Optional[List[str]]): CRS of the images to label.
+            extent (Optional[gpd.GeoSeries]): Area of interest.
+            lazy (bool): If True, only the extents of the GPKG files are
+                loaded upfront, and each file is read when an image
+                intersects it.
+            cache_size (int): Number of GPKG files kept in memory by each
+                process in lazy mode.
         """
-        super(COSIALabeler, self).__init__(year, dep, task)
-        self.labeling_data = download_data.load_cosia(year=self.year, dep=self.dep)
-        self.labeling_data["bbox"] = self.labeling_data.geometry.apply(lambda geom: geom.bounds)
+        super(COSIALabeler, self).__init__(year, dep, task, crs_list, extent)
+        self.lazy = lazy
+        self.cache_size = cache_size
+        # GPKG files read in lazy mode, by (file path, CRS), least recently used first
+        self.files = OrderedDict()
+        self.footprints_trees = {}
         id2label = (
             pd.DataFrame.from_dict(
                 requests.get("https://minio.lab.sspcloud.fr/projet-slums-detection/data-label/COSIA/cosia-id2label.json").json(),
@@ -270,47 +551,173 @@ class COSIALabeler(Labeler):
             "#222222",
         ]
         self.label_infos = id2label
-        self.labeling_data = self.labeling_data.loc[:, [c for c in self.labeling_data.columns if c != "numero"]].merge(
-            self.label_infos, on="classe"
-        )
 
-    def create_segmentation_label(self, satellite_image: SatelliteImage) -> np.array:
+        if self.lazy:
+            self.labeling_data = None
+            self.footprints = download_data.get_cosia_footprints(year=self.year, dep=self.dep)
+            if self.extent is not None:
+                self.footprints = self.footprints[
+                    self.footprints.intersects(self.extent.to_crs(self.footprints.crs).union_all())
+                ].reset_index(drop=True)
+        else:
+            self.labeling_data = download_data.load_cosia(year=self.year, dep=self.dep, extent=self.extent)
+            self.labeling_data = self.labeling_data.loc[:, [c for c in self.labeling_data.columns if c != "numero"]].merge(
+                self.label_infos, on="classe"
+            )
+            # Ensure the labeling data contains a 'numero' column with class IDs
+            if "numero" not in self.labeling_data.columns:
+                raise ValueError("labeling_data must contain a 'numero' column with class IDs.")
+            self.class_ids = self.labeling_data["numero"].astype(int).to_numpy()
+        self.build_indexes()
+
+    def build_indexes(self):
         """
-        Create a segmentation label (mask) with multiple classes from CoSIA data for a SatelliteImage.
+        Project and index the labeling data, or the extents of the GPKG files
+        in lazy mode, in every CRS of `crs_list`.
+        """
+        if not self.lazy:
+            return super(COSIALabeler, self).build_indexes()
+        for crs in self.crs_list:
+            self.get_footprints_tree(crs)
+
+    def get_footprints_tree(self, crs: str) -> STRtree:
+        """
+        Return the spatial index of the GPKG files extents in a given CRS.
 
         Args:
-            satellite_image (SatelliteImage): Satellite image.
+            crs (str): Target CRS.
 
         Returns:
-            np.array: Segmentation mask with class IDs.
+            STRtree: Spatial index over the rows of `footprints`.
         """
-        if self.labeling_data.crs != satellite_image.crs:
-            self.labeling_data.geometry = self.labeling_data.geometry.to_crs(satellite_image.crs)
+        if crs not in self.footprints_trees:
+            geometry = self.footprints.geometry
+            if geometry.crs != crs:
+                geometry = geometry.to_crs(crs)
+            self.footprints_trees[crs] = STRtree(geometry.to_numpy())
+        return self.footprints_trees[crs]
+
+    def get_file(self, file_path: str, crs: str) -> Tuple[np.ndarray, np.ndarray, STRtree]:
+        """
+        Return the polygons of a GPKG file projected in a given CRS, reading
+        the file if it is not among the `cache_size` most recently used.
 
-        # Filtering geometries within the bounds of the satellite image
-        xmin, ymin, xmax, ymax = satellite_image.bounds
-        patch = self.labeling_data.cx[xmin:xmax, ymin:ymax].copy()
+        Args:
+            file_path (str): S3 path of the GPKG file.
+            crs (str): Target CRS.
 
-        if patch.empty:
-            # Return a mask filled with zeros (background class ID 0)
-            rasterized = np.zeros(satellite_image.array.shape[1:], dtype=np.uint8)
+        Returns:
+            Tuple[np.ndarray, np.ndarray, STRtree]: Geometries, class IDs and
+                spatial index of the polygons.
+        """
+        key = (file_path, crs)
+        if key in self.files:
+            self.files.move_to_end(key)
+            return self.files[key]
+
+        gdf = download_data.read_cosia_file(file_path)
+        if gdf.crs != crs:
+            gdf = gdf.to_crs(crs)
+        class_ids = gdf["classe"].map(self.label_infos.set_index("classe")["numero"])
+        known = class_ids.notna().to_numpy()
+        geometries = gdf.geometry.to_numpy()[known]
+
+        self.files[key] = (geometries, class_ids[known].astype(int).to_numpy(), STRtree(geometries))
+        if len(self.files) > self.cache_size:
+            self.files.popitem(last=False)
+        return self.files[key]
+
+    def query_files(self, bounds: Tuple[float], crs: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the polygons intersecting a box, reading only the GPKG files
+        whose extents intersect it.
+
+        Args:
+            bounds (Tuple[float]): Box bounds (xmin, ymin, xmax, ymax).
+            crs (str): CRS of the bounds.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Geometries and class IDs.
+        """
+        geometries, class_ids = [], []
+        for position in np.sort(self.get_footprints_tree(crs).query(shapely.box(*bounds), predicate="intersects")):
+            file_geometries, file_class_ids, tree = self.get_file(self.footprints.loc[position, "file_path"], crs)
+            indices = np.sort(tree.query(shapely.box(*bounds), predicate="intersects"))
+            geometries.append(file_geometries[indices])
+            class_ids.append(file_class_ids[indices])
+
+        if not geometries:
+            return np.array([], dtype=object), np.array([], dtype=int)
+        return np.concatenate(geometries), np.concatenate(class_ids)
+
+    def has_labels(self, bounds_list: List[Tuple[float]], crs: str) -> List[bool]:
+        """
+        Return whether some labeling geometries may intersect each of several
+        boxes. In lazy mode, the extents of the GPKG files are queried.
+
+        Args:
+            bounds_list (List[Tuple[float]]): Boxes bounds (xmin, ymin, xmax, ymax).
+            crs (str): CRS of the bounds.
+
+        Returns:
+            List[bool]: One flag per box.
+        """
+        if not self.lazy:
+            return super(COSIALabeler, self).has_labels(bounds_list, crs)
+        boxes = shapely.box(*np.asarray(bounds_list, dtype=float).reshape(-1, 4).T)
+        box_indices, _ = self.get_footprints_tree(crs).query(boxes, predicate="intersects")
+        return np.isin(np.arange(len(boxes)), box_indices).tolist()
+
+    def rasterize_labels(self, bounds: Tuple[float], transform: Affine, out_shape: Tuple[int], crs: str) -> np.array:
+        """
+        Rasterize the CoSIA classes over a pixel grid.
+
+        Args:
+            bounds (Tuple[float]): Bounds of the grid.
+            transform (Affine): Transform of the grid.
+            out_shape (Tuple[int]): Shape (height, width) of the grid.
+            crs (str): CRS of the grid.
+
+        Returns:
+            np.array: Segmentation mask with class IDs.
+        """
+        # Filtering geometries within the bounds of the grid
+        if self.lazy:
+            geometries, class_ids = self.query_files(bounds, crs)
         else:
-            # Ensure the patch contains a 'class_id' column
-            if "numero" not in patch.columns:
-                raise ValueError("labeling_data must contain a 'numero' column with class IDs.")
+            indices = self.query(bounds, crs)
+            geometries, class_ids = self.get_geometries(crs)[indices], self.class_ids[indices]
 
+        if geometries.size == 0:
+            # Return a mask filled with zeros (background class ID 0)
+            rasterized = np.zeros(out_shape, dtype=np.uint8)
+        else:
             # Prepare geometries and class IDs for rasterization
-            shapes = ((geom, int(class_id)) for geom, class_id in zip(patch.geometry, patch["numero"]))
+            shapes = zip(geometries, class_ids.tolist())
 
             # Rasterize the shapes into a segmentation mask
             rasterized = rasterize(
                 shapes=shapes,
-                out_shape=satellite_image.array.shape[1:],  # Match satellite image dimensions
+                out_shape=out_shape,
                 fill=0,  # Background class ID
                 out=None,
-                transform=satellite_image.transform,
+                transform=transform,
                 all_touched=True,
                 dtype=np.uint8,
             )
 
         return rasterized
+
+    def create_segmentation_label(self, satellite_image: SatelliteImage) -> np.array:
+        """
+        Create a segmentation label (mask) with multiple classes from CoSIA data for a SatelliteImage.
+
+        Args:
+            satellite_image (SatelliteImage): Satellite image.
+
+        Returns:
+            np.array: Segmentation mask with class IDs.
+        """
+        return self.rasterize_labels(
+            satellite_image.bounds, satellite_image.transform, satellite_image.array.shape[1:], satellite_image.crs
+        )
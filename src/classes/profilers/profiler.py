@@ -0,0 +1,163 @@
+"""
+Profiler class.
+"""
+
+import csv
+import glob
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Metrics measured for each stage, summed over images except the peak RSS
+METRICS = ["wall_time", "cpu_time", "read_bytes", "write_bytes", "peak_rss"]
+
+
+class Profiler:
+    """
+    Per-stage instrumentation of the processing of an image.
+
+    Each stage records its wall time, CPU time, bytes read and written by the
+    process (network included) and peak resident memory. A stage entered
+    several times, e.g. once per tile, accumulates its measures. Stages can
+    be nested: the peak of an enclosing stage includes the peaks of its inner
+    stages.
+    """
+
+    def __init__(self, enabled: bool = True):
+        """
+        Constructor.
+
+        Args:
+            enabled (bool): If False, stages are not measured.
+        """
+        self.enabled = enabled
+        self.stages = {}
+        # Peak RSS of each open stage before the last reset, outermost first
+        self.peaks = []
+
+    @staticmethod
+    def read_io() -> Dict[str, int]:
+        """
+        Return the bytes read and written by the process so far, from
+        /proc/self/io (Linux only).
+        """
+        try:
+            with open("/proc/self/io") as f:
+                io = dict(line.split(": ") for line in f.read().splitlines())
+            return {"read_bytes": int(io["rchar"]), "write_bytes": int(io["wchar"])}
+        except OSError:
+            return {"read_bytes": 0, "write_bytes": 0}
+
+    @staticmethod
+    def reset_peak_rss():
+        """
+        Reset the peak resident memory of the process (Linux only), so that
+        the peak of each stage is measured separately.
+        """
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+    @staticmethod
+    def read_peak_rss() -> int:
+        """
+        Return the peak resident memory of the process in bytes, since the last
+        reset if supported.
+        """
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measure the code run inside the context as stage `name`.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        if self.peaks:
+            # Entering a stage resets the peak, which the enclosing stage keeps so far
+            self.peaks[-1] = max(self.peaks[-1], self.read_peak_rss())
+        self.reset_peak_rss()
+        self.peaks.append(0)
+        io = self.read_io()
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            peak_rss = max(self.peaks.pop(), self.read_peak_rss())
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak_rss)
+            measures = {
+                "wall_time": time.perf_counter() - wall_time,
+                "cpu_time": time.process_time() - cpu_time,
+                **{key: value - io[key] for key, value in self.read_io().items()},
+                "peak_rss": peak_rss,
+            }
+            stage = self.stages.setdefault(name, dict.fromkeys(METRICS, 0))
+            for key, value in measures.items():
+                stage[key] = max(stage[key], value) if key == "peak_rss" else stage[key] + value
+
+    def write_trace(self, path: str, im: str):
+        """
+        Write the measures of the stages of an image to a JSON trace file.
+
+        Args:
+            path (str): Path of the trace file.
+            im (str): Path of the raw image.
+        """
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"image": im, "pid": os.getpid(), "stages": self.stages}, f)
+
+    @staticmethod
+    def write_report(trace_dir: str, report_path: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Aggregate the trace files of all the images into a report, written as
+        JSON and CSV. Measures are summed over the images, except the peak RSS
+        which is the maximum.
+
+        Args:
+            trace_dir (str): Directory of the trace files.
+            report_path (Optional[str]): Path of the report, without extension.
+                Defaults to `report` next to the trace directory.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Aggregated measures, by stage.
+        """
+        report = {}
+        for trace_path in sorted(glob.glob(os.path.join(trace_dir, "*.json"))):
+            with open(trace_path) as f:
+                trace = json.load(f)
+            for name, measures in trace["stages"].items():
+                stage = report.setdefault(name, {"images": 0, **dict.fromkeys(METRICS, 0)})
+                stage["images"] += 1
+                for key in METRICS:
+                    stage[key] = max(stage[key], measures[key]) if key == "peak_rss" else stage[key] + measures[key]
+
+        report_path = report_path or os.path.join(os.path.dirname(os.path.normpath(trace_dir)), "report")
+        with open(f"{report_path}.json", "w") as f:
+            json.dump(report, f, indent=2)
+        with open(f"{report_path}.csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage", "images", *METRICS])
+            writer.writerows([name, stage["images"], *(stage[key] for key in METRICS)] for name, stage in report.items())
+
+        return report
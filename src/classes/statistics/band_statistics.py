@@ -0,0 +1,133 @@
+"""
+Band statistics class.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class BandStatistics:
+    """
+    Streaming per-band mean and variance accumulator.
+
+    Keeps the pixel count, the mean and the sum of squared deviations (M2) of
+    each band. Tiles are added with `update` and accumulators of different
+    workers are combined with `merge` (Chan et al. parallel formula), so the
+    pooled statistics are exact at constant memory.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, array: np.ndarray) -> BandStatistics:
+        """
+        Add the pixels of an image to the statistics.
+
+        Args:
+            array (np.ndarray): Image array in (C, H, W) format.
+
+        Returns:
+            BandStatistics: The updated accumulator.
+        """
+        pixels = array.reshape(array.shape[0], -1)
+        other = BandStatistics()
+        other.count = pixels.shape[1]
+        other.mean = pixels.mean(axis=1, dtype=np.float64)
+        other.m2 = pixels.var(axis=1, dtype=np.float64) * other.count
+        return self.merge(other)
+
+    def merge(self, other: BandStatistics) -> BandStatistics:
+        """
+        Merge the statistics of another accumulator into this one.
+
+        Args:
+            other (BandStatistics): Accumulator to merge.
+
+        Returns:
+            BandStatistics: The updated accumulator.
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @staticmethod
+    def merge_all(statistics: List[BandStatistics]) -> BandStatistics:
+        """
+        Merge a list of accumulators by pairwise tree reduction, which keeps
+        the rounding error low for many accumulators of similar sizes.
+
+        Args:
+            statistics (List[BandStatistics]): Accumulators to merge.
+
+        Returns:
+            BandStatistics: The merged accumulator.
+        """
+        statistics = list(statistics)
+        if not statistics:
+            return BandStatistics()
+        while len(statistics) > 1:
+            statistics = [
+                statistics[i].merge(statistics[i + 1]) if i + 1 < len(statistics) else statistics[i]
+                for i in range(0, len(statistics), 2)
+            ]
+        return statistics[0]
+
+    def to_record(self) -> Dict:
+        """
+        Return the state of the accumulator as JSON-serializable values.
+
+        Returns:
+            Dict: Count, mean and M2 of each band.
+        """
+        return {
+            "count": self.count,
+            "mean": None if self.mean is None else self.mean.tolist(),
+            "m2": None if self.m2 is None else self.m2.tolist(),
+        }
+
+    @staticmethod
+    def from_record(record: Dict) -> BandStatistics:
+        """
+        Create an accumulator from the output of `to_record`.
+
+        Args:
+            record (Dict): Count, mean and M2 of each band.
+
+        Returns:
+            BandStatistics: Accumulator.
+        """
+        statistics = BandStatistics()
+        if record["count"]:
+            statistics.count = record["count"]
+            statistics.mean = np.array(record["mean"], dtype=np.float64)
+            statistics.m2 = np.array(record["m2"], dtype=np.float64)
+        return statistics
+
+    def to_dict(self) -> Dict[str, Optional[List[float]]]:
+        """
+        Return the per-band mean and (population) standard deviation.
+
+        Returns:
+            Dict[str, Optional[List[float]]]: Mean and std of each band, None
+                if no pixel was added.
+        """
+        if self.count == 0:
+            return {"mean": None, "std": None}
+        return {"mean": self.mean.tolist(), "std": np.sqrt(self.m2 / self.count).tolist()}
@@ -0,0 +1,127 @@
+"""
+Tile encoder class.
+"""
+
+import io
+from typing import Dict, Optional
+
+import numpy as np
+from rasterio.io import MemoryFile
+
+from classes.tile_views.tile_view import TileView
+
+# Extension of the image files of each GDAL driver
+IMAGE_EXTENSIONS = {"GTiff": ".tif", "COG": ".tif", "JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+# Extension of the label files of each label format
+LABEL_EXTENSIONS = {"npy": ".npy", "npz": ".npz", "packbits": ".npz"}
+
+
+class TileEncoder:
+    """
+    Encoding of the image and the label of a tile, from an encoding profile of
+    `src/config/encodings.yaml`.
+
+    Images are encoded with a GDAL driver and its creation options, e.g. GTiff
+    with DEFLATE, ZSTD or LZW compression and a predictor, a COG, or JPEG and
+    WebP when lossy compression is acceptable. Pixels are written as "float64",
+    as `SatelliteImage.to_raster`, or in the dtype of the image ("native").
+    Labels are written as `.npy` files, as compressed `.npz` files, or bit-packed
+    in compressed `.npz` files for binary labels ("packbits").
+    """
+
+    def __init__(self, image: Optional[Dict] = None, label: str = "npy"):
+        """
+        Constructor.
+
+        Args:
+            image (Optional[Dict]): "driver" (GTiff by default), "dtype" ("float64"
+                by default, or "native") and creation options of the driver
+                (e.g. "compress", "predictor", "zstd_level", "quality").
+            label (str): Format of the labels, "npy", "npz" or "packbits".
+        """
+        image = dict(image or {})
+        self.driver = image.pop("driver", "GTiff")
+        self.dtype = image.pop("dtype", "float64")
+        self.options = image
+        if self.driver not in IMAGE_EXTENSIONS:
+            raise ValueError(f"Unknown driver {self.driver}, expected one of {', '.join(IMAGE_EXTENSIONS)}.")
+        if label not in LABEL_EXTENSIONS:
+            raise ValueError(f"Unknown label format {label}, expected one of {', '.join(LABEL_EXTENSIONS)}.")
+        self.label = label
+
+    @property
+    def image_ext(self) -> str:
+        return IMAGE_EXTENSIONS[self.driver]
+
+    @property
+    def label_ext(self) -> str:
+        return LABEL_EXTENSIONS[self.label]
+
+    def encode_image(self, tile: TileView) -> bytes:
+        """
+        Encode the image of a tile, georeferenced.
+
+        Args:
+            tile (TileView): The tile.
+
+        Returns:
+            bytes: Content of the image file.
+        """
+        array = tile.array
+        dtype = array.dtype if self.dtype == "native" else np.dtype(self.dtype)
+        profile = {
+            "driver": self.driver,
+            "dtype": dtype.name,
+            "count": array.shape[0],
+            "height": array.shape[1],
+            "width": array.shape[2],
+            "crs": tile.crs,
+            "transform": tile.transform,
+            **self.options,
+        }
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dst:
+                dst.write(array.astype(dtype, copy=False))
+            return memfile.read()
+
+    def encode_label(self, tile: TileView) -> bytes:
+        """
+        Encode the label of a tile.
+
+        Args:
+            tile (TileView): The tile.
+
+        Returns:
+            bytes: Content of the label file.
+        """
+        buffer = io.BytesIO()
+        label = tile.label
+        if self.label == "npy":
+            np.save(buffer, label)
+        elif self.label == "npz":
+            np.savez_compressed(buffer, label=label)
+        else:
+            if label.size and label.max() > 1:
+                raise ValueError("Only binary labels can be bit-packed.")
+            np.savez_compressed(buffer, packed=np.packbits(label.astype(bool)), shape=np.array(label.shape))
+        return buffer.getvalue()
+
+    @staticmethod
+    def decode_label(data: bytes) -> np.ndarray:
+        """
+        Decode a label encoded by `encode_label`, whatever its format.
+
+        Args:
+            data (bytes): Content of the label file.
+
+        Returns:
+            np.ndarray: The label.
+        """
+        content = np.load(io.BytesIO(data))
+        if isinstance(content, np.ndarray):
+            return content
+        if "label" in content:
+            return content["label"]
+        shape = tuple(content["shape"])
+        return np.unpackbits(content["packed"], count=int(np.prod(shape))).reshape(shape)
@@ -0,0 +1,244 @@
+"""
+Tile grid class.
+"""
+
+from functools import cached_property
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from astrovision.data import SatelliteImage
+from astrovision.data.utils import generate_tiles_borders
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+
+from classes.filters.filter import Filter
+from classes.labelers.labeler import Labeler
+from classes.profilers.profiler import Profiler
+from classes.tile_views.tile_view import TileView
+
+
+class TileGrid:
+    """
+    Tiles of a raw image, in the order of `generate_tiles_borders`.
+
+    The data the tile filters need is loaded lazily, at most once, from the
+    cheapest to the most expensive: the tile geometries from the header, an
+    overview, the pixels of the image and its labels. The pixels are the whole
+    image, or in windowed mode a single-band grayscale image built strip by
+    strip, tiles being then read window by window with `read_tile`.
+
+    The data of the image does not depend on the tile size: it is kept in
+    `cache`, shared by the grids of other tile sizes built with `resize`, so
+    that an image is read, labeled and cloud-masked once for all tile sizes.
+    """
+
+    def __init__(
+        self,
+        src: rasterio.DatasetReader,
+        tiles_size: int,
+        n_bands: int,
+        labeler: Optional[Labeler] = None,
+        windowed: bool = False,
+        profiler: Optional[Profiler] = None,
+        cache: Optional[Dict] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            src (rasterio.DatasetReader): Open raw image.
+            tiles_size (int): Side of the tiles in pixels.
+            n_bands (int): Number of bands of the image.
+            labeler (Optional[Labeler]): Labeler of the image, if labels are needed.
+            windowed (bool): If True, the image is never loaded whole.
+            profiler (Optional[Profiler]): Profiler measuring the reads and the labeling.
+            cache (Optional[Dict]): Data of the image, shared with the grids of other tile sizes.
+        """
+        self.src = src
+        self.tiles_size = int(tiles_size)
+        self.n_bands = int(n_bands)
+        self.labeler = labeler
+        self.windowed = windowed
+        self.profiler = profiler or Profiler(enabled=False)
+        self.crs = f"EPSG:{src.crs.to_epsg()}"
+        self.shape = (src.height, src.width)
+        self.indices = generate_tiles_borders(src.height, src.width, self.tiles_size)
+        self.cache = {} if cache is None else cache
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def resize(self, tiles_size: int) -> "TileGrid":
+        """
+        Grid of the same image with another tile size, sharing the data of the
+        image already loaded or loaded later by either grid.
+
+        Args:
+            tiles_size (int): Side of the tiles in pixels.
+
+        Returns:
+            TileGrid: The grid.
+        """
+        return TileGrid(self.src, tiles_size, self.n_bands, self.labeler, self.windowed, self.profiler, self.cache)
+
+    def get_cached(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """
+        Return data of the image from the cache, loaded by `load` the first time.
+
+        Args:
+            key (Hashable): Key of the data.
+            load (Callable[[], Any]): Function loading the data.
+
+        Returns:
+            Any: The data.
+        """
+        if key not in self.cache:
+            self.cache[key] = load()
+        return self.cache[key]
+
+    @cached_property
+    def boxes(self) -> np.ndarray:
+        """
+        Boxes of the tiles in the CRS of the image, with the bounds of
+        `get_bounds_for_tile`, as a shapely array.
+        """
+        (row_min, row_max), (col_min, col_max) = np.array(self.indices, dtype=np.float64).reshape(-1, 2, 2).transpose(1, 2, 0)
+        a, b, c, d, e, f = self.src.transform[:6]
+        left, bottom = col_min * a + row_max * b + c, col_min * d + row_max * e + f
+        right, top = col_max * a + row_min * b + c, col_max * d + row_min * e + f
+        return shapely.box(left, bottom, right, top)
+
+    def get_overview(self, overview_factor: int) -> SatelliteImage:
+        """
+        Read the first 3 bands of the image at a resolution reduced by
+        `overview_factor`, each pixel being the average of a block of
+        `overview_factor` x `overview_factor` pixels. Blocks start at the
+        top-left corner, the pixels of the incomplete blocks at the bottom and
+        right edges are left out. GDAL reads the closest overview, or resolution
+        level of a JPEG2000 image, rather than decoding the image at full resolution.
+
+        Args:
+            overview_factor (int): Resolution reduction factor.
+
+        Returns:
+            SatelliteImage: Reduced-resolution image.
+        """
+        return self.get_cached(("overview", overview_factor), lambda: self.read_overview(overview_factor))
+
+    def read_overview(self, overview_factor: int) -> SatelliteImage:
+        """
+        Read an overview of the image, see `get_overview`.
+        """
+        src = self.src
+        height, width = src.height // overview_factor, src.width // overview_factor
+        window = Window(0, 0, width * overview_factor, height * overview_factor)
+        if height == 0 or width == 0:
+            array = np.zeros((3, height, width), dtype=src.dtypes[0])
+        else:
+            with self.profiler.stage("read"):
+                array = src.read(indexes=[1, 2, 3], window=window, out_shape=(3, height, width), resampling=Resampling.average)
+        transform = src.transform * Affine.scale(overview_factor)
+        return SatelliteImage(array, self.crs, window_bounds(window, src.transform), transform)
+
+    @property
+    def image(self) -> SatelliteImage:
+        """
+        The whole image, read at full resolution.
+        """
+        return self.get_cached("image", self.read_image)
+
+    def read_image(self) -> SatelliteImage:
+        """
+        Read the whole image, see `image`.
+        """
+        with self.profiler.stage("read"):
+            return SatelliteImage.from_raster(file_path=self.src.name, n_bands=self.n_bands)
+
+    @property
+    def label(self) -> np.ndarray:
+        """
+        Label of the whole image.
+        """
+        return self.get_cached("label", self.create_label)
+
+    def create_label(self) -> np.ndarray:
+        """
+        Label the whole image, see `label`.
+        """
+        with self.profiler.stage("label"):
+            return self.labeler.create_label(self.image)
+
+    @property
+    def grayscale(self) -> SatelliteImage:
+        """
+        Single-band grayscale image: built strip by strip in windowed mode,
+        from the whole image otherwise.
+        """
+        return self.get_cached("grayscale", self.create_grayscale)
+
+    def create_grayscale(self) -> SatelliteImage:
+        """
+        Build the grayscale image, see `grayscale`.
+        """
+        src = self.src
+        if not self.windowed:
+            return SatelliteImage(Filter().to_grayscale(self.image.array)[np.newaxis], self.crs, src.bounds, src.transform)
+
+        grayscale = np.empty(self.shape, dtype=src.dtypes[0])
+        for row in range(0, src.height, self.tiles_size):
+            window = Window(0, row, src.width, min(self.tiles_size, src.height - row))
+            with self.profiler.stage("read"):
+                strip = src.read(window=window)
+            grayscale[row : row + window.height] = Filter().to_grayscale(strip)
+        return SatelliteImage(grayscale[np.newaxis], self.crs, src.bounds, src.transform)
+
+    def pixels_read(self) -> bool:
+        """
+        Return True if pixels of the image were read at full resolution, by
+        this grid or by a grid of another tile size.
+        """
+        return "image" in self.cache or "grayscale" in self.cache or self.cache.get("tiles_read", 0) > 0
+
+    def get_tile(self, k: int) -> TileView:
+        """
+        View on the whole image, and on its label if the grid has a labeler,
+        of tile `k`.
+
+        Args:
+            k (int): Position of the tile in the grid.
+
+        Returns:
+            TileView: The tile.
+        """
+        rows, cols = self.indices[k]
+        label = self.label if self.labeler is not None else None
+        return TileView(self.image.array, rows, cols, self.crs, self.src.transform, label)
+
+    def read_tile(self, k: int) -> TileView:
+        """
+        Read the window of tile `k` at full resolution.
+
+        Args:
+            k (int): Position of the tile in the grid.
+
+        Returns:
+            TileView: The tile, on the array of its window.
+        """
+        rows, cols = self.indices[k]
+        with self.profiler.stage("read"):
+            array = self.src.read(window=Window(cols[0], rows[0], self.tiles_size, self.tiles_size))
+        # Counted in the cache, so that the grids of the other tile sizes see the reads
+        self.cache["tiles_read"] = self.cache.get("tiles_read", 0) + 1
+        return TileView(array, rows, cols, self.crs, self.src.transform, offset=(rows[0], cols[0]))
+
+    def get_bytes(self, tiles: Optional[int] = None) -> int:
+        """
+        Size in bytes of the decoded image, or of `tiles` tiles.
+        """
+        n_bands = self.src.count if self.windowed else self.n_bands
+        pixels = self.shape[0] * self.shape[1] if tiles is None else tiles * self.tiles_size**2
+        return pixels * n_bands * np.dtype(self.src.dtypes[0]).itemsize
@@ -0,0 +1,179 @@
+"""
+Tile tensor class.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class TileTensor:
+    """
+    Tiles of a split stored as two contiguous arrays, one row per tile: the
+    images (N, C, S, S) in `images.bin` and the labels (N, S, S) in `labels.bin`,
+    raw in C order, described by the header `tensors.json`.
+
+    The header holds the dtype and the shape of a row of each array, and a
+    table mapping each row to its tile: name, raw image, CRS, bounds and
+    transform. Rows are reserved by ranges before the tiles are written, so
+    that each worker writes its own rows of the memory-mapped arrays without
+    locks, then `compact` removes the rows left unused.
+    """
+
+    def __init__(self, directory: str, tile_shape: Tuple[int, int, int], dtype: str, label_dtype: str = "uint8"):
+        """
+        Constructor.
+
+        Args:
+            directory (str): Directory of the arrays and the header.
+            tile_shape (Tuple[int, int, int]): Shape (C, S, S) of a tile.
+            dtype (str): Dtype of the images.
+            label_dtype (str): Dtype of the labels.
+        """
+        self.directory = directory
+        self.tile_shape = tuple(int(dim) for dim in tile_shape)
+        self.dtype = np.dtype(dtype)
+        self.label_dtype = np.dtype(label_dtype)
+        self.images_path = os.path.join(directory, "images.bin")
+        self.labels_path = os.path.join(directory, "labels.bin")
+        self.header_path = os.path.join(directory, "tensors.json")
+
+    @classmethod
+    def from_header(cls, directory: str) -> Optional["TileTensor"]:
+        """
+        Tensor of a directory, None if it has no header.
+        """
+        header = cls.read_header(directory)
+        if header is None:
+            return None
+        return cls(directory, header["images"]["shape"], header["images"]["dtype"], header["labels"]["dtype"])
+
+    @staticmethod
+    def read_header(directory: str) -> Optional[Dict]:
+        path = os.path.join(directory, "tensors.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @property
+    def image_bytes(self) -> int:
+        return int(np.prod(self.tile_shape)) * self.dtype.itemsize
+
+    @property
+    def label_bytes(self) -> int:
+        return int(np.prod(self.tile_shape[1:])) * self.label_dtype.itemsize
+
+    def __len__(self) -> int:
+        """
+        Number of rows of the arrays, reserved or written.
+        """
+        if not os.path.exists(self.images_path):
+            return 0
+        return os.path.getsize(self.images_path) // self.image_bytes
+
+    def reserve(self, rows: int, start: Optional[int] = None) -> int:
+        """
+        Reserve `rows` rows at the end of the arrays. Files are extended without
+        writing them, so that unused rows take no disk space until they are
+        compacted.
+
+        Args:
+            rows (int): Number of rows.
+            start (Optional[int]): First reserved row, at least the number of rows
+                of the arrays, e.g. to reserve the same rows in several tensors.
+
+        Returns:
+            int: Index of the first reserved row.
+        """
+        start = len(self) if start is None else start
+        if start < len(self):
+            raise ValueError(f"Row {start} of {self.directory} is already reserved.")
+        os.makedirs(self.directory, exist_ok=True)
+        for path, row_bytes in ((self.images_path, self.image_bytes), (self.labels_path, self.label_bytes)):
+            with open(path, "ab"):
+                pass
+            os.truncate(path, (start + rows) * row_bytes)
+        return start
+
+    def open(self, mode: str = "r+", rows: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Memory-map the arrays.
+
+        Args:
+            mode (str): Mode of `np.memmap`, "r" or "r+".
+            rows (Optional[int]): Number of rows to map, all the rows by default.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Images (N, C, S, S) and labels (N, S, S).
+        """
+        rows = len(self) if rows is None else rows
+        if rows == 0:
+            return np.empty((0, *self.tile_shape), self.dtype), np.empty((0, *self.tile_shape[1:]), self.label_dtype)
+        images = np.memmap(self.images_path, dtype=self.dtype, mode=mode, shape=(rows, *self.tile_shape))
+        labels = np.memmap(self.labels_path, dtype=self.label_dtype, mode=mode, shape=(rows, *self.tile_shape[1:]))
+        return images, labels
+
+    def compact(self, rows: List[int]):
+        """
+        Move the written rows to the start of the arrays, in the same order,
+        and truncate the arrays after them.
+
+        Args:
+            rows (List[int]): Written rows, in increasing order: row `rows[i]` becomes row `i`.
+        """
+        if any(new > old for new, old in enumerate(rows)) or len(set(rows)) != len(rows):
+            raise ValueError("Rows to keep should be distinct and in increasing order.")
+        if len(self) > 0:
+            images, labels = self.open()
+            for new, old in enumerate(rows):
+                if new != old:
+                    images[new] = images[old]
+                    labels[new] = labels[old]
+            if isinstance(images, np.memmap):
+                images.flush()
+                labels.flush()
+            del images, labels
+        for path, row_bytes in ((self.images_path, self.image_bytes), (self.labels_path, self.label_bytes)):
+            if os.path.exists(path):
+                os.truncate(path, len(rows) * row_bytes)
+
+    def write_header(self, tiles: List[Dict]):
+        """
+        Write the header atomically, with the table of the tiles of each row.
+
+        Args:
+            tiles (List[Dict]): Tile of each row, from row 0.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        header = {
+            "rows": len(tiles),
+            "images": {"dtype": self.dtype.name, "shape": list(self.tile_shape)},
+            "labels": {"dtype": self.label_dtype.name, "shape": list(self.tile_shape[1:])},
+            "tiles": tiles,
+        }
+        with open(f"{self.header_path}.tmp", "w") as f:
+            json.dump(header, f)
+        os.replace(f"{self.header_path}.tmp", self.header_path)
+
+    @classmethod
+    def load(cls, directory: str) -> Tuple[np.ndarray, np.ndarray, List[Dict]]:
+        """
+        Memory-map the tiles of a split for reading, e.g. by a data loader
+        gathering random batches of rows.
+
+        Args:
+            directory (str): Directory of the tensor.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, List[Dict]]: Images (N, C, S, S),
+                labels (N, S, S), and the tile of each row.
+        """
+        tensor = cls.from_header(directory)
+        if tensor is None:
+            raise FileNotFoundError(f"No tile tensor in {directory}.")
+        header = cls.read_header(directory)
+        images, labels = tensor.open("r", header["rows"])
+        return images, labels, header["tiles"]
@@ -0,0 +1,99 @@
+"""
+Tile view class.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+from affine import Affine
+from astrovision.data import SatelliteImage, SegmentationLabeledSatelliteImage
+from astrovision.data.utils import get_bounds_for_tile, get_transform_for_tile
+
+
+class TileView:
+    """
+    Tile of a raw image, as views on the arrays of the image.
+
+    Unlike `SegmentationLabeledSatelliteImage.split`, which builds a labeled
+    image for each tile of the image, a view only holds the window of the tile:
+    its bounds and transform are derived on demand, and a `SatelliteImage` is
+    only built by `to_labeled_satellite_image` when the tile is saved. A view
+    has the `array`, `crs`, `bounds` and `transform` of a `SatelliteImage`, so
+    that filters and labelers can be run on it.
+    """
+
+    __slots__ = ("parent_array", "parent_label", "offset", "rows", "cols", "crs", "parent_transform")
+
+    def __init__(
+        self,
+        parent_array: np.ndarray,
+        rows: Tuple[int, int],
+        cols: Tuple[int, int],
+        crs: str,
+        parent_transform: Affine,
+        parent_label: Optional[np.ndarray] = None,
+        offset: Tuple[int, int] = (0, 0),
+    ):
+        """
+        Constructor.
+
+        Args:
+            parent_array (np.ndarray): Array (C, H, W) containing the tile, the whole
+                image or a window of it.
+            rows (Tuple[int, int]): First and last (exclusive) rows of the tile in the image.
+            cols (Tuple[int, int]): First and last (exclusive) columns of the tile in the image.
+            crs (str): CRS of the image.
+            parent_transform (Affine): Transform of the image.
+            parent_label (Optional[np.ndarray]): Label (H, W) aligned with `parent_array`, if known.
+            offset (Tuple[int, int]): Row and column of `parent_array` in the image.
+        """
+        self.parent_array = parent_array
+        self.parent_label = parent_label
+        self.offset = offset
+        self.rows = rows
+        self.cols = cols
+        self.crs = crs
+        self.parent_transform = parent_transform
+
+    def get_slices(self) -> Tuple[slice, slice]:
+        """
+        Slices of the tile in the parent arrays.
+        """
+        row, col = self.offset
+        return slice(self.rows[0] - row, self.rows[1] - row), slice(self.cols[0] - col, self.cols[1] - col)
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        View (C, H, W) of the tile on the parent array.
+        """
+        rows, cols = self.get_slices()
+        return self.parent_array[:, rows, cols]
+
+    @property
+    def label(self) -> Optional[np.ndarray]:
+        """
+        View (H, W) of the label of the tile on the parent label.
+        """
+        if self.parent_label is None:
+            return None
+        return self.parent_label[self.get_slices()]
+
+    @property
+    def bounds(self) -> Tuple:
+        return get_bounds_for_tile(self.parent_transform, self.rows, self.cols)
+
+    @property
+    def transform(self) -> Affine:
+        return get_transform_for_tile(self.parent_transform, self.rows[0], self.cols[0])
+
+    def to_labeled_satellite_image(self) -> SegmentationLabeledSatelliteImage:
+        """
+        Build the labeled image of the tile, on views of the parent arrays.
+
+        Returns:
+            SegmentationLabeledSatelliteImage: The labeled tile, as returned by
+                `SegmentationLabeledSatelliteImage.split`.
+        """
+        satellite_image = SatelliteImage(array=self.array, crs=self.crs, bounds=self.bounds, transform=self.transform)
+        return SegmentationLabeledSatelliteImage(satellite_image, self.label)
@@ -0,0 +1,279 @@
+"""
+Tile writer classes.
+"""
+
+import io
+import json
+import os
+import tarfile
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from classes.tile_encoders.tile_encoder import TileEncoder
+from classes.tile_tensors.tile_tensor import TileTensor
+from classes.tile_views.tile_view import TileView
+
+
+class TileWriter:
+    """
+    Base class of the writers of the tiles of an image.
+
+    A writer saves the tiles kept for an image to the test or train outputs
+    and returns, for each tile, the entry of the manifest record: its split
+    and the paths of its "image" and "label" files, checked by
+    `verify_records` and removed by `remove_tiles`. It is used as a context
+    manager, outputs being complete once it is closed.
+    """
+
+    def __init__(self, prepro_test_path: str, prepro_train_path: str):
+        """
+        Constructor.
+
+        Args:
+            prepro_test_path (str): Directory of the test labels.
+            prepro_train_path (str): Directory of the train labels.
+        """
+        self.prepro_test_path = prepro_test_path
+        self.prepro_train_path = prepro_train_path
+
+    def __enter__(self) -> "TileWriter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, tile: TileView, name: str, is_test: bool) -> Dict[str, str]:
+        """
+        Write a labeled tile.
+
+        Args:
+            tile (TileView): Labeled tile.
+            name (str): Name of the tile, unique in the dataset.
+            is_test (bool): True if the tile intersects a test box, see `get_test_tiles`.
+
+        Returns:
+            Dict[str, str]: Manifest entry of the tile.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Flush the outputs.
+        """
+        return
+
+    def get_prepro_path(self, is_test: bool) -> str:
+        return self.prepro_test_path if is_test else self.prepro_train_path
+
+
+class FileTileWriter(TileWriter):
+    """
+    Write each tile as an image file in the `patchs` directories and a label
+    file in the `labels` directories: with `SatelliteImage.to_raster` and
+    `np.save`, or with the encoding profile of an `encoder`.
+    """
+
+    def __init__(
+        self,
+        prepro_test_path: str,
+        prepro_train_path: str,
+        ext: str = ".tif",
+        encoder: Optional[TileEncoder] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            prepro_test_path (str): Directory of the test labels.
+            prepro_train_path (str): Directory of the train labels.
+            ext (str): Extension of the image files, ".tif" or ".jp2", without `encoder`.
+            encoder (Optional[TileEncoder]): Encoder of the tiles.
+        """
+        super().__init__(prepro_test_path, prepro_train_path)
+        self.ext = ext
+        self.encoder = encoder
+
+    def write(self, tile: TileView, name: str, is_test: bool) -> Dict[str, str]:
+        if self.encoder is not None:
+            return self.write_encoded(tile, name, is_test)
+        prepro_path = self.get_prepro_path(is_test)
+
+        image_path = f"{prepro_path.replace('labels', 'patchs')}{name}{self.ext}"
+        label_path = f"{prepro_path}{name}.npy"
+        lsi = tile.to_labeled_satellite_image()
+        lsi.satellite_image.to_raster(image_path)
+        np.save(
+            label_path,
+            lsi.label,
+        )
+
+        return {"split": "test" if is_test else "train", "image": image_path, "label": label_path}
+
+    def write_encoded(self, tile: TileView, name: str, is_test: bool) -> Dict[str, str]:
+        """
+        Write a labeled tile with the encoder.
+        """
+        prepro_path = self.get_prepro_path(is_test)
+
+        image_path = f"{prepro_path.replace('labels', 'patchs')}{name}{self.encoder.image_ext}"
+        label_path = f"{prepro_path}{name}{self.encoder.label_ext}"
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        for path, data in ((image_path, self.encoder.encode_image(tile)), (label_path, self.encoder.encode_label(tile))):
+            with open(path, "wb") as f:
+                f.write(data)
+
+        return {"split": "test" if is_test else "train", "image": image_path, "label": label_path}
+
+
+class ShardTileWriter(TileWriter):
+    """
+    Write the tiles of an image into tar shards per split, in the WebDataset
+    layout: each tile is stored as `{name}.tif`, `{name}.npy` and `{name}.json`
+    (bounds, transform, CRS, raw image and split) members, the image and label
+    members being encoded by `encoder` (float64 GeoTIFF and `.npy` by default).
+
+    Shards are written in the `shards` directories, named after the raw image
+    and numbered: a shard is closed once it reaches `max_shard_size` bytes.
+    Since each image has its own shards, the manifest keeps tracking, verifying
+    and removing the outputs of each image.
+    """
+
+    def __init__(
+        self,
+        prepro_test_path: str,
+        prepro_train_path: str,
+        im: str,
+        max_shard_size: int = 256 * 2**20,
+        encoder: Optional[TileEncoder] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            prepro_test_path (str): Directory of the test labels.
+            prepro_train_path (str): Directory of the train labels.
+            im (str): Path of the raw image.
+            max_shard_size (int): Size in bytes above which a shard is closed.
+            encoder (Optional[TileEncoder]): Encoder of the tiles.
+        """
+        super().__init__(prepro_test_path, prepro_train_path)
+        self.im = im
+        self.max_shard_size = max_shard_size
+        self.encoder = encoder or TileEncoder()
+        self.shards = {}
+
+    def write(self, tile: TileView, name: str, is_test: bool) -> Dict[str, str]:
+        split = "test" if is_test else "train"
+        metadata = {
+            "image": self.im,
+            "split": split,
+            "crs": tile.crs,
+            "bounds": list(tile.bounds),
+            "transform": list(tile.transform)[:6],
+        }
+        members = {
+            f"{name}{self.encoder.image_ext}": self.encoder.encode_image(tile),
+            f"{name}{self.encoder.label_ext}": self.encoder.encode_label(tile),
+            f"{name}.json": json.dumps(metadata).encode(),
+        }
+
+        shard = self.get_shard(is_test, sum(len(data) for data in members.values()))
+        for member, data in members.items():
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            shard["tar"].addfile(info, io.BytesIO(data))
+        shard["size"] += sum(len(data) for data in members.values())
+
+        return {"split": split, "image": shard["path"], "label": shard["path"], "key": name}
+
+    def get_shard(self, is_test: bool, size: int) -> Dict:
+        """
+        Return the open shard of a split, opening the next one if the tile of
+        `size` bytes does not fit in it.
+        """
+        shard = self.shards.get(is_test)
+        if shard is not None and shard["size"] > 0 and shard["size"] + size > self.max_shard_size:
+            shard["tar"].close()
+            shard = None
+        if shard is None:
+            index = self.shards[is_test]["index"] + 1 if is_test in self.shards else 0
+            prepro_path = self.get_prepro_path(is_test).replace("labels", "shards")
+            os.makedirs(prepro_path, exist_ok=True)
+            path = f"{prepro_path}{os.path.splitext(os.path.basename(self.im))[0]}-{index:04d}.tar"
+            shard = {"tar": tarfile.open(path, "w"), "path": path, "size": 0, "index": index}
+            self.shards[is_test] = shard
+        return shard
+
+    def close(self):
+        for shard in self.shards.values():
+            shard["tar"].close()
+        self.shards = {}
+
+
+class TensorTileWriter(TileWriter):
+    """
+    Write the tiles of an image into the rows of the `TileTensor` of each split,
+    in the `tensors` directories.
+
+    The rows of the image are reserved beforehand, see `reserve_tensor_rows`:
+    the writers of the images share the memory-mapped arrays of a split, each
+    writing its own rows, without locks. Rows of rejected tiles are left unused
+    until the tensors are compacted, see `write_tensors`.
+    """
+
+    def __init__(self, prepro_test_path: str, prepro_train_path: str, im: str, rows: Tuple[int, int]):
+        """
+        Constructor.
+
+        Args:
+            prepro_test_path (str): Directory of the test labels.
+            prepro_train_path (str): Directory of the train labels.
+            im (str): Path of the raw image.
+            rows (Tuple[int, int]): First and last (exclusive) rows reserved for
+                the image, in the tensor of each split.
+        """
+        super().__init__(prepro_test_path, prepro_train_path)
+        self.im = im
+        self.rows = rows
+        self.tensors = {}
+
+    def write(self, tile: TileView, name: str, is_test: bool) -> Dict[str, str]:
+        split = "test" if is_test else "train"
+        tensor = self.get_tensor(is_test)
+        row = self.rows[0] + tensor["written"]
+        if row >= self.rows[1]:
+            raise ValueError(f"More tiles than the {self.rows[1] - self.rows[0]} rows reserved for {self.im}.")
+        array = tile.array[: tensor["images"].shape[1]]
+        if not np.can_cast(array.dtype, tensor["images"].dtype):
+            raise ValueError(f"Tiles of {self.im} ({array.dtype}) do not fit in a {tensor['images'].dtype} tensor.")
+        tensor["images"][row] = array
+        tensor["labels"][row] = tile.label
+        tensor["written"] += 1
+
+        return {
+            "split": split,
+            "image": tensor["tensor"].images_path,
+            "label": tensor["tensor"].labels_path,
+            "key": name,
+            "row": int(row),
+            "crs": tile.crs,
+            "bounds": list(tile.bounds),
+            "transform": list(tile.transform)[:6],
+        }
+
+    def get_tensor(self, is_test: bool) -> Dict:
+        """
+        Return the memory-mapped arrays of the tensor of a split, mapping them at the first tile.
+        """
+        if is_test not in self.tensors:
+            tensor = TileTensor.from_header(self.get_prepro_path(is_test).replace("labels", "tensors"))
+            images, labels = tensor.open("r+")
+            self.tensors[is_test] = {"tensor": tensor, "images": images, "labels": labels, "written": 0}
+        return self.tensors[is_test]
+
+    def close(self):
+        for tensor in self.tensors.values():
+            tensor["images"].flush()
+            tensor["labels"].flush()
+        self.tensors = {}
@@ -1,14 +1,22 @@
 import concurrent.futures
+import json
 import os
 import subprocess
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
 import geopandas as gpd
 import pandas as pd
+import pyarrow.parquet as pq
+import pyogrio
+from pyproj import CRS
 from s3fs import S3FileSystem
+from shapely.geometry import box
 from tqdm import tqdm
 
+# Local cache of the labeling data, one GeoParquet file per (source, dep, year)
+LABEL_CACHE_DIR = "data/data-label-cache"
+
 
 def get_file_system() -> S3FileSystem:
     """
@@ -22,40 +30,100 @@ def get_file_system() -> S3FileSystem:
     )
 
 
+def write_label_cache(
+    gdf: gpd.GeoDataFrame,
+    cache_path: str,
+    row_group_size: int = 50_000,
+):
+    """
+    Write labeling data to a GeoParquet cache file. Rows are sorted along a
+    Hilbert curve and a bbox covering column is written, so that the row
+    groups are spatially compact and can be skipped when reading a bbox.
+
+    Args:
+        gdf (gpd.GeoDataFrame): Labeling data.
+        cache_path (str): Path of the GeoParquet file.
+        row_group_size (int): Number of rows per row group.
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    gdf = gdf.iloc[gdf.hilbert_distance().argsort()]
+    gdf.to_parquet(f"{cache_path}.tmp", index=False, write_covering_bbox=True, row_group_size=row_group_size)
+    os.replace(f"{cache_path}.tmp", cache_path)
+
+
+def read_label_cache(
+    cache_path: str,
+    columns: Sequence[str],
+    extent: Optional[gpd.GeoSeries] = None,
+) -> gpd.GeoDataFrame:
+    """
+    Read labeling data from a GeoParquet cache file.
+
+    Args:
+        cache_path (str): Path of the GeoParquet file.
+        columns (Sequence[str]): Columns to read besides the geometry. Columns
+            missing from the file are ignored.
+        extent (Optional[gpd.GeoSeries]): Area of interest, only the row
+            groups intersecting its bounds are read.
+
+    Returns:
+        gpd.GeoDataFrame: Labeling data.
+    """
+    schema = pq.read_schema(cache_path)
+    metadata = json.loads(schema.metadata[b"geo"])
+    geometry_column = metadata["primary_column"]
+    columns = [column for column in columns if column in schema.names] + [geometry_column]
+
+    bbox = None
+    if extent is not None:
+        crs = metadata["columns"][geometry_column].get("crs")
+        bbox = tuple(extent.to_crs(CRS.from_json_dict(crs) if crs else None).total_bounds)
+
+    return gpd.read_parquet(cache_path, columns=columns, bbox=bbox)
+
+
 def load_bdtopo(
     year: str,
     dep: str,
+    extent: Optional[gpd.GeoSeries] = None,
+    columns: Sequence[str] = ("USAGE1", "HAUTEUR"),
 ) -> gpd.GeoDataFrame:
     """
-    Load BDTOPO for a given datetime.
+    Load BDTOPO for a given datetime. The shapefile is downloaded and
+    converted to a local GeoParquet cache the first time only.
 
     Args:
         year (Literal): Year.
         dep (Literal): Departement.
+        extent (Optional[gpd.GeoSeries]): Area of interest, only buildings
+            in the row groups intersecting it are loaded.
+        columns (Sequence[str]): Attributes to load besides the geometry.
 
     Returns:
         gpd.GeoDataFrame: BDTOPO GeoDataFrame.
     """
+    cache_path = f"{LABEL_CACHE_DIR}/BDTOPO/{dep}/{year}.parquet"
 
-    if int(year) >= 2019:
-        couche, ext = ("BATIMENT", "shp")
-    elif int(year) < 2019:
-        couche, ext = ("BATI_INDIFFERENCIE", "SHP")
+    if not os.path.exists(cache_path):
+        if int(year) >= 2019:
+            couche, ext = ("BATIMENT", "shp")
+        elif int(year) < 2019:
+            couche, ext = ("BATI_INDIFFERENCIE", "SHP")
 
-    fs = get_file_system()
+        fs = get_file_system()
 
-    s3_path = f"projet-slums-detection/data-label/BDTOPO/{dep}/{year}/{couche}.*"
-    local_path = f"data/data-label/BDTOPO/{dep}/{year}/"
+        s3_path = f"projet-slums-detection/data-label/BDTOPO/{dep}/{year}/{couche}.*"
+        local_path = f"data/data-label/BDTOPO/{dep}/{year}/"
 
-    fs.download(
-        rpath=s3_path,
-        lpath=local_path,
-        recursive=True,
-    )
+        fs.download(
+            rpath=s3_path,
+            lpath=local_path,
+            recursive=True,
+        )
 
-    df = gpd.read_file(f"{local_path}{couche}.{ext}")
+        write_label_cache(gpd.read_file(f"{local_path}{couche}.{ext}"), cache_path)
 
-    return df
+    return read_label_cache(cache_path, columns, extent)
 
 
 def get_raw_images(
@@ -116,25 +184,43 @@ def download_data(
         subprocess.run(image_cmd, check=True, stdout=devnull, stderr=devnull)
 
 
+def list_gpkg_files(base_path: str, filesystem: S3FileSystem) -> List[str]:
+    """
+    List all GPKG files in the specified path.
+
+    Returns:
+        List[str]: List of GPKG file paths
+    """
+    try:
+        pattern = f"{base_path}/**/*.gpkg"
+        files = filesystem.glob(pattern)
+        print(f"Found {len(files)} GPKG files")
+        return files
+    except Exception as e:
+        print(f"Error listing GPKG files: {str(e)}")
+        raise
+
+
 def load_cosia(
     year: str,
     dep: str,
+    extent: Optional[gpd.GeoSeries] = None,
+    columns: Sequence[str] = ("classe",),
 ):
-    def list_gpkg_files(base_path: str, filesystem: S3FileSystem) -> List[str]:
-        """
-        List all GPKG files in the specified path.
+    """
+    Load CoSIA for a given datetime. The GPKG files are read and converted
+    to a local GeoParquet cache the first time only.
 
-        Returns:
-            List[str]: List of GPKG file paths
-        """
-        try:
-            pattern = f"{base_path}/**/*.gpkg"
-            files = filesystem.glob(pattern)
-            print(f"Found {len(files)} GPKG files")
-            return files
-        except Exception as e:
-            print(f"Error listing GPKG files: {str(e)}")
-            raise
+    Args:
+        year (Literal): Year.
+        dep (Literal): Departement.
+        extent (Optional[gpd.GeoSeries]): Area of interest, only polygons
+            in the row groups intersecting it are loaded.
+        columns (Sequence[str]): Attributes to load besides the geometry.
+
+    Returns:
+        gpd.GeoDataFrame: CoSIA GeoDataFrame.
+    """
 
     def read_single_file(file_path: str, filesystem: S3FileSystem) -> Optional[gpd.GeoDataFrame]:
         """
@@ -196,11 +282,82 @@ def load_cosia(
 
         return result
 
-    fs = get_file_system()
+    cache_path = f"{LABEL_CACHE_DIR}/COSIA/{dep}/{year}.parquet"
 
-    gdf = process_files(
-        f"projet-slums-detection/data-label/COSIA/{dep}/{year}",
-        filesystem=fs,
-    )
+    if not os.path.exists(cache_path):
+        fs = get_file_system()
+
+        gdf = process_files(
+            f"projet-slums-detection/data-label/COSIA/{dep}/{year}",
+            filesystem=fs,
+        )
+        write_label_cache(gdf, cache_path)
+
+    return read_label_cache(cache_path, columns, extent)
+
+
+def get_cosia_footprints(
+    year: str,
+    dep: str,
+    max_workers: int = 16,
+) -> gpd.GeoDataFrame:
+    """
+    Return the extent of every CoSIA GPKG file of a department. Extents are
+    read from the GPKG headers through GDAL range requests, without
+    downloading the files, and cached locally the first time only.
+
+    Args:
+        year (Literal): Year.
+        dep (Literal): Departement.
+        max_workers (int): Number of threads reading the headers.
 
-    return gdf
+    Returns:
+        gpd.GeoDataFrame: One row per GPKG file, with its S3 path in the
+            `file_path` column and its extent as geometry.
+    """
+    cache_path = f"{LABEL_CACHE_DIR}/COSIA/{dep}/{year}-footprints.parquet"
+
+    if not os.path.exists(cache_path):
+        files = list_gpkg_files(f"projet-slums-detection/data-label/COSIA/{dep}/{year}", get_file_system())
+
+        def read_footprint(file_path: str):
+            info = pyogrio.read_info(f"/vsis3/{file_path}", layer=Path(file_path).stem, force_total_bounds=True)
+            return info["crs"], box(*info["total_bounds"])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            footprints = list(tqdm(executor.map(read_footprint, files), total=len(files), desc="Indexing GPKG files"))
+
+        if not footprints:
+            raise ValueError("No GPKG files were found. Make sure label data is available for the specified department and year.")
+
+        # Extents are expressed in the CRS of the first file
+        crs = footprints[0][0]
+        gdf = pd.concat(
+            [
+                gpd.GeoDataFrame({"file_path": [file_path]}, geometry=[footprint], crs=file_crs).to_crs(crs)
+                for file_path, (file_crs, footprint) in zip(files, footprints)
+            ],
+            ignore_index=True,
+        )
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        gdf.to_parquet(cache_path, index=False)
+
+    return gpd.read_parquet(cache_path)
+
+
+def read_cosia_file(
+    file_path: str,
+    columns: Sequence[str] = ("classe",),
+) -> gpd.GeoDataFrame:
+    """
+    Read a single CoSIA GPKG file from S3.
+
+    Args:
+        file_path (str): S3 path of the GPKG file.
+        columns (Sequence[str]): Attributes to load besides the geometry.
+
+    Returns:
+        gpd.GeoDataFrame: CoSIA polygons of the file.
+    """
+    gdf = gpd.read_file(f"/vsis3/{file_path}", layer=Path(file_path).stem, columns=list(columns))
+    return gdf.dropna(subset=["geometry"])
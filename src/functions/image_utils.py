@@ -1,9 +1,15 @@
+import math
 import re
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
+import geopandas as gpd
 import s3fs
+from affine import Affine
 from astrovision.data import SatelliteImage
-from pyproj import Transformer
+from osgeo import gdal
+from pyproj import CRS, Transformer
+from shapely.geometry import box
 
 from utils.mappings import name_dep_to_crs
 
@@ -344,3 +350,104 @@ def image_is_in_bb(
             return True
     else:
         return False
+
+
+def get_image_profile(
+    filepath: str,
+) -> Tuple[str, Affine, int, int]:
+    """
+    Return the georeferencing of a raster file, reading only its header.
+
+    Args:
+        filepath (str): The full filepath (GDAL path).
+
+    Returns:
+        Tuple[str, Affine, int, int]: The CRS, formatted like
+            `SatelliteImage.crs` (e.g. "EPSG:4471"), the transform, the
+            width and the height of the image.
+    """
+    ds = gdal.Open(filepath)
+    crs = CRS.from_wkt(ds.GetSpatialRef().ExportToWkt())
+    return f"EPSG:{crs.to_epsg()}", Affine.from_gdal(*ds.GetGeoTransform()), ds.RasterXSize, ds.RasterYSize
+
+
+def get_images_profiles(
+    images: List[str],
+    from_s3: bool,
+    max_workers: int = 16,
+) -> List[Tuple[str, Affine, int, int]]:
+    """
+    Return the georeferencing of a list of raw images.
+
+    Args:
+        images (List[str]): Paths of the raw images.
+        from_s3 (bool): True if the images are read from S3.
+        max_workers (int): Number of threads reading the headers.
+
+    Returns:
+        List[Tuple[str, Affine, int, int]]: CRS, transform, width and height
+            of each image.
+    """
+    filepaths = [f"/vsis3/{im}" if int(from_s3) else im for im in images]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(get_image_profile, filepaths))
+
+
+def get_images_grids(
+    profiles: List[Tuple[str, Affine, int, int]],
+) -> Dict[str, Tuple[Affine, int, int]]:
+    """
+    Return, for each CRS, the pixel grid covering all the images in that CRS.
+    The grid has the resolution of the images and is aligned with their pixels.
+
+    Args:
+        profiles (List[Tuple[str, Affine, int, int]]): Output of `get_images_profiles`.
+
+    Returns:
+        Dict[str, Tuple[Affine, int, int]]: Transform, width and height of the
+            grid, by CRS.
+
+    Raises:
+        ValueError: If the images of a CRS have different resolutions or pixels
+            not aligned with each other.
+    """
+    grids = {}
+    for crs in sorted({profile[0] for profile in profiles}):
+        transforms = [(transform, width, height) for c, transform, width, height in profiles if c == crs]
+        res_x, res_y = transforms[0][0].a, -transforms[0][0].e
+        left = min(transform.c for transform, _, _ in transforms)
+        top = max(transform.f for transform, _, _ in transforms)
+        right = max(transform.c + width * res_x for transform, width, _ in transforms)
+        bottom = min(transform.f - height * res_y for transform, _, height in transforms)
+        for transform, _, _ in transforms:
+            if (transform.a, transform.e) != (res_x, -res_y):
+                raise ValueError(f"Images in {crs} have different resolutions, their pixels cannot share a grid.")
+            offsets = ((transform.c - left) / res_x, (top - transform.f) / res_y)
+            if any(round(offset, 6) != round(offset) for offset in offsets):
+                raise ValueError(f"Images in {crs} have pixels not aligned with each other, they cannot share a grid.")
+        grids[crs] = (
+            Affine(res_x, 0.0, left, 0.0, -res_y, top),
+            math.ceil(round((right - left) / res_x, 6)),
+            math.ceil(round((top - bottom) / res_y, 6)),
+        )
+    return grids
+
+
+def get_roi_extent(
+    roi: gpd.GeoDataFrame,
+    profiles: List[Tuple[str, Affine, int, int]],
+) -> gpd.GeoSeries:
+    """
+    Return the area that images intersecting the ROI can cover: the bounds of
+    the ROI expanded by the largest image side.
+
+    Args:
+        roi (gpd.GeoDataFrame): Region of interest.
+        profiles (List[Tuple[str, Affine, int, int]]): Output of `get_images_profiles`.
+
+    Returns:
+        gpd.GeoSeries: Extent, in the CRS of the ROI.
+    """
+    margin = max(max(width * abs(transform.a), height * abs(transform.e)) for _, transform, width, height in profiles)
+    xmin, ymin, xmax, ymax = roi.total_bounds
+    return gpd.GeoSeries([box(xmin - margin, ymin - margin, xmax + margin, ymax + margin)], crs=roi.crs)
@@ -1,7 +1,19 @@
+from typing import List, Optional
+
+import geopandas as gpd
+
 from classes.labelers.labeler import BDTOPOLabeler, COSIALabeler
 
 
-def get_labeler(type_labeler: str, year: int, dep: str, task: str):
+def get_labeler(
+    type_labeler: str,
+    year: int,
+    dep: str,
+    task: str,
+    crs_list: Optional[List[str]] = None,
+    extent: Optional[gpd.GeoSeries] = None,
+    lazy: bool = False,
+):
     """
     Get a labeler instance based on the specified type.
 
@@ -10,6 +22,9 @@ def get_labeler(type_labeler: str, year: int, dep: str, task: str):
     - year (int): The year parameter for labeler instantiation.
     - dep (str): The dep parameter for labeler instantiation.
     - task (str): The task parameter for labeler instantiation.
+    - crs_list (Optional[List[str]]): The CRS in which the labeling data is projected upfront.
+    - extent (Optional[gpd.GeoSeries]): The area outside of which labeling data is not loaded.
+    - lazy (bool): Whether labeling files are only read when an image intersects them (COSIA only).
 
 
     Returns:
@@ -19,9 +34,11 @@ def get_labeler(type_labeler: str, year: int, dep: str, task: str):
 
     match type_labeler:
         case "BDTOPO":
-            labeler = BDTOPOLabeler(year=year, dep=dep, task=task)
+            if lazy:
+                raise NotImplementedError("Lazy loading is only available for the COSIA labeler.")
+            labeler = BDTOPOLabeler(year=year, dep=dep, task=task, crs_list=crs_list, extent=extent)
         case "COSIA":
-            labeler = COSIALabeler(year=year, dep=dep, task=task)
+            labeler = COSIALabeler(year=year, dep=dep, task=task, crs_list=crs_list, extent=extent, lazy=lazy)
         case _:
             pass
     return labeler
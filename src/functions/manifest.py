@@ -0,0 +1,154 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from classes.statistics.band_statistics import BandStatistics
+from functions.download_data import get_file_system
+
+
+def get_images_fingerprints(
+    images: List[str],
+    from_s3: bool,
+    max_workers: int = 16,
+) -> Dict[str, Dict]:
+    """
+    Return a fingerprint of each raw image: its path, size and ETag on S3, or
+    modification time on the local disk.
+
+    Args:
+        images (List[str]): Paths of the raw images.
+        from_s3 (bool): True if the images are read from S3.
+        max_workers (int): Number of threads reading the metadata.
+
+    Returns:
+        Dict[str, Dict]: Fingerprint, by image path.
+    """
+    if int(from_s3):
+        fs = get_file_system()
+
+        def get_fingerprint(im: str) -> Dict:
+            info = fs.info(im)
+            return {"path": im, "size": info["size"], "etag": info.get("ETag")}
+    else:
+
+        def get_fingerprint(im: str) -> Dict:
+            stat = os.stat(im)
+            return {"path": im, "size": stat.st_size, "mtime": stat.st_mtime}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(images, executor.map(get_fingerprint, images)))
+
+
+def get_record_path(manifest_dir: str, im: str) -> str:
+    """
+    Return the path of the manifest record of a raw image.
+    """
+    return os.path.join(manifest_dir, f"{os.path.basename(im)}.json")
+
+
+def write_record(
+    manifest_dir: str,
+    im: str,
+    fingerprint: Dict,
+    parameters: Dict,
+    tiles: List[Dict[str, str]],
+    statistics: BandStatistics,
+    report: Optional[Dict] = None,
+):
+    """
+    Write the manifest record of a processed raw image. The record is written
+    atomically, once all the tiles of the image are saved, so that an
+    interrupted image has no record and is processed again by the next run.
+
+    Args:
+        manifest_dir (str): Directory of the manifest records.
+        im (str): Path of the raw image.
+        fingerprint (Dict): Fingerprint of the raw image.
+        parameters (Dict): Preprocessing parameters.
+        tiles (List[Dict[str, str]]): Split and files of each saved tile.
+        statistics (BandStatistics): Normalization statistics of the train tiles.
+        report (Optional[Dict]): Report of the tile filters, e.g. their statistics
+            under "filters" and the prefilter report under "prefilter".
+    """
+    record = {
+        "image": im,
+        "fingerprint": fingerprint,
+        "parameters": parameters,
+        "tiles": tiles,
+        "statistics": statistics.to_record(),
+    }
+    if report is not None:
+        record.update(report)
+    update_record(manifest_dir, record)
+
+
+def update_record(manifest_dir: str, record: Dict):
+    """
+    Write a manifest record atomically, e.g. after the rows of its tiles were moved.
+    """
+    path = get_record_path(manifest_dir, record["image"])
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(record, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_records(manifest_dir: str, images: List[str]) -> Dict[str, Dict]:
+    """
+    Read the manifest records of a list of raw images.
+
+    Args:
+        manifest_dir (str): Directory of the manifest records.
+        images (List[str]): Paths of the raw images.
+
+    Returns:
+        Dict[str, Dict]: Record, by image path, for the images having one.
+    """
+    records = {}
+    for im in images:
+        path = get_record_path(manifest_dir, im)
+        if os.path.exists(path):
+            with open(path) as f:
+                records[im] = json.load(f)
+    return records
+
+
+def is_up_to_date(record: Dict, fingerprint: Dict, parameters: Dict) -> bool:
+    """
+    Return True if a record was produced from the same raw image with the same
+    parameters.
+    """
+    return record["fingerprint"] == fingerprint and record["parameters"] == parameters
+
+
+def verify_records(records: Dict[str, Dict], max_workers: int = 16) -> Dict[str, bool]:
+    """
+    Check that the files of all the tiles of each record exist.
+
+    Args:
+        records (Dict[str, Dict]): Records, by image path.
+        max_workers (int): Number of threads checking the files.
+
+    Returns:
+        Dict[str, bool]: True if all the tiles of the image are present, by
+            image path.
+    """
+
+    def verify(record: Dict) -> bool:
+        return all(os.path.exists(tile["image"]) and os.path.exists(tile["label"]) for tile in record["tiles"])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(records, executor.map(verify, records.values())))
+
+
+def remove_tiles(record: Dict):
+    """
+    Remove the files of the tiles of a record, before its image is processed again.
+    """
+    for tile in record["tiles"]:
+        if "row" in tile:
+            # Tensors are shared by the images, rows no longer recorded are removed by `write_tensors`
+            continue
+        for path in (tile["image"], tile["label"]):
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,11 +1,104 @@
 import os
+from typing import Dict, List, Optional, Tuple
 
 import geopandas as gpd
 import numpy as np
-from astrovision.data import SatelliteImage, SegmentationLabeledSatelliteImage
+import pyproj
+import rasterio
+from shapely import STRtree
+from shapely.geometry import box
+from shapely.ops import transform
 
-from classes.filters.filter import Filter
+from classes.filters.filter_chain import FilterChain
+from classes.filters.tile_filter import BlackFilter, CloudFilter, OverviewFilter, RoiFilter, SamplingFilter, TileFilter
 from classes.labelers.labeler import Labeler
+from classes.profilers.profiler import Profiler
+from classes.statistics.band_statistics import BandStatistics
+from classes.tile_encoders.tile_encoder import TileEncoder
+from classes.tile_grids.tile_grid import TileGrid
+from classes.tile_writers.tile_writer import FileTileWriter, ShardTileWriter, TensorTileWriter, TileWriter
+from functions.manifest import write_record
+from functions.tile_index import get_index_row, write_index_part
+
+# Arguments shared by every task of a worker process, set once by `init_worker`
+WORKER_CONTEXT = {}
+
+# Thresholds of the tile filters, recorded in the manifest of each image
+CLOUD_PARAMETERS = {"threshold_center": 0.7, "threshold_full": 0.4, "min_relative_size": 0.0125}
+BLACK_PARAMETERS = {"black_value_threshold": 25, "black_area_threshold": 0.5}
+
+# Resolution reduction of the overview read by the prefilter
+PREFILTER_PARAMETERS = {"overview_factor": 8}
+
+
+def init_worker(context: dict):
+    """
+    Initialize a worker process with the arguments shared by all its tasks.
+
+    The labeler, the ROI and the test boxes are heavy objects: they are handed
+    to each worker once (inherited copy-on-write when the pool forks) instead
+    of being pickled into every task.
+
+    Args:
+        context (dict): Context of each job of the batch under "jobs", by job name.
+            The context of a job holds:
+            - the keyword arguments of `process_single_image`, except `im` and `profiler`;
+            - `manifest_dir`: manifest directory, for each tile size;
+            - `parameters`: parameters of the manifest records, for each tile size;
+            - `index_dir`: tile index directory, for each tile size;
+            - `fingerprints`: fingerprint of each image;
+            - `trace_dir`: directory of the profiling traces, None to disable profiling.
+    """
+    WORKER_CONTEXT.clear()
+    WORKER_CONTEXT.update(context)
+
+
+def process_image(im: str, context: Optional[dict] = None) -> List[BandStatistics]:
+    """
+    Process a raw image with the context set by `init_worker`, then write its
+    part of the tile index and its manifest record for each tile size once all
+    its tiles are saved.
+
+    Args:
+        im (str): Path of the raw image.
+        context (Optional[dict]): Context of the image, `WORKER_CONTEXT` by default.
+
+    Returns:
+        List[BandStatistics]: Normalization statistics of the train tiles, for each tile size.
+    """
+    context = dict(WORKER_CONTEXT if context is None else context)
+    manifest_dirs = context.pop("manifest_dir")
+    index_dirs = context.pop("index_dir")
+    fingerprint = context.pop("fingerprints")[im]
+    parameters = context.pop("parameters")
+    trace_dir = context.pop("trace_dir", None)
+
+    profiler = Profiler(enabled=trace_dir is not None)
+    with profiler.stage("total"):
+        results = process_single_image(im, **context, profiler=profiler)
+    for manifest_dir, index_dir, size_parameters, (statistics, tiles, report, index_rows) in zip(
+        manifest_dirs, index_dirs, parameters, results
+    ):
+        write_index_part(index_dir, im, index_rows)
+        write_record(manifest_dir, im, fingerprint, size_parameters, tiles, statistics, report)
+    if trace_dir is not None:
+        profiler.write_trace(os.path.join(trace_dir, f"{os.path.basename(im)}.json"), im)
+    return [statistics for statistics, _, _, _ in results]
+
+
+def process_job_image(task: Tuple[str, str]) -> List[BandStatistics]:
+    """
+    Process a raw image of a job of a batch, with the context of the job set
+    by `init_worker` under "jobs": the jobs of a batch share a process pool.
+
+    Args:
+        task (Tuple[str, str]): Name of the job and path of the raw image.
+
+    Returns:
+        List[BandStatistics]: Normalization statistics of the train tiles, for each tile size.
+    """
+    job, im = task
+    return process_image(im, WORKER_CONTEXT["jobs"][job])
 
 
 def process_single_image(
@@ -13,75 +106,270 @@ def process_single_image(
     from_s3: bool,
     n_bands: int,
     labeler: Labeler,
-    tiles_size: int,
+    tiles_size: List[int],
     source: str,
     roi: gpd.GeoDataFrame,
     bbox_test: dict,
     name_dep_to_crs: dict,
     dep: str,
+    prepro_test_path: List[str],
+    prepro_train_path: List[str],
+    windowed: bool = False,
+    prefilter: bool = False,
+    output: str = "files",
+    rows: Optional[List[Dict[str, Tuple[int, int]]]] = None,
+    sampling: Optional[Dict] = None,
+    encoding: Optional[Dict] = None,
+    filters: Optional[List[TileFilter]] = None,
+    profiler: Optional[Profiler] = None,
+) -> List[Tuple[BandStatistics, List[Dict[str, str]], Dict, List[Dict]]]:
+    """
+    Filter, label and save the tiles of a raw image, for one or several tile
+    sizes. Each stage is measured by `profiler` if given.
+
+    Tiles are filtered by a chain of `filters` (by default `get_filters`), from
+    the cheapest filter to the most expensive: the image is not read if no tile
+    is left after the filters reading only the header or an overview. With
+    `sampling`, the kept tiles are then sampled from their label, before they
+    are saved.
+
+    The image is read, labeled and cloud-masked once for all tile sizes, the
+    tiles of each size being saved to its own directories, as a file per tile,
+    as shards or as tensor rows depending on `output` (see `get_tile_writer`). In windowed mode,
+    each tile window is read, filtered, labeled and saved before the next one
+    is read, so that memory is bounded by the tile size rather than the image
+    size. Tiles are the same in both modes.
+
+    Args:
+        tiles_size (List[int]): Tile sizes.
+        prepro_test_path (List[str]): Directory of the test labels, for each tile size.
+        prepro_train_path (List[str]): Directory of the train labels, for each tile size.
+        rows (Optional[List[Dict[str, Tuple[int, int]]]]): For the "tensors" output,
+            rows reserved for each image, for each tile size (see `reserve_tensor_rows`).
+        sampling (Optional[Dict]): Parameters of the `SamplingFilter`, None to keep all the tiles.
+        encoding (Optional[Dict]): Encoding profile of the tiles, see `TileEncoder`.
+
+    Returns:
+        List[Tuple[BandStatistics, List[Dict[str, str]], Dict, List[Dict]]]: For
+            each tile size, normalization statistics of the train tiles, the
+            split and files of each saved tile, the report of the filters (and
+            of the prefilter), and the rows of the tile index.
+    """
+    profiler = profiler or Profiler(enabled=False)
+    filters = filters or get_filters(source, roi, prefilter, sampling)
+    filename = os.path.splitext(os.path.basename(im))[0]
+
+    grids, filter_chains, results = [], [], []
+    with rasterio.open(f"/vsis3/{im}" if int(from_s3) else im) as src:
+        grid = TileGrid(src, tiles_size[0], n_bands, labeler, windowed, profiler)
+        for index, (size, test_path, train_path) in enumerate(zip(tiles_size, prepro_test_path, prepro_train_path)):
+            # Grids of all the sizes share the image, its label and its cloud mask
+            grid = grid.resize(size)
+            filter_chain = FilterChain(filters)
+            test_tree = grid.get_cached("test_tree", lambda: get_test_tree(bbox_test, name_dep_to_crs, dep, grid.crs))
+            image_rows = rows[index][im] if rows is not None else None
+            with get_tile_writer(output, test_path, train_path, im, image_rows, encoding) as writer:
+                statistics, tiles, index_rows = process_tile_grid(grid, filter_chain, test_tree, writer, filename)
+            grids.append(grid)
+            filter_chains.append(filter_chain)
+            results.append((statistics, tiles, index_rows))
+
+    reports = []
+    for grid, filter_chain in zip(grids, filter_chains):
+        report = {"filters": filter_chain.statistics}
+        if prefilter:
+            report["prefilter"] = get_prefilter_report(grid, filter_chain.statistics)
+        reports.append(report)
+    return [(statistics, tiles, report, index_rows) for (statistics, tiles, index_rows), report in zip(results, reports)]
+
+
+def process_tile_grid(
+    grid: TileGrid,
+    filter_chain: FilterChain,
+    test_tree: STRtree,
+    writer: TileWriter,
+    filename: str,
+) -> Tuple[BandStatistics, List[Dict[str, str]], List[Dict]]:
+    """
+    Filter, label and save the tiles of a grid.
+
+    Args:
+        grid (TileGrid): Tiles of the image.
+        filter_chain (FilterChain): Filters of the tiles.
+        test_tree (STRtree): Index of the test boxes, as returned by `get_test_tree`.
+        writer (TileWriter): Writer of the tiles.
+        filename (str): File name of the raw image, without extension.
+
+    Returns:
+        Tuple[BandStatistics, List[Dict[str, str]], List[Dict]]: Normalization
+            statistics of the train tiles, the manifest entry of each saved
+            tile, and its row of the tile index (see `get_index_row`).
+    """
+    # 1- Filter the tiles, local filters are run tile by tile in windowed mode
+    kept = filter_chain.run(grid, local=not grid.windowed)
+
+    # 2- Test split of the kept tiles
+    is_test = np.zeros(len(grid), dtype=bool)
+    if kept.any():
+        is_test[kept] = get_test_tiles(grid.boxes[kept], test_tree)
+
+    # 3- Label and save the kept tiles to data-prepro
+    statistics = BandStatistics()
+    tiles, index_rows = [], []
+    for k in np.flatnonzero(kept):
+        if grid.windowed:
+            tile = grid.read_tile(k)
+            if not filter_chain.run_tile(grid, tile):
+                continue
+            with grid.profiler.stage("label"):
+                tile.parent_label = grid.labeler.create_label(tile)
+            if not filter_chain.run_tile(grid, tile, "labels"):
+                continue
+        else:
+            tile = grid.get_tile(k)
+        name = f"{filename}_{len(tiles):04d}"
+        with grid.profiler.stage("save"):
+            tiles.append(writer.write(tile, name, is_test[k]))
+            if not is_test[k]:
+                # Add the pixels of the tile to the normalization statistics
+                statistics.update(tile.array)
+        with grid.profiler.stage("index"):
+            index_rows.append(get_index_row(tile, name, tiles[-1], grid.boxes[k], filter_chain.score_tile(grid, tile)))
+    return statistics, tiles, index_rows
+
+
+def get_filters(
+    source: str,
+    roi: gpd.GeoDataFrame,
+    prefilter: bool = False,
+    sampling: Optional[Dict] = None,
+) -> List[TileFilter]:
+    """
+    Default filters: tiles outside the ROI, too black tiles, and cloudy tiles
+    for PLEIADES images. With `prefilter`, tiles certain to be black from an
+    overview are rejected before the image is read. With
+    `sampling`, tiles are sampled from their label.
+
+    Args:
+        source (str): Source of the images.
+        roi (gpd.GeoDataFrame): ROI of the department.
+        prefilter (bool): If True, add the overview prefilter.
+        sampling (Optional[Dict]): Parameters of the `SamplingFilter`, see `load_sampling`.
+
+    Returns:
+        List[TileFilter]: The filters, run by a `FilterChain`.
+    """
+    cloud_parameters = CLOUD_PARAMETERS if source == "PLEIADES" else None
+    filters = [RoiFilter(roi.loc[0, "geometry"]), BlackFilter(**BLACK_PARAMETERS)]
+    if cloud_parameters is not None:
+        filters.append(CloudFilter(**cloud_parameters))
+    if prefilter:
+        filters.append(OverviewFilter(BLACK_PARAMETERS, **PREFILTER_PARAMETERS))
+    if sampling is not None:
+        filters.append(SamplingFilter(**sampling))
+    return filters
+
+
+def get_tile_writer(
+    output: str,
     prepro_test_path: str,
     prepro_train_path: str,
-):
-    # 1- Open with SatelliteImage
-    if int(from_s3):
-        si = SatelliteImage.from_raster(
-            file_path=f"/vsis3/{im}",
-            n_bands=int(n_bands),
-        )
-    else:
-        si = SatelliteImage.from_raster(
-            file_path=im,
-            n_bands=int(n_bands),
-        )
-
-    # 2- Label with labeler
-    label = labeler.create_label(si)
-    lsi = SegmentationLabeledSatelliteImage(si, label)
-
-    # 3- Split tiles
-    splitted_lsi = lsi.split(int(tiles_size))  # TODO int(tiles_size) is redundant
-
-    filter_ = Filter()
-
-    # 4- Filter: too black, clouds, and ROI
-    if source == "PLEIADES":
-        is_cloud = filter_.is_cloud(
-            lsi.satellite_image,
-            tiles_size=int(tiles_size),  # TODO int(tiles_size) is redundant
-            threshold_center=0.7,
-            threshold_full=0.4,
-            min_relative_size=0.0125,
-        )
+    im: str,
+    rows: Optional[Tuple[int, int]] = None,
+    encoding: Optional[Dict] = None,
+) -> TileWriter:
+    """
+    Return the writer of the tiles of an image.
+
+    Args:
+        output (str): "files" for an image file and a label file per tile,
+            "shards" for tar shards of tiles, "tensors" for rows of a
+            memory-mapped tensor per split.
+        prepro_test_path (str): Directory of the test labels.
+        prepro_train_path (str): Directory of the train labels.
+        im (str): Path of the raw image.
+        rows (Optional[Tuple[int, int]]): Rows reserved for the image, for the "tensors" output.
+        encoding (Optional[Dict]): Encoding profile of the tiles, for the "files"
+            and "shards" outputs, see `TileEncoder`. Tensors are not encoded.
+
+    Returns:
+        TileWriter: The writer.
+    """
+    encoder = TileEncoder(**encoding) if encoding is not None else None
+    match output:
+        case "files":
+            return FileTileWriter(prepro_test_path, prepro_train_path, os.path.splitext(im)[1], encoder)
+        case "shards":
+            return ShardTileWriter(prepro_test_path, prepro_train_path, im, encoder=encoder)
+        case "tensors":
+            if encoder is not None:
+                raise ValueError("Tiles of the tensors output are stored raw, without encoding.")
+            return TensorTileWriter(prepro_test_path, prepro_train_path, im, rows)
+        case _:
+            raise ValueError(f"Unknown output {output}.")
+
+
+def get_test_tree(bbox_test: dict, name_dep_to_crs: dict, dep: str, crs: str) -> STRtree:
+    """
+    Index the test boxes of a department, projected in the CRS of an image as
+    in `SatelliteImage.intersects_box`.
+
+    Args:
+        bbox_test (dict): Test boxes, by department.
+        name_dep_to_crs (dict): CRS of the test boxes, by department.
+        dep (str): Department.
+        crs (str): CRS of the image.
+
+    Returns:
+        STRtree: Index of the test boxes.
+    """
+    boxes = [box(*bbox) for bbox in bbox_test[dep]]
+    if name_dep_to_crs[dep] != crs:
+        transformer = pyproj.Transformer.from_proj(pyproj.CRS(name_dep_to_crs[dep]), pyproj.CRS(crs))
+        boxes = [transform(transformer.transform, geometry) for geometry in boxes]
+    return STRtree(boxes)
+
+
+def get_test_tiles(tiles_boxes: np.ndarray, test_tree: STRtree) -> np.ndarray:
+    """
+    Find the tiles intersecting a test box, in one vectorized query.
+
+    Args:
+        tiles_boxes (np.ndarray): Boxes of the tiles, see `TileGrid.boxes`.
+        test_tree (STRtree): Index of the test boxes, as returned by `get_test_tree`.
+
+    Returns:
+        np.ndarray: For each tile, True if it belongs to the test split.
+    """
+    is_test = np.zeros(len(tiles_boxes), dtype=bool)
+    is_test[test_tree.query(tiles_boxes, predicate="intersects")[0]] = True
+    return is_test
+
+
+def get_prefilter_report(grid: TileGrid, statistics: Dict[str, Dict]) -> Dict[str, int]:
+    """
+    Report of the prefilter of an image, recorded in its manifest record.
+
+    Args:
+        grid (TileGrid): Tiles of the image, once processed.
+        statistics (Dict[str, Dict]): Statistics of the filter chain.
+
+    Returns:
+        Dict[str, int]: Number of tiles, of tiles rejected before reading the
+            pixels (outside the ROI or by the prefilter), 1 if the image was not
+            read at all, and the decoded bytes not read.
+    """
+    skipped_image = not grid.pixels_read()
+    if skipped_image:
+        skipped_bytes = grid.get_bytes()
+    elif grid.windowed:
+        # Windows of the tiles rejected by the prefilter
+        skipped_bytes = grid.get_bytes(statistics["prefilter"]["rejected"])
     else:
-        is_cloud = [0] * len(splitted_lsi.satellite_image)
-
-    splitted_lsi_filtered = [
-        lsi
-        for lsi, cloud in zip(splitted_lsi, is_cloud)
-        if not (filter_.is_too_black(lsi.satellite_image, black_value_threshold=25, black_area_threshold=0.5) or cloud)
-        and (lsi.satellite_image.intersects_polygon(roi.loc[0, "geometry"], crs=lsi.satellite_image.crs))
-    ]
-
-    # 5- Save filtered tiles to data-prepro
-    metrics = {"mean": [], "std": []}
-    for i, lsi in enumerate(splitted_lsi_filtered):
-        filename, ext = os.path.splitext(os.path.basename(im))
-        is_test = any([lsi.satellite_image.intersects_box(tuple(bbox), crs=name_dep_to_crs[dep]) for bbox in bbox_test[dep]])
-
-        if is_test:
-            lsi.satellite_image.to_raster(f"{prepro_test_path.replace('labels', 'patchs')}{filename}_{i:04d}{ext}")
-            np.save(
-                f"{prepro_test_path}{filename}_{i:04d}.npy",
-                lsi.label,
-            )
-        else:
-            lsi.satellite_image.to_raster(f"{prepro_train_path.replace('labels', 'patchs')}{filename}_{i:04d}{ext}")
-            np.save(
-                f"{prepro_train_path}{filename}_{i:04d}.npy",
-                lsi.label,
-            )
-            # Get mean and std of an image
-            metrics["mean"].append(np.mean(lsi.satellite_image.array, axis=(1, 2)))
-            metrics["std"].append(np.std(lsi.satellite_image.array, axis=(1, 2)))
-
-    return metrics
+        skipped_bytes = 0
+    return {
+        "tiles": len(grid),
+        "rejected_tiles": statistics["roi"]["rejected"] + statistics["prefilter"]["rejected"],
+        "skipped_image": int(skipped_image),
+        "skipped_bytes": int(skipped_bytes),
+    }
@@ -0,0 +1,626 @@
+import json
+import multiprocessing
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import geopandas as gpd
+import rasterio
+import yaml
+from affine import Affine
+from astrovision.data.utils import generate_tiles_borders
+from pqdm.processes import pqdm
+
+from classes.filters.filter_chain import FilterChain
+from classes.profilers.profiler import Profiler
+from classes.statistics.band_statistics import BandStatistics
+from classes.tile_tensors.tile_tensor import TileTensor
+from functions.download_data import get_raw_images, get_roi
+from functions.image_utils import get_images_grids, get_images_profiles, get_roi_extent
+from functions.labelling import get_labeler
+from functions.manifest import get_images_fingerprints, is_up_to_date, read_records, remove_tiles, update_record, verify_records
+from functions.process_images import (
+    BLACK_PARAMETERS,
+    CLOUD_PARAMETERS,
+    PREFILTER_PARAMETERS,
+    init_worker,
+    process_job_image,
+)
+from functions.tile_index import write_index
+from utils.mappings import name_dep_to_crs
+
+# Optional arguments of a run, see `preprocess-satellite-images.py`
+RUN_DEFAULTS = {
+    "label_raster": False,
+    "lazy_labels": False,
+    "windowed": False,
+    "prefilter": False,
+    "output": "files",
+    "sampling": None,
+    "encoding": None,
+}
+
+# Arguments of a run identifying its output directories
+OUTPUT_ARGUMENTS = ["type_labeler", "task", "source", "dep", "year"]
+
+
+def get_sizes(tiles_size: str) -> List[int]:
+    """
+    Parse tile sizes separated by commas, e.g. "250,500".
+    """
+    return [int(size) for size in str(tiles_size).split(",")]
+
+
+def get_outputs(
+    type_labeler: str,
+    task: str,
+    source: str,
+    dep: str,
+    year: str,
+    n_bands: int,
+    sizes: List[int],
+    prefilter: bool = False,
+    output: str = "files",
+    sampling: Optional[Dict] = None,
+    encoding: Optional[Dict] = None,
+) -> Dict[str, List]:
+    """
+    Create the output directories of a run and return, for each tile size, its
+    label directories, its manifest directory and the parameters of its records.
+
+    Args:
+        type_labeler (str): Labeler.
+        task (str): Task.
+        source (str): Source of the images.
+        dep (str): Department.
+        year (str): Year.
+        n_bands (int): Number of bands.
+        sizes (List[int]): Tile sizes.
+        prefilter (bool): If True, the tiles are prefiltered.
+        output (str): Layout of the tiles, see `get_tile_writer`.
+        sampling (Optional[Dict]): Parameters of the sampling of the tiles, see `load_sampling`.
+        encoding (Optional[Dict]): Encoding profile of the tiles, see `load_encoding`.
+
+    Returns:
+        Dict[str, List]: Lists "prepro_test_path", "prepro_train_path",
+            "manifest_dir", "index_dir" and "parameters", aligned with `sizes`,
+            as expected by `process_single_image` and `process_image`.
+    """
+    outputs = {"prepro_test_path": [], "prepro_train_path": [], "manifest_dir": [], "index_dir": [], "parameters": []}
+    for size in sizes:
+        prepro_test_path = f"data/data-preprocessed/labels/{type_labeler}/{task}/{source}/{dep}/{year}/{size}/test/"
+        prepro_train_path = f"data/data-preprocessed/labels/{type_labeler}/{task}/{source}/{dep}/{year}/{size}/train/"
+        # Creating empty directories for train and test data
+        os.makedirs(
+            prepro_test_path,
+            exist_ok=True,
+        )
+        os.makedirs(
+            prepro_train_path,
+            exist_ok=True,
+        )
+
+        # Each processed image has a record in the manifest: images whose input and parameters are unchanged are skipped
+        manifest_dir = f"data/data-preprocessed/manifests/{type_labeler}/{task}/{source}/{dep}/{year}/{size}/"
+        os.makedirs(manifest_dir, exist_ok=True)
+        # Each processed image writes its part of the tile index, merged at the end of the run
+        index_dir = f"data/data-preprocessed/index/{type_labeler}/{task}/{source}/{dep}/{year}/{size}/"
+        os.makedirs(index_dir, exist_ok=True)
+        parameters = {
+            "type_labeler": type_labeler,
+            "task": task,
+            "tiles_size": size,
+            "n_bands": int(n_bands),
+            "cloud": CLOUD_PARAMETERS,
+            "black": BLACK_PARAMETERS,
+        }
+        if prefilter:
+            # Tiles discarded by the prefilter are not saved: records made without it are not up to date
+            parameters["prefilter"] = PREFILTER_PARAMETERS
+        if output != "files":
+            # Records of tiles written in another layout are not up to date
+            parameters["output"] = output
+        if sampling is not None:
+            # Tiles dropped by the sampling are not saved: records made with other parameters are not up to date
+            parameters["sampling"] = sampling
+        if encoding is not None:
+            # Tiles encoded with another profile are not up to date
+            parameters["encoding"] = encoding
+
+        outputs["prepro_test_path"].append(prepro_test_path)
+        outputs["prepro_train_path"].append(prepro_train_path)
+        outputs["manifest_dir"].append(manifest_dir)
+        outputs["index_dir"].append(index_dir)
+        # Parameters as read back from the records (e.g. class keys of the quotas become strings), so that they compare equal
+        outputs["parameters"].append(json.loads(json.dumps(parameters)))
+    return outputs
+
+
+def get_pending_images(
+    images: List[str], fingerprints: Dict[str, Dict], outputs: Dict[str, List], verify: bool = False
+) -> List[str]:
+    """
+    Return the images to process, and remove the tiles they have from a
+    previous run. An image is processed again for all the tile sizes if its
+    record of any size is not up to date.
+
+    Args:
+        images (List[str]): Paths of the raw images.
+        fingerprints (Dict[str, Dict]): Fingerprints of the raw images.
+        outputs (Dict[str, List]): Outputs of the run, as returned by `get_outputs`.
+        verify (bool): If True, the tiles of every record must also be present.
+
+    Returns:
+        List[str]: Paths of the images to process.
+    """
+    pending = set()
+    for manifest_dir, parameters in zip(outputs["manifest_dir"], outputs["parameters"]):
+        records = read_records(manifest_dir, images)
+        verified = verify_records(records) if verify else dict.fromkeys(records, True)
+        pending.update(
+            im
+            for im in images
+            if not (im in records and verified[im] and is_up_to_date(records[im], fingerprints[im], parameters))
+        )
+    pending = [im for im in images if im in pending]
+    for manifest_dir in outputs["manifest_dir"]:
+        records = read_records(manifest_dir, pending)
+        for im in pending:
+            if im in records:
+                remove_tiles(records[im])
+    return pending
+
+
+def get_mp_context() -> Optional[multiprocessing.context.BaseContext]:
+    """
+    Fork lets workers share the labeling data copy-on-write with the parent.
+    """
+    return multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+
+
+def load_sampling(profile: Optional[str], task: str) -> Optional[Dict]:
+    """
+    Load the parameters of a sampling profile of `src/config/sampling.yaml`,
+    None if no profile is given. Tiles are sampled from segmentation labels only.
+    """
+    if profile is None:
+        return None
+    if task != "segmentation":
+        raise ValueError("Tiles can only be sampled for the segmentation task.")
+    with open("src/config/sampling.yaml", "r") as file:
+        profiles = yaml.load(file, Loader=yaml.FullLoader)
+    if profile not in profiles:
+        raise ValueError(f"Unknown sampling profile {profile}, expected one of {', '.join(profiles)}.")
+    return profiles[profile]
+
+
+def load_encoding(profile: Optional[str], output: str) -> Optional[Dict]:
+    """
+    Load an encoding profile of `src/config/encodings.yaml`, None if no profile
+    is given. Tiles of the "tensors" output are not encoded.
+    """
+    if profile is None:
+        return None
+    if output == "tensors":
+        raise ValueError("Tiles of the tensors output are stored raw, without encoding.")
+    with open("src/config/encodings.yaml", "r") as file:
+        profiles = yaml.load(file, Loader=yaml.FullLoader)
+    if profile not in profiles:
+        raise ValueError(f"Unknown encoding profile {profile}, expected one of {', '.join(profiles)}.")
+    return profiles[profile]
+
+
+def load_bbox_test() -> Dict:
+    """
+    Load the test boxes configuration.
+    """
+    with open("src/config/bb_test.yaml", "r") as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def write_metrics(images: List[str], sizes: List[int], outputs: Dict[str, List], prefilter: bool = False):
+    """
+    Rebuild the normalization statistics of each tile size from the records of
+    all the images, processed by this run or not, and print the statistics of
+    the filters.
+
+    Args:
+        images (List[str]): Paths of the raw images.
+        sizes (List[int]): Tile sizes.
+        outputs (Dict[str, List]): Outputs of the run, as returned by `get_outputs`.
+        prefilter (bool): If True, print the prefilter reports.
+    """
+    for size, manifest_dir, parameters, prepro_train_path in zip(
+        sizes, outputs["manifest_dir"], outputs["parameters"], outputs["prepro_train_path"]
+    ):
+        records = read_records(manifest_dir, images)
+        filters = FilterChain.merge_statistics([record["filters"] for record in records.values() if "filters" in record])
+        for name, statistics in filters.items():
+            print(
+                f"Tuiles de {size} px, filtre {name} : {statistics['rejected']}/{statistics['tiles']} tuiles écartées "
+                f"en {statistics['time']:.1f}s"
+            )
+        if prefilter:
+            reports = [record["prefilter"] for record in records.values() if "prefilter" in record]
+            totals = {key: sum(report[key] for report in reports) for key in ["skipped_image", "rejected_tiles", "tiles"]}
+            print(
+                f"Tuiles de {size} px, préfiltre : {totals['skipped_image']}/{len(reports)} images non décodées, "
+                f"{totals['rejected_tiles']}/{totals['tiles']} tuiles écartées, "
+                f"{sum(report['skipped_bytes'] for report in reports) / 2**30:.1f} Gio non lus"
+            )
+        metrics = BandStatistics.merge_all(
+            [
+                BandStatistics.from_record(record["statistics"])
+                for record in records.values()
+                if record["parameters"] == parameters
+            ]
+        ).to_dict()
+
+        os.makedirs(prepro_train_path.replace("labels", "patchs"), exist_ok=True)
+        with open(f"{prepro_train_path.replace('labels', 'patchs')}metrics-normalization.yaml", "w") as f:
+            yaml.dump(metrics, f, default_flow_style=False)
+
+
+def reserve_tensor_rows(
+    pending: List[str],
+    profiles: Dict[str, Tuple[str, Affine, int, int]],
+    sizes: List[int],
+    outputs: Dict[str, List],
+    n_bands: int,
+    from_s3: bool,
+) -> List[Dict[str, Tuple[int, int]]]:
+    """
+    Reserve, before the workers are forked, the rows of the tensors of the
+    "tensors" output where each pending image writes its tiles: one row per
+    tile of its grid, at the same rows in the test and train tensors since
+    the split of a tile is only known once it is processed.
+
+    Args:
+        pending (List[str]): Paths of the images to process.
+        profiles (Dict[str, Tuple[str, Affine, int, int]]): CRS, transform,
+            width and height of the images, by image path.
+        sizes (List[int]): Tile sizes.
+        outputs (Dict[str, List]): Outputs of the run, as returned by `get_outputs`.
+        n_bands (int): Number of bands.
+        from_s3 (bool): True if the images are read from S3.
+
+    Returns:
+        List[Dict[str, Tuple[int, int]]]: For each tile size, first and last
+            (exclusive) rows of each image, as expected by `process_single_image`.
+    """
+    # Images of a run share the dtype of the first one, checked when their tiles are written
+    with rasterio.open(f"/vsis3/{pending[0]}" if int(from_s3) else pending[0]) as src:
+        dtype = src.dtypes[0]
+
+    rows = []
+    for size, prepro_test_path, prepro_train_path in zip(sizes, outputs["prepro_test_path"], outputs["prepro_train_path"]):
+        tensors = []
+        for prepro_path in (prepro_test_path, prepro_train_path):
+            directory = prepro_path.replace("labels", "tensors")
+            tensor = TileTensor.from_header(directory)
+            if tensor is None:
+                tensor = TileTensor(directory, (int(n_bands), size, size), dtype)
+                tensor.write_header([])
+            elif tensor.tile_shape != (int(n_bands), size, size) or tensor.dtype != dtype:
+                raise ValueError(f"Tiles of {directory} have another shape or dtype, remove the directory to write them again.")
+            tensors.append(tensor)
+
+        counts = [len(generate_tiles_borders(profiles[im][3], profiles[im][2], size)) for im in pending]
+        start = max(len(tensor) for tensor in tensors)
+        for tensor in tensors:
+            tensor.reserve(sum(counts), start)
+        size_rows = {}
+        for im, count in zip(pending, counts):
+            size_rows[im] = (start, start + count)
+            start += count
+        rows.append(size_rows)
+    return rows
+
+
+def write_tensors(images: List[str], sizes: List[int], outputs: Dict[str, List]):
+    """
+    Compact the tensors of the "tensors" output once the images are processed:
+    rows of rejected tiles, of failed images, and of images processed again are
+    removed, and the table of the tiles of each row is written to the header.
+    Records are updated with the new rows of their tiles.
+
+    Args:
+        images (List[str]): Paths of the raw images.
+        sizes (List[int]): Tile sizes.
+        outputs (Dict[str, List]): Outputs of the run, as returned by `get_outputs`.
+    """
+    for size, manifest_dir, prepro_test_path, prepro_train_path in zip(
+        sizes, outputs["manifest_dir"], outputs["prepro_test_path"], outputs["prepro_train_path"]
+    ):
+        records = read_records(manifest_dir, images)
+        for prepro_path in (prepro_test_path, prepro_train_path):
+            tensor = TileTensor.from_header(prepro_path.replace("labels", "tensors"))
+            if tensor is None:
+                continue
+            reserved = len(tensor)
+            entries = sorted(
+                (
+                    (tile["row"], record, tile)
+                    for record in records.values()
+                    for tile in record["tiles"]
+                    if "row" in tile and tile["image"] == tensor.images_path
+                ),
+                key=lambda entry: entry[0],
+            )
+            tensor.compact([row for row, _, _ in entries])
+            table = []
+            for row, (_, record, tile) in enumerate(entries):
+                tile["row"] = row
+                table.append(
+                    {
+                        "name": tile["key"],
+                        "image": record["image"],
+                        "crs": tile["crs"],
+                        "bounds": tile["bounds"],
+                        "transform": tile["transform"],
+                    }
+                )
+            tensor.write_header(table)
+            print(
+                f"Tuiles de {size} px, tenseur {os.path.basename(os.path.normpath(prepro_path))} : {len(table)} tuiles, "
+                f"{reserved - len(table)} lignes libérées"
+            )
+        for record in records.values():
+            if any("row" in tile for tile in record["tiles"]):
+                update_record(manifest_dir, record)
+
+
+def group_runs(runs: List[Dict]) -> List[Dict]:
+    """
+    Merge the runs of a batch writing to the same directories, i.e. only
+    differing by their tile sizes or by how images and labels are read, so
+    that their images are read, labeled and cloud-masked once for all the
+    sizes.
+
+    Args:
+        runs (List[Dict]): Arguments of each run, as for `main` of
+            `preprocess-satellite-images.py` (without the pool arguments).
+
+    Returns:
+        List[Dict]: Merged runs ("jobs"), with the list of their tile sizes
+            as "sizes" and their number of runs as "runs".
+    """
+    jobs = {}
+    for run in runs:
+        run = {**RUN_DEFAULTS, **run}
+        key = tuple(str(run[name]) for name in OUTPUT_ARGUMENTS)
+        if key not in jobs:
+            jobs[key] = {**{name: value for name, value in run.items() if name != "tiles_size"}, "sizes": [], "runs": 0}
+        job = jobs[key]
+        if (int(job["n_bands"]), bool(job["prefilter"]), job["output"], job["sampling"], job["encoding"]) != (
+            int(run["n_bands"]),
+            bool(run["prefilter"]),
+            run["output"],
+            run["sampling"],
+            run["encoding"],
+        ):
+            raise ValueError(
+                f"Runs writing to {'/'.join(key)} should have the same number of bands, prefilter, output, sampling and encoding."
+            )
+        for name in ["label_raster", "lazy_labels", "windowed"]:
+            # These only change how images and labels are read, not the tiles
+            job[name] = bool(job[name]) or bool(run[name])
+        job["sizes"] = sorted(set(job["sizes"]) | set(get_sizes(run["tiles_size"])))
+        job["runs"] += 1
+    return list(jobs.values())
+
+
+def build_context(
+    job: Dict,
+    listing: Dict,
+    profiles: List[Tuple[str, Affine, int, int]],
+    roi: gpd.GeoDataFrame,
+    bbox_test: Dict,
+    run: Optional[str] = None,
+) -> Dict:
+    """
+    Arguments shared by the tasks of a job, sent once to each worker. The
+    trace directory and the rows of the tensors of the job are also set in
+    `job`, under "trace_dir" and "rows".
+
+    Args:
+        job (Dict): Job, see `group_runs`, with its "name", "outputs",
+            "pending" images and "labeler".
+        listing (Dict): "images" and "fingerprints" of the raw images of the job.
+        profiles (List[Tuple[str, Affine, int, int]]): Profiles of the images, see `get_images_profiles`.
+        roi (gpd.GeoDataFrame): ROI of the department.
+        bbox_test (Dict): Test boxes, see `load_bbox_test`.
+        run (Optional[str]): Name of the trace directory of the run, None to disable profiling.
+
+    Returns:
+        Dict: Context of the job, see `init_worker`.
+    """
+    # Per-stage measures of each image are written to a trace directory, one per job and run
+    job["trace_dir"] = None
+    if run is not None:
+        job["trace_dir"] = f"data/data-preprocessed/profiles/{job['name']}/{'-'.join(map(str, job['sizes']))}/{run}/traces/"
+        os.makedirs(job["trace_dir"], exist_ok=True)
+    # Each image writes its tiles to its own rows of the tensors, reserved before the workers are forked
+    job["rows"] = None
+    if job["output"] == "tensors":
+        job["rows"] = reserve_tensor_rows(
+            job["pending"],
+            dict(zip(listing["images"], profiles)),
+            job["sizes"],
+            job["outputs"],
+            job["n_bands"],
+            job["from_s3"],
+        )
+    return {
+        "from_s3": job["from_s3"],
+        "n_bands": job["n_bands"],
+        "labeler": job["labeler"],
+        "tiles_size": job["sizes"],
+        "source": job["source"],
+        "roi": roi,
+        "bbox_test": bbox_test,
+        "name_dep_to_crs": name_dep_to_crs,
+        "dep": job["dep"],
+        "windowed": job["windowed"],
+        "prefilter": job["prefilter"],
+        "output": job["output"],
+        "rows": job["rows"],
+        "sampling": job["sampling"],
+        "encoding": job["encoding"],
+        "fingerprints": listing["fingerprints"],
+        "trace_dir": job["trace_dir"],
+        **job["outputs"],
+    }
+
+
+def finish_run(images: List[str], sizes: List[int], outputs: Dict[str, List], prefilter: bool, output: str):
+    """
+    Write the outputs gathering all the images, processed by this run or not,
+    once the workers are done: the compacted tensors, the tile index and the
+    normalization statistics.
+
+    Args:
+        images (List[str]): Paths of the raw images.
+        sizes (List[int]): Tile sizes.
+        outputs (Dict[str, List]): Outputs of the run, as returned by `get_outputs`.
+        prefilter (bool): If True, print the prefilter reports.
+        output (str): Output of the tiles, "files", "shards" or "tensors".
+    """
+    if output == "tensors":
+        # Rows left unused by the workers are removed, the tiles of all the images being contiguous
+        write_tensors(images, sizes, outputs)
+    # Tile index of all the images, from the parts written by the workers
+    write_index(images, sizes, outputs)
+    # Normalization statistics are rebuilt from the records of all the images
+    write_metrics(images, sizes, outputs, prefilter)
+
+
+def run_jobs(jobs: List[Dict], max_workers: int = 30, verify: bool = False, profile: bool = False) -> Dict[str, int]:
+    """
+    Process the pending images of jobs in a single process pool. Image
+    listings, ROIs and labelers are loaded once and shared by the jobs which
+    need them, before the workers are forked.
+
+    Args:
+        jobs (List[Dict]): Jobs, see `group_runs`.
+        max_workers (int): Number of worker processes.
+        verify (bool): If True, check that the tiles recorded in the manifest exist.
+        profile (bool): If True, measure each processing stage and write a report per job.
+
+    Returns:
+        Dict[str, int]: Number of image listings, ROIs and labelers loaded.
+    """
+    print("\n*** 1- Récupération des données...\n")
+    listings = {}
+    for job in jobs:
+        job["name"] = f"{job['type_labeler']}/{job['task']}/{job['source']}/{job['dep']}/{job['year']}"
+        job["listing"] = (int(job["from_s3"]), job["source"], job["dep"], str(job["year"]))
+        job["sampling"] = load_sampling(job["sampling"], job["task"])
+        job["encoding"] = load_encoding(job["encoding"], job["output"])
+        if job["listing"] not in listings:
+            images = get_raw_images(*job["listing"])
+            listings[job["listing"]] = {"images": images, "fingerprints": get_images_fingerprints(images, job["from_s3"])}
+        listing = listings[job["listing"]]
+
+        job["outputs"] = get_outputs(
+            job["type_labeler"],
+            job["task"],
+            job["source"],
+            job["dep"],
+            job["year"],
+            job["n_bands"],
+            job["sizes"],
+            job["prefilter"],
+            job["output"],
+            job["sampling"],
+            job["encoding"],
+        )
+        job["pending"] = get_pending_images(listing["images"], listing["fingerprints"], job["outputs"], verify)
+        print(
+            f"{job['name']} : {len(listing['images']) - len(job['pending'])} images à jour, "
+            f"{len(job['pending'])} images à traiter"
+        )
+
+    active = [job for job in jobs if job["pending"]]
+    profiles, rois, labelers = {}, {}, {}
+    if active:
+        print("\n*** 2- Téléchargement des bases d'annotation...\n")
+        for job in active:
+            # CRS and grids of all the images are read from their headers, label rasters cover the whole department
+            if job["listing"] not in profiles:
+                profiles[job["listing"]] = get_images_profiles(listings[job["listing"]]["images"], job["from_s3"])
+            # Import ROI borders, labeling data is only loaded around the ROI
+            if job["dep"] not in rois:
+                rois[job["dep"]] = get_roi(job["dep"])
+
+        # A labeler is shared by the jobs of its department and year, whatever the source of their images
+        labeler_jobs = {}
+        for job in active:
+            key = (job["type_labeler"], str(job["year"]), job["dep"], job["task"], job["lazy_labels"], job["label_raster"])
+            labeler_jobs.setdefault(key, []).append(job)
+        for (type_labeler, year, dep, task, lazy_labels, label_raster), shared_jobs in labeler_jobs.items():
+            shared_profiles = [profile for listing in {job["listing"] for job in shared_jobs} for profile in profiles[listing]]
+            # Labeling data is reprojected once, before the workers are forked, in every CRS of the images
+            labeler = get_labeler(
+                type_labeler,
+                year,
+                dep,
+                task,
+                crs_list=sorted({profile[0] for profile in shared_profiles}),
+                extent=get_roi_extent(rois[dep], shared_profiles),
+                lazy=lazy_labels,
+            )
+            if label_raster:
+                # Labels are rasterized once for the whole department and then read by window
+                labeler.build_label_rasters(
+                    get_images_grids(shared_profiles), f"data/data-label-raster/{type_labeler}/{dep}/{year}/"
+                )
+            for job in shared_jobs:
+                job["labeler"] = labeler
+            labelers[(type_labeler, year, dep, task, lazy_labels, label_raster)] = labeler
+
+        print("\n*** 3- Annotation, découpage et filtrage des images...\n")
+
+        # Load bbox_test configuration
+        bbox_test = load_bbox_test()
+
+        # Shared arguments of each job are sent once to each worker, tasks only carry the job and the image path
+        run = datetime.now().strftime("%Y%m%d-%H%M%S") if profile else None
+        contexts = {
+            job["name"]: build_context(job, listings[job["listing"]], profiles[job["listing"]], rois[job["dep"]], bbox_test, run)
+            for job in active
+        }
+
+        # All the images of all the jobs share a single pool
+        tasks = [(job["name"], im) for job in active for im in job["pending"]]
+        if max_workers == 1:
+            # pqdm runs the tasks in this process, without the initializer
+            init_worker({"jobs": contexts})
+        result = pqdm(
+            tasks,
+            process_job_image,
+            n_jobs=max_workers,
+            initializer=init_worker,
+            initargs=({"jobs": contexts},),
+            mp_context=get_mp_context(),
+        )
+
+        if profile:
+            for job in active:
+                # Measures aggregated across workers, next to the traces
+                report = Profiler.write_report(job["trace_dir"])
+                for name, stage in report.items():
+                    print(
+                        f"{job['name']}, {name}: {stage['wall_time']:.1f}s wall, {stage['cpu_time']:.1f}s CPU, "
+                        f"{stage['peak_rss'] / 2**20:.0f} MiB peak"
+                    )
+
+        failures = [task for task, entry in zip(tasks, result) if isinstance(entry, Exception)]
+        if failures:
+            print(f"{len(failures)} images en échec, elles seront traitées à la prochaine exécution")
+
+    for job in jobs:
+        print(f"\n{job['name']} :")
+        finish_run(listings[job["listing"]]["images"], job["sizes"], job["outputs"], job["prefilter"], job["output"])
+
+    return {"listings": len(listings), "rois": len(rois), "labelers": len(labelers)}
@@ -0,0 +1,100 @@
+import os
+from typing import Dict, List
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely import Geometry
+
+from classes.tile_views.tile_view import TileView
+from functions.manifest import read_records
+
+
+def get_index_row(tile: TileView, name: str, entry: Dict, footprint: Geometry, scores: Dict[str, float]) -> Dict:
+    """
+    Row of the tile index of a saved tile.
+
+    Args:
+        tile (TileView): The tile.
+        name (str): Name of the tile.
+        entry (Dict): Manifest entry of the tile, as returned by `TileWriter.write`.
+        footprint (Geometry): Box of the tile, in the CRS of the image.
+        scores (Dict[str, float]): Scores of the filters, see `FilterChain.score_tile`.
+
+    Returns:
+        Dict: Name, split, output path, CRS, footprint, scores and, for
+            segmentation labels, number of pixels of each class under "class_{k}".
+    """
+    row = {"name": name, "split": entry["split"], "path": entry["image"], "crs": tile.crs, "geometry": footprint, **scores}
+    label = tile.label
+    if isinstance(label, np.ndarray) and label.ndim == 2:
+        counts = np.bincount(label.ravel())
+        row.update({f"class_{k}": int(count) for k, count in enumerate(counts) if count})
+    return row
+
+
+def get_part_path(index_dir: str, im: str) -> str:
+    """
+    Return the path of the part of the tile index written for a raw image.
+    """
+    return os.path.join(index_dir, "parts", f"{os.path.basename(im)}.parquet")
+
+
+def sort_class_columns(index: pd.DataFrame) -> pd.DataFrame:
+    """
+    Put the class columns last, in class order, and count missing classes as 0 pixels.
+    """
+    classes = sorted((column for column in index.columns if column.startswith("class_")), key=lambda c: int(c[6:]))
+    index[classes] = index[classes].fillna(0).astype("int64")
+    return index[[column for column in index.columns if column not in classes] + classes]
+
+
+def write_index_part(index_dir: str, im: str, rows: List[Dict]):
+    """
+    Write the rows of the tile index of a processed raw image as a GeoParquet
+    file, atomically. A worker writes the part of each of its images, parts
+    are merged by `write_index` at the end of the run.
+
+    Args:
+        index_dir (str): Directory of the tile index.
+        im (str): Path of the raw image.
+        rows (List[Dict]): Rows of the saved tiles, see `get_index_row`.
+    """
+    path = get_part_path(index_dir, im)
+    if not rows:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = gpd.GeoDataFrame(rows, geometry="geometry", crs=rows[0]["crs"])
+    part.insert(0, "image", im)
+    sort_class_columns(part).to_parquet(f"{path}.tmp", index=False, write_covering_bbox=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_index(images: List[str], sizes: List[int], outputs: Dict[str, List]):
+    """
+    Merge the parts of the tile index of each tile size into `tiles.parquet`,
+    from the images having a record, processed by this run or not. Footprints
+    are reprojected in the CRS of the first part, the CRS of the image of each
+    tile being kept in the "crs" column.
+
+    Args:
+        images (List[str]): Paths of the raw images.
+        sizes (List[int]): Tile sizes.
+        outputs (Dict[str, List]): Outputs of the run, as returned by `get_outputs`.
+    """
+    for size, manifest_dir, index_dir in zip(sizes, outputs["manifest_dir"], outputs["index_dir"]):
+        records = read_records(manifest_dir, images)
+        parts = [
+            gpd.read_parquet(get_part_path(index_dir, im))
+            for im in images
+            if im in records and os.path.exists(get_part_path(index_dir, im))
+        ]
+        if not parts:
+            continue
+        index = gpd.GeoDataFrame(pd.concat([part.to_crs(parts[0].crs) for part in parts], ignore_index=True), crs=parts[0].crs)
+        path = os.path.join(index_dir, "tiles.parquet")
+        sort_class_columns(index).to_parquet(f"{path}.tmp", index=False, write_covering_bbox=True)
+        os.replace(f"{path}.tmp", path)
+        print(f"Tuiles de {size} px, index : {len(index)} tuiles dans {path}")
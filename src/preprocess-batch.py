@@ -0,0 +1,70 @@
+import argparse
+
+import yaml
+from osgeo import gdal
+
+from functions.run_utils import group_runs, run_jobs
+
+gdal.UseExceptions()
+
+
+def main(
+    config_path: str,
+    max_workers: int = 30,
+    verify: bool = False,
+    profile: bool = False,
+):
+    """
+    Run a batch of preprocessing configurations in a single process pool.
+
+    Runs writing to the same directories are merged into one job producing
+    all their tile sizes. Image listings, ROIs and labelers are loaded once
+    and shared by the jobs which need them, before the workers are forked.
+    """
+    with open(config_path, "r") as file:
+        runs = yaml.load(file, Loader=yaml.FullLoader)["runs"]
+    jobs = group_runs(runs)
+
+    loaded = run_jobs(jobs, max_workers, verify, profile)
+
+    # Work shared by the runs, compared with one run per configuration and tile size
+    active_runs = sum(job["runs"] for job in jobs if job["pending"])
+    summary = {
+        "runs": len(runs),
+        "jobs": len(jobs),
+        "listings": loaded["listings"],
+        "rois": loaded["rois"],
+        "rois_without_batch": active_runs,
+        "labelers": loaded["labelers"],
+        "labelers_without_batch": active_runs,
+        "saved_decodes": sum(len(job["pending"]) * (len(job["sizes"]) - 1) for job in jobs),
+    }
+    print(
+        f"\nOrdonnancement : {summary['runs']} configurations regroupées en {summary['jobs']} traitements dans un seul pool, "
+        f"{summary['listings']} listages d'images au lieu de {summary['runs']}, "
+        f"{summary['rois']} ROI au lieu de {summary['rois_without_batch']}, "
+        f"{summary['labelers']} bases d'annotation au lieu de {summary['labelers_without_batch']}, "
+        f"{summary['saved_decodes']} décodages d'images évités"
+    )
+
+    print("\n*** 4- Preprocessing terminé !\n")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocessing of satellite images, for a batch of configurations")
+    parser.add_argument("config_path", type=str, help="YAML file listing the runs (e.g., 'src/config/batch.yaml')")
+    parser.add_argument("--max_workers", type=int, default=30, help="Number of worker processes")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check that the tiles of the images recorded in the manifest exist, and process again those with missing tiles",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Measure the time, I/O and memory of each processing stage and write a report",
+    )
+    args = parser.parse_args()
+
+    main(**vars(args))
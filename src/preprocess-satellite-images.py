@@ -1,15 +1,9 @@
-import os
-import sys
+import argparse
+from typing import Optional
 
-import numpy as np
-import yaml
 from osgeo import gdal
-from pqdm.processes import pqdm
 
-from functions.download_data import get_raw_images, get_roi
-from functions.labelling import get_labeler
-from functions.process_images import process_single_image
-from utils.mappings import name_dep_to_crs
+from functions.run_utils import group_runs, run_jobs
 
 gdal.UseExceptions()
 
@@ -21,88 +15,110 @@ def main(
     n_bands: int,
     type_labeler: str,
     task: str,
-    tiles_size: int,
+    tiles_size: str,
     from_s3: bool,
+    label_raster: bool = False,
+    lazy_labels: bool = False,
+    windowed: bool = False,
+    max_workers: int = 30,
+    verify: bool = False,
+    profile: bool = False,
+    prefilter: bool = False,
+    output: str = "files",
+    sampling: Optional[str] = None,
+    encoding: Optional[str] = None,
 ):
     """
-    Main method.
+    Main method: a batch of a single job, see `preprocess-batch.py`.
     """
-
-    print("\n*** 1- Téléchargement de la base d'annotation...\n")
-    labeler = get_labeler(type_labeler, year, dep, task)
-
-    print("\n*** 2- Récupération des données...\n")
-    images = get_raw_images(from_s3, source, dep, year)
-
-    prepro_test_path = f"data/data-preprocessed/labels/{type_labeler}/{task}/{source}/{dep}/{year}/{tiles_size}/test/"
-    prepro_train_path = f"data/data-preprocessed/labels/{type_labeler}/{task}/{source}/{dep}/{year}/{tiles_size}/train/"
-    # Creating empty directories for train and test data
-    os.makedirs(
-        prepro_test_path,
-        exist_ok=True,
-    )
-    os.makedirs(
-        prepro_train_path,
-        exist_ok=True,
-    )
-
-    print("\n*** 3- Annotation, découpage et filtrage des images...\n")
-
-    # Import ROI borders
-    roi = get_roi(dep)
-
-    # Instanciate a dict of metrics for normalization
-    metrics = {
-        "mean": [],
-        "std": [],
-    }
-
-    # Load bbox_test configuration
-    with open("src/config/bb_test.yaml", "r") as file:
-        bbox_test = yaml.load(file, Loader=yaml.FullLoader)
-
-    max_workers = 30
-    # Use pqdm for parallelization
-    args = [
-        [
-            im,
-            from_s3,
-            n_bands,
-            labeler,
-            tiles_size,
-            source,
-            roi,
-            bbox_test,
-            name_dep_to_crs,
-            dep,
-            prepro_test_path,
-            prepro_train_path,
-        ]
-        for im in images
-    ]
-    result = pqdm(args, process_single_image, n_jobs=max_workers, argument_type="args")
-
-    metrics = {
-        key: np.mean(np.stack([array for entry in result if entry[key] for array in entry[key]]), axis=0).tolist()
-        if any(entry[key] for entry in result)
-        else None
-        for key in ["mean", "std"]
+    run = {
+        "source": source,
+        "dep": dep,
+        "year": year,
+        "n_bands": n_bands,
+        "type_labeler": type_labeler,
+        "task": task,
+        "tiles_size": tiles_size,
+        "from_s3": from_s3,
+        "label_raster": label_raster,
+        "lazy_labels": lazy_labels,
+        "windowed": windowed,
+        "prefilter": prefilter,
+        "output": output,
+        "sampling": sampling,
+        "encoding": encoding,
     }
-
-    with open(f"{prepro_train_path.replace('labels', 'patchs')}metrics-normalization.yaml", "w") as f:
-        yaml.dump(metrics, f, default_flow_style=False)
+    run_jobs(group_runs([run]), max_workers, verify, profile)
 
     print("\n*** 4- Preprocessing terminé !\n")
 
 
 if __name__ == "__main__":
-    main(
-        str(sys.argv[1]),
-        str(sys.argv[2]),
-        str(sys.argv[3]),
-        str(sys.argv[4]),
-        str(sys.argv[5]),
-        str(sys.argv[6]),
-        str(sys.argv[7]),
-        str(sys.argv[8]),
+    parser = argparse.ArgumentParser(description="Preprocessing of satellite images")
+    parser.add_argument("source", type=str, help="Source of the images (e.g., 'PLEIADES')")
+    parser.add_argument("dep", type=str, help="Department (e.g., 'MAYOTTE')")
+    parser.add_argument("year", type=str, help="Year (e.g., '2020')")
+    parser.add_argument("n_bands", type=str, help="Number of bands")
+    parser.add_argument("type_labeler", type=str, help="Labeler ('BDTOPO' or 'COSIA')")
+    parser.add_argument("task", type=str, help="Task ('segmentation' or 'detection')")
+    parser.add_argument("tiles_size", type=str, help="Tile size in pixels, or sizes separated by commas (e.g., '250,500')")
+    parser.add_argument("from_s3", type=str, help="1 to read the images from S3, 0 to download them")
+    parser.add_argument(
+        "--label_raster",
+        action="store_true",
+        help="Rasterize the labels of the department once and read them by window (segmentation only)",
+    )
+    parser.add_argument(
+        "--lazy_labels",
+        action="store_true",
+        help="Index the labeling files by extent and read them only when an image intersects them (COSIA only)",
+    )
+    parser.add_argument(
+        "--windowed",
+        action="store_true",
+        help="Read, label and save the images tile by tile instead of loading them whole",
+    )
+    parser.add_argument("--max_workers", type=int, default=30, help="Number of worker processes")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check that the tiles of the images recorded in the manifest exist, and process again those with missing tiles",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Measure the time, I/O and memory of each processing stage and write a report",
     )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Discard the tiles, or whole images, outside the ROI or certain to be black from an overview before reading them",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        choices=["files", "shards", "tensors"],
+        default="files",
+        help=(
+            "Write an image and a label file per tile, tar shards of tiles per image and split, "
+            "or a memory-mapped tensor per split"
+        ),
+    )
+    parser.add_argument(
+        "--sampling",
+        type=str,
+        default=None,
+        help=(
+            "Sample the tiles from their label with a profile of src/config/sampling.yaml (e.g., 'bdtopo', segmentation only), "
+            "class quotas being counted per image"
+        ),
+    )
+    parser.add_argument(
+        "--encoding",
+        type=str,
+        default=None,
+        help="Encode the tiles with a profile of src/config/encodings.yaml (e.g., 'zstd'), instead of float64 GeoTIFF and .npy",
+    )
+    args = parser.parse_args()
+
+    main(**vars(args))